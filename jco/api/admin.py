@@ -12,9 +12,9 @@ from django.utils.safestring import mark_safe
 from django.http import HttpResponse
 from django.contrib.admin import SimpleListFilter
 from django.utils import timezone
+from django.db import transaction
 
 
-from rest_framework.authtoken.models import Token
 from allauth.account.models import EmailAddress
 
 from jco.api.models import (
@@ -27,11 +27,13 @@ from jco.api.models import (
     Transaction,
     UserJntPrice,
     Withdraw,
+    refresh_raised_tokens_cache,
 )
 
 from jco.api import tasks
 from jco.api import serializers
 from jco.api import utils
+from jco.api.authentication import delete_user_tokens
 from jco.commonutils import ga_integration
 
 
@@ -163,7 +165,7 @@ class AccountAdmin(admin.ModelAdmin):
         account = get_object_or_404(Account, pk=account_id)
         logger.info('Manual Identity verification status reset for %s', account.user.username)
         account.reset_verification_state()
-        Token.objects.filter(user=account.user).delete()
+        delete_user_tokens(account.user)
         messages.success(request,
                          mark_safe('Verification Status <b>Reset Done</b> for {}'.format(account.user.username)))
         return HttpResponse('OK')
@@ -313,6 +315,7 @@ class JntAdmin(ReadonlyMixin, admin.ModelAdmin):
         """
         obj.jnt_value = obj.usd_value / obj.jnt_to_usd_rate
         super().save_model(request, obj, form, change)
+        transaction.on_commit(refresh_raised_tokens_cache)
 
 
 @admin.register(Operation)
@@ -351,6 +354,7 @@ class PresaleJntAdmin(admin.ModelAdmin):
         obj.created = timezone.now()
         obj.is_presale_round = False
         super().save_model(request, obj, form, change)
+        transaction.on_commit(refresh_raised_tokens_cache)
 
 
 @admin.register(UserJntPrice)
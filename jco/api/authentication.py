@@ -0,0 +1,78 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token
+
+
+def get_token_cache_key(key):
+    return 'auth_token:{}'.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+USER_EVENTS_TOKEN_SALT = 'jco.api.user_events'
+
+
+def get_active_user(user_id):
+    user = get_user_model().objects.filter(pk=user_id).first()
+    if user is None or not user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+    return user
+
+
+def make_user_events_token(user):
+    return signing.dumps(user.pk, salt=USER_EVENTS_TOKEN_SALT)
+
+
+def delete_user_tokens(user):
+    """
+    Revoke all tokens of user, cached lookups are invalidated on Token deletion
+    """
+    Token.objects.filter(user=user).delete()
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """
+    Token authentication with token->user lookups cached in the shared cache for AUTH_TOKEN__CACHE_TTL,
+    authenticated requests don't query the database. The cached lookup is invalidated when the token
+    is deleted or the user is saved (deactivation). Invalidation of the local memory cache doesn't reach
+    other processes, tokens are looked up in the database without the shared cache
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.CACHE_IS_SHARED:
+            return super().authenticate_credentials(key)
+
+        model = self.get_model()
+        cache_key = get_token_cache_key(key)
+        user = cache.get(cache_key)
+        if user is None:
+            try:
+                user = model.objects.select_related('user').get(key=key).user
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            cache.set(cache_key, user, settings.AUTH_TOKEN__CACHE_TTL)
+
+        return (user, model(key=key, user=user))
+
+
+class UserEventsTokenAuthentication(authentication.BaseAuthentication):
+    """
+    Authentication of the events stream by the short-lived signed token in the `token` query parameter,
+    EventSource can't send the Authorization header. The token is valid for USER_EVENTS__TOKEN_TTL
+    """
+
+    def authenticate(self, request):
+        token = request.query_params.get('token')
+        if not token:
+            return None
+        try:
+            user_id = signing.loads(token, salt=USER_EVENTS_TOKEN_SALT, max_age=settings.USER_EVENTS__TOKEN_TTL)
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        return (get_active_user(user_id), None)
@@ -0,0 +1,148 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+# Postgres NOTIFY channel of user events, published by DB triggers on transaction, JNT and withdraw
+# with user_id in the payload (see migrations 0044_user_events_notify and 0053_user_events_channel)
+USER_EVENTS_CHANNEL = 'user_events'
+
+
+class UserEventsListener:
+    """
+    One LISTEN connection of the process shared by all event streams, events are fanned out to the queues
+    of the user subscribers. The connection is opened on the first subscription, reopened after failures
+    and closed when the last subscriber leaves
+    """
+    idle_check_interval = 1
+
+    def __init__(self, queue_size, reconnect_delay):
+        self._queue_size = queue_size
+        self._reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._listening = threading.Event()
+        self._subscribers = {}
+        self._thread = None
+
+    def subscribe(self, user_id):
+        events = queue.Queue(maxsize=self._queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(events)
+            # the listener thread doesn't survive the fork of the worker
+            if self._thread is None or not self._thread.is_alive():
+                self._listening.clear()
+                self._thread = threading.Thread(target=self._run, name='user-events-listener', daemon=True)
+                self._thread.start()
+        self._listening.wait(self._reconnect_delay)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, set())
+            subscribers.discard(events)
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def publish(self, event):
+        user_id = event.pop('user_id', None)
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                logger.warning('Events queue of user %s is full, event %s is dropped', user_id, event)
+
+    def _stop_if_idle(self):
+        with self._lock:
+            if self._subscribers:
+                return False
+            self._thread = None
+            self._listening.clear()
+            return True
+
+    def _run(self):
+        while True:
+            # noinspection PyBroadException
+            try:
+                self._listen()
+                return
+            except Exception:
+                logger.exception('User events listener failed, reconnect in %s seconds', self._reconnect_delay)
+            if self._stop_if_idle():
+                return
+            self._listening.clear()
+            time.sleep(self._reconnect_delay)
+
+    def _listen(self):
+        conn = connection.get_new_connection(connection.get_connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(USER_EVENTS_CHANNEL))
+            self._listening.set()
+
+            while not self._stop_if_idle():
+                readable, _, _ = select.select([conn], [], [], self.idle_check_interval)
+                if not readable:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        event = json.loads(notify.payload)
+                    except ValueError:
+                        logger.error('Invalid user event payload %s', notify.payload)
+                        continue
+                    self.publish(event)
+        finally:
+            conn.close()
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_user_events_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = UserEventsListener(settings.USER_EVENTS__QUEUE_SIZE, settings.USER_EVENTS__RECONNECT_DELAY)
+        return _listener
+
+
+def iter_user_events(user_id, duration, heartbeat):
+    """
+    Listen to user events for `duration` seconds on the shared listener of the process.
+    Yields event dicts, or None every `heartbeat` seconds without events
+    """
+    listener = get_user_events_listener()
+    events = listener.subscribe(user_id)
+    try:
+        deadline = time.monotonic() + duration
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = events.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                event = None
+            yield event
+    finally:
+        listener.unsubscribe(user_id, events)
+
+
+def format_server_sent_event(event):
+    if event is None:
+        return ': keep-alive\n\n'
+    return 'event: {}\ndata: {}\n\n'.format(event.get('event', 'message'), json.dumps(event))
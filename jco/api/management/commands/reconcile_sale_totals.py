@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from jco.api.models import SaleTotals
+
+
+class Command(BaseCommand):
+
+    help = 'Recomputes sale totals counter from JNT and presale_jnt tables'
+
+    def handle(self, *args, **options):
+        before = SaleTotals.get_current()
+        self.stdout.write('Sale totals before: {}'.format(before))
+        after = SaleTotals.reconcile()
+        self.stdout.write(self.style.SUCCESS('Sale totals after: {}'.format(after)))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from jco.api.models import UserBalance
+
+
+class Command(BaseCommand):
+
+    help = 'Posts correcting balance ledger entries for user balances differing from JNT, presale_jnt and withdraw'
+
+    def handle(self, *args, **options):
+        corrected = UserBalance.reconcile()
+        self.stdout.write(self.style.SUCCESS('Corrected user balances: {}'.format(corrected)))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-09 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+SALE_TOTALS_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION sale_totals_add(d_jnt double precision,
+                                           d_presale double precision,
+                                           d_presale_round double precision) RETURNS void AS $$
+BEGIN
+    IF d_jnt = 0 AND d_presale = 0 AND d_presale_round = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO sale_totals (id, jnt_value, presale_jnt_value, presale_round_jnt_value, updated_at)
+    VALUES (1, d_jnt, d_presale, d_presale_round, now())
+    ON CONFLICT (id) DO UPDATE
+       SET jnt_value = sale_totals.jnt_value + EXCLUDED.jnt_value,
+           presale_jnt_value = sale_totals.presale_jnt_value + EXCLUDED.presale_jnt_value,
+           presale_round_jnt_value = sale_totals.presale_round_jnt_value + EXCLUDED.presale_round_jnt_value,
+           updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sale_totals_jnt_trigger() RETURNS trigger AS $$
+DECLARE
+    d_jnt double precision := 0;
+BEGIN
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        IF OLD.is_sale_allocation THEN
+            d_jnt := d_jnt - OLD.jnt_value;
+        END IF;
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        IF NEW.is_sale_allocation THEN
+            d_jnt := d_jnt + NEW.jnt_value;
+        END IF;
+    END IF;
+    PERFORM sale_totals_add(d_jnt, 0, 0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sale_totals_presale_jnt_trigger() RETURNS trigger AS $$
+DECLARE
+    d_presale double precision := 0;
+    d_presale_round double precision := 0;
+BEGIN
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        IF OLD.is_sale_allocation AND COALESCE(OLD.is_presale_round, FALSE) THEN
+            d_presale_round := d_presale_round - OLD.jnt_value;
+        ELSIF OLD.is_sale_allocation THEN
+            d_presale := d_presale - OLD.jnt_value;
+        END IF;
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        IF NEW.is_sale_allocation AND COALESCE(NEW.is_presale_round, FALSE) THEN
+            d_presale_round := d_presale_round + NEW.jnt_value;
+        ELSIF NEW.is_sale_allocation THEN
+            d_presale := d_presale + NEW.jnt_value;
+        END IF;
+    END IF;
+    PERFORM sale_totals_add(0, d_presale, d_presale_round);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sale_totals_jnt
+    AFTER INSERT OR UPDATE OR DELETE ON "JNT"
+    FOR EACH ROW EXECUTE PROCEDURE sale_totals_jnt_trigger();
+
+CREATE TRIGGER sale_totals_presale_jnt
+    AFTER INSERT OR UPDATE OR DELETE ON presale_jnt
+    FOR EACH ROW EXECUTE PROCEDURE sale_totals_presale_jnt_trigger();
+
+INSERT INTO sale_totals (id, jnt_value, presale_jnt_value, presale_round_jnt_value, updated_at)
+SELECT 1,
+       (SELECT COALESCE(SUM(jnt_value), 0) FROM "JNT"
+         WHERE is_sale_allocation),
+       (SELECT COALESCE(SUM(jnt_value), 0) FROM presale_jnt
+         WHERE is_sale_allocation AND NOT COALESCE(is_presale_round, FALSE)),
+       (SELECT COALESCE(SUM(jnt_value), 0) FROM presale_jnt
+         WHERE is_sale_allocation AND COALESCE(is_presale_round, FALSE)),
+       now();
+"""
+
+SALE_TOTALS_TRIGGERS_REVERSE_SQL = """
+DROP TRIGGER IF EXISTS sale_totals_jnt ON "JNT";
+DROP TRIGGER IF EXISTS sale_totals_presale_jnt ON presale_jnt;
+DROP FUNCTION IF EXISTS sale_totals_jnt_trigger();
+DROP FUNCTION IF EXISTS sale_totals_presale_jnt_trigger();
+DROP FUNCTION IF EXISTS sale_totals_add(double precision, double precision, double precision);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_operation_last_notification_sent_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleTotals',
+            fields=[
+                ('id', models.IntegerField(default=1, primary_key=True, serialize=False)),
+                ('jnt_value', models.FloatField(default=0)),
+                ('presale_jnt_value', models.FloatField(default=0)),
+                ('presale_round_jnt_value', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'sale_totals',
+            },
+        ),
+        migrations.RunSQL(SALE_TOTALS_TRIGGERS_SQL, SALE_TOTALS_TRIGGERS_REVERSE_SQL),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-10 08:41
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_saletotals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=50)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('failed_attempts', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'outbox_event',
+            },
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX outbox_event_not_processed ON outbox_event (id) WHERE processed IS NULL',
+            'DROP INDEX IF EXISTS outbox_event_not_processed',
+        ),
+    ]
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-11 09:27
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+USER_BALANCE_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION user_balance_post(p_user_id integer,
+                                             p_delta double precision,
+                                             p_source varchar,
+                                             p_source_id integer) RETURNS void AS $$
+BEGIN
+    IF p_user_id IS NULL OR p_delta = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO balance_ledger (user_id, delta, source, source_id, created)
+    VALUES (p_user_id, p_delta, p_source, p_source_id, now());
+    INSERT INTO user_balance (user_id, balance, updated_at)
+    VALUES (p_user_id, p_delta, now())
+    ON CONFLICT (user_id) DO UPDATE
+       SET balance = user_balance.balance + EXCLUDED.balance,
+           updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION jnt_balance_owner(p_transaction_id integer) RETURNS integer AS $$
+    SELECT a.user_id
+      FROM transaction t
+      JOIN address a ON a.id = t.address_id
+     WHERE t.id = p_transaction_id AND t.status = 'success';
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION user_balance_jnt_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.transaction_id IS NOT DISTINCT FROM NEW.transaction_id
+           AND OLD.jnt_value IS NOT DISTINCT FROM NEW.jnt_value THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        PERFORM user_balance_post(jnt_balance_owner(OLD.transaction_id), -OLD.jnt_value, 'jnt', OLD.id);
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        PERFORM user_balance_post(jnt_balance_owner(NEW.transaction_id), NEW.jnt_value, 'jnt', NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_balance_transaction_trigger() RETURNS trigger AS $$
+DECLARE
+    old_owner integer;
+    new_owner integer;
+    jnt_row record;
+BEGIN
+    IF OLD.status IS NOT DISTINCT FROM NEW.status
+       AND OLD.address_id IS NOT DISTINCT FROM NEW.address_id THEN
+        RETURN NULL;
+    END IF;
+    SELECT id, jnt_value INTO jnt_row FROM "JNT" WHERE transaction_id = NEW.id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    IF OLD.status = 'success' THEN
+        SELECT user_id INTO old_owner FROM address WHERE id = OLD.address_id;
+    END IF;
+    IF NEW.status = 'success' THEN
+        SELECT user_id INTO new_owner FROM address WHERE id = NEW.address_id;
+    END IF;
+    IF old_owner IS NOT DISTINCT FROM new_owner THEN
+        RETURN NULL;
+    END IF;
+    PERFORM user_balance_post(old_owner, -jnt_row.jnt_value, 'jnt', jnt_row.id);
+    PERFORM user_balance_post(new_owner, jnt_row.jnt_value, 'jnt', jnt_row.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_balance_address_trigger() RETURNS trigger AS $$
+DECLARE
+    jnt_row record;
+BEGIN
+    IF OLD.user_id IS NOT DISTINCT FROM NEW.user_id THEN
+        RETURN NULL;
+    END IF;
+    FOR jnt_row IN SELECT j.id, j.jnt_value
+                     FROM "JNT" j
+                     JOIN transaction t ON t.id = j.transaction_id
+                    WHERE t.address_id = NEW.id AND t.status = 'success'
+    LOOP
+        PERFORM user_balance_post(OLD.user_id, -jnt_row.jnt_value, 'jnt', jnt_row.id);
+        PERFORM user_balance_post(NEW.user_id, jnt_row.jnt_value, 'jnt', jnt_row.id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_balance_presale_jnt_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.user_id IS NOT DISTINCT FROM NEW.user_id
+           AND OLD.jnt_value IS NOT DISTINCT FROM NEW.jnt_value THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        PERFORM user_balance_post(OLD.user_id, -OLD.jnt_value, 'presale_jnt', OLD.id);
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        PERFORM user_balance_post(NEW.user_id, NEW.jnt_value, 'presale_jnt', NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_balance_withdraw_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.user_id IS NOT DISTINCT FROM NEW.user_id
+           AND OLD.value IS NOT DISTINCT FROM NEW.value THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        PERFORM user_balance_post(OLD.user_id, OLD.value, 'withdraw', OLD.id);
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        PERFORM user_balance_post(NEW.user_id, -NEW.value, 'withdraw', NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_balance_jnt
+    AFTER INSERT OR DELETE OR UPDATE OF transaction_id, jnt_value ON "JNT"
+    FOR EACH ROW EXECUTE PROCEDURE user_balance_jnt_trigger();
+
+CREATE TRIGGER user_balance_transaction
+    AFTER UPDATE OF status, address_id ON transaction
+    FOR EACH ROW EXECUTE PROCEDURE user_balance_transaction_trigger();
+
+CREATE TRIGGER user_balance_address
+    AFTER UPDATE OF user_id ON address
+    FOR EACH ROW EXECUTE PROCEDURE user_balance_address_trigger();
+
+CREATE TRIGGER user_balance_presale_jnt
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, jnt_value ON presale_jnt
+    FOR EACH ROW EXECUTE PROCEDURE user_balance_presale_jnt_trigger();
+
+CREATE TRIGGER user_balance_withdraw
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, value ON withdraw
+    FOR EACH ROW EXECUTE PROCEDURE user_balance_withdraw_trigger();
+
+SELECT user_balance_post(expected.user_id, expected.balance, 'reconcile', NULL)
+  FROM (SELECT auth_user.id AS user_id,
+               (SELECT COALESCE(SUM(j.jnt_value), 0)
+                  FROM "JNT" j
+                  JOIN transaction t ON t.id = j.transaction_id
+                  JOIN address a ON a.id = t.address_id
+                 WHERE a.user_id = auth_user.id AND t.status = 'success')
+             + (SELECT COALESCE(SUM(p.jnt_value), 0) FROM presale_jnt p WHERE p.user_id = auth_user.id)
+             - (SELECT COALESCE(SUM(w.value), 0) FROM withdraw w WHERE w.user_id = auth_user.id) AS balance
+          FROM auth_user) expected;
+"""
+
+USER_BALANCE_TRIGGERS_REVERSE_SQL = """
+DROP TRIGGER IF EXISTS user_balance_jnt ON "JNT";
+DROP TRIGGER IF EXISTS user_balance_transaction ON transaction;
+DROP TRIGGER IF EXISTS user_balance_address ON address;
+DROP TRIGGER IF EXISTS user_balance_presale_jnt ON presale_jnt;
+DROP TRIGGER IF EXISTS user_balance_withdraw ON withdraw;
+DROP FUNCTION IF EXISTS user_balance_jnt_trigger();
+DROP FUNCTION IF EXISTS user_balance_transaction_trigger();
+DROP FUNCTION IF EXISTS user_balance_address_trigger();
+DROP FUNCTION IF EXISTS user_balance_presale_jnt_trigger();
+DROP FUNCTION IF EXISTS user_balance_withdraw_trigger();
+DROP FUNCTION IF EXISTS jnt_balance_owner(integer);
+DROP FUNCTION IF EXISTS user_balance_post(integer, double precision, varchar, integer);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0041_outboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('balance', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'user_balance',
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.FloatField()),
+                ('source', models.CharField(max_length=20)),
+                ('source_id', models.IntegerField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='balance_ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'balance_ledger',
+            },
+        ),
+        migrations.RunSQL(USER_BALANCE_TRIGGERS_SQL, USER_BALANCE_TRIGGERS_REVERSE_SQL),
+    ]
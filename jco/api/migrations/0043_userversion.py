@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-12 11:05
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+USER_VERSION_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION user_version_bump(p_user_id integer) RETURNS void AS $$
+BEGIN
+    IF p_user_id IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO user_version (user_id, version, updated_at)
+    VALUES (p_user_id, 1, now())
+    ON CONFLICT (user_id) DO UPDATE
+       SET version = user_version.version + 1,
+           updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_version_by_user_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        PERFORM user_version_bump(OLD.user_id);
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        IF TG_OP = 'INSERT' OR OLD.user_id IS DISTINCT FROM NEW.user_id THEN
+            PERFORM user_version_bump(NEW.user_id);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_version_transaction_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        PERFORM user_version_bump((SELECT user_id FROM address WHERE id = OLD.address_id));
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        IF TG_OP = 'INSERT' OR OLD.address_id IS DISTINCT FROM NEW.address_id THEN
+            PERFORM user_version_bump((SELECT user_id FROM address WHERE id = NEW.address_id));
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_version_jnt_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+        PERFORM user_version_bump((SELECT a.user_id
+                                     FROM transaction t
+                                     JOIN address a ON a.id = t.address_id
+                                    WHERE t.id = OLD.transaction_id));
+    END IF;
+    IF TG_OP = 'UPDATE' OR TG_OP = 'INSERT' THEN
+        IF TG_OP = 'INSERT' OR OLD.transaction_id IS DISTINCT FROM NEW.transaction_id THEN
+            PERFORM user_version_bump((SELECT a.user_id
+                                         FROM transaction t
+                                         JOIN address a ON a.id = t.address_id
+                                        WHERE t.id = NEW.transaction_id));
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_version_account
+    AFTER INSERT OR UPDATE OR DELETE ON account
+    FOR EACH ROW EXECUTE PROCEDURE user_version_by_user_trigger();
+
+CREATE TRIGGER user_version_address
+    AFTER INSERT OR UPDATE OR DELETE ON address
+    FOR EACH ROW EXECUTE PROCEDURE user_version_by_user_trigger();
+
+CREATE TRIGGER user_version_emailaddress
+    AFTER INSERT OR UPDATE OR DELETE ON account_emailaddress
+    FOR EACH ROW EXECUTE PROCEDURE user_version_by_user_trigger();
+
+CREATE TRIGGER user_version_withdraw
+    AFTER INSERT OR UPDATE OR DELETE ON withdraw
+    FOR EACH ROW EXECUTE PROCEDURE user_version_by_user_trigger();
+
+CREATE TRIGGER user_version_presale_jnt
+    AFTER INSERT OR UPDATE OR DELETE ON presale_jnt
+    FOR EACH ROW EXECUTE PROCEDURE user_version_by_user_trigger();
+
+CREATE TRIGGER user_version_transaction
+    AFTER INSERT OR UPDATE OR DELETE ON transaction
+    FOR EACH ROW EXECUTE PROCEDURE user_version_transaction_trigger();
+
+CREATE TRIGGER user_version_jnt
+    AFTER INSERT OR UPDATE OR DELETE ON "JNT"
+    FOR EACH ROW EXECUTE PROCEDURE user_version_jnt_trigger();
+"""
+
+USER_VERSION_TRIGGERS_REVERSE_SQL = """
+DROP TRIGGER IF EXISTS user_version_account ON account;
+DROP TRIGGER IF EXISTS user_version_address ON address;
+DROP TRIGGER IF EXISTS user_version_emailaddress ON account_emailaddress;
+DROP TRIGGER IF EXISTS user_version_withdraw ON withdraw;
+DROP TRIGGER IF EXISTS user_version_presale_jnt ON presale_jnt;
+DROP TRIGGER IF EXISTS user_version_transaction ON transaction;
+DROP TRIGGER IF EXISTS user_version_jnt ON "JNT";
+DROP FUNCTION IF EXISTS user_version_by_user_trigger();
+DROP FUNCTION IF EXISTS user_version_transaction_trigger();
+DROP FUNCTION IF EXISTS user_version_jnt_trigger();
+DROP FUNCTION IF EXISTS user_version_bump(integer);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('account', '0002_email_max_length'),
+        ('api', '0042_userbalance_balanceledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserVersion',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='version', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'user_version',
+            },
+        ),
+        migrations.RunSQL(USER_VERSION_TRIGGERS_SQL, USER_VERSION_TRIGGERS_REVERSE_SQL),
+    ]
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-12 15:48
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+USER_EVENTS_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION user_events_notify(p_user_id integer, p_payload json) RETURNS void AS $$
+BEGIN
+    IF p_user_id IS NULL THEN
+        RETURN;
+    END IF;
+    PERFORM pg_notify('user_events_' || p_user_id, p_payload::text);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_events_transaction_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM user_events_notify(
+        (SELECT user_id FROM address WHERE id = NEW.address_id),
+        json_build_object('event', 'deposit_detected',
+                          'transaction_id', NEW.transaction_id,
+                          'value', NEW.value,
+                          'status', NEW.status));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_events_jnt_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM user_events_notify(
+        (SELECT a.user_id
+           FROM transaction t
+           JOIN address a ON a.id = t.address_id
+          WHERE t.id = NEW.transaction_id),
+        json_build_object('event', 'jnt_credited',
+                          'transaction_id', (SELECT transaction_id FROM transaction WHERE id = NEW.transaction_id),
+                          'jnt_value', NEW.jnt_value));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_events_withdraw_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.status IS NOT DISTINCT FROM NEW.status THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    PERFORM user_events_notify(
+        NEW.user_id,
+        json_build_object('event', 'withdraw_status',
+                          'withdraw_id', NEW.id,
+                          'transaction_id', NEW.transaction_id,
+                          'value', NEW.value,
+                          'status', NEW.status));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_events_transaction
+    AFTER INSERT ON transaction
+    FOR EACH ROW EXECUTE PROCEDURE user_events_transaction_trigger();
+
+CREATE TRIGGER user_events_jnt
+    AFTER INSERT ON "JNT"
+    FOR EACH ROW EXECUTE PROCEDURE user_events_jnt_trigger();
+
+CREATE TRIGGER user_events_withdraw
+    AFTER INSERT OR UPDATE OF status ON withdraw
+    FOR EACH ROW EXECUTE PROCEDURE user_events_withdraw_trigger();
+"""
+
+USER_EVENTS_TRIGGERS_REVERSE_SQL = """
+DROP TRIGGER IF EXISTS user_events_transaction ON transaction;
+DROP TRIGGER IF EXISTS user_events_jnt ON "JNT";
+DROP TRIGGER IF EXISTS user_events_withdraw ON withdraw;
+DROP FUNCTION IF EXISTS user_events_transaction_trigger();
+DROP FUNCTION IF EXISTS user_events_jnt_trigger();
+DROP FUNCTION IF EXISTS user_events_withdraw_trigger();
+DROP FUNCTION IF EXISTS user_events_notify(integer, json);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0043_userversion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(USER_EVENTS_TRIGGERS_SQL, USER_EVENTS_TRIGGERS_REVERSE_SQL),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-15 10:21
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0044_user_events_notify'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX address_unassigned ON address (type, id) WHERE user_id IS NULL AND is_usable',
+            'DROP INDEX IF EXISTS address_unassigned',
+        ),
+    ]
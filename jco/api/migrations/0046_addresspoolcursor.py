@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-15 14:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0045_address_unassigned_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AddressPoolCursor',
+            fields=[
+                ('type', models.CharField(max_length=10, primary_key=True, serialize=False)),
+                ('next_index', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'address_pool_cursor',
+            },
+        ),
+    ]
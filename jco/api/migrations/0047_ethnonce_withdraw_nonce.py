@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-16 11:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0046_addresspoolcursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EthNonce',
+            fields=[
+                ('address', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('next_nonce', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'eth_nonce',
+            },
+        ),
+        migrations.AddField(
+            model_name='withdraw',
+            name='nonce',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='withdraw',
+            name='sent',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
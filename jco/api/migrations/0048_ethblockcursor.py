@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-16 16:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0047_ethnonce_withdraw_nonce'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EthBlockCursor',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('block_number', models.IntegerField()),
+                ('updated_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'eth_block_cursor',
+            },
+        ),
+    ]
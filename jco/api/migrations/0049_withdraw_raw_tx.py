@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-18 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0048_ethblockcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdraw',
+            name='raw_tx',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-22 11:05
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0051_notification_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "DELETE FROM affiliate a USING affiliate b "
+            "WHERE a.event = 'transaction' AND b.event = 'transaction' AND a.user_id = b.user_id "
+            "AND a.meta->>'transaction_id' = b.meta->>'transaction_id' AND a.id > b.id",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX affiliate_transaction ON affiliate (user_id, (meta->>'transaction_id')) "
+            "WHERE event = 'transaction'",
+            'DROP INDEX IF EXISTS affiliate_transaction',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2018-01-29 12:10
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+USER_EVENTS_CHANNEL_SQL = """
+CREATE OR REPLACE FUNCTION user_events_notify(p_user_id integer, p_payload json) RETURNS void AS $$
+BEGIN
+    IF p_user_id IS NULL THEN
+        RETURN;
+    END IF;
+    PERFORM pg_notify('user_events', (p_payload::jsonb || jsonb_build_object('user_id', p_user_id))::text);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+USER_EVENTS_CHANNEL_REVERSE_SQL = """
+CREATE OR REPLACE FUNCTION user_events_notify(p_user_id integer, p_payload json) RETURNS void AS $$
+BEGIN
+    IF p_user_id IS NULL THEN
+        RETURN;
+    END IF;
+    PERFORM pg_notify('user_events_' || p_user_id, p_payload::text);
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0052_affiliate_transaction_unique'),
+    ]
+
+    operations = [
+        migrations.RunSQL(USER_EVENTS_CHANNEL_SQL, USER_EVENTS_CHANNEL_REVERSE_SQL),
+    ]
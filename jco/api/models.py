@@ -2,21 +2,28 @@ import logging
 import uuid
 import binascii
 import os
+import random
+from datetime import timedelta
 
 from allauth.account.models import EmailAddress
-from django.db import models, transaction
+from django.db import models, transaction, connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.postgres.fields import JSONField
-from django.template.loader import render_to_string
 from django.utils.timezone import now
 from django.contrib.auth.tokens import default_token_generator as token_generator
 from django.contrib.sites.shortcuts import get_current_site
+from rest_framework.authtoken.models import Token
 
 from jco.appdb.models import CurrencyType
 from jco.appdb.models import TransactionStatus
 from jco.appdb.models import NotificationType
 from jco.appdb.models import NOTIFICATION_KEYS, NOTIFICATION_SUBJECTS
+from jco.appdb.models import ASSIGN_ADDRESS_PAIR_SQL
 from jco.appprocessor import notify
+from jco.api.authentication import get_token_cache_key
 
 
 logger = logging.getLogger(__name__)
@@ -103,15 +110,24 @@ class Account(models.Model):
                                                self.user.id if self.user else None)
 
     def get_jnt_balance(self):
-        presale_balance = PresaleJnt.objects.filter(
-            user=self.user).aggregate(models.Sum('jnt_value'))['jnt_value__sum'] or 0
-        jnt_balance = (Jnt.objects.filter(transaction__address__user=self.user,
-                                          transaction__status=TransactionStatus.success)
-                       .aggregate(models.Sum('jnt_value')))['jnt_value__sum'] or 0
+        return UserBalance.get_balance(self.user)
 
-        withdraws = Withdraw.objects.filter(
-            user=self.user).aggregate(models.Sum('value'))['value__sum'] or 0
-        return jnt_balance + presale_balance - withdraws
+    @classmethod
+    def get_with_dashboard_data(cls, user):
+        """
+        Get account with user, balance, addresses and email confirmation in one query
+        """
+        addresses = Address.objects.filter(user=models.OuterRef('user')).order_by('id')
+        return (cls.objects
+                .select_related('user', 'user__balance')
+                .annotate(dashboard_btc_address=models.Subquery(
+                              addresses.filter(type=CurrencyType.btc).values('address')[:1]),
+                          dashboard_eth_address=models.Subquery(
+                              addresses.filter(type=CurrencyType.eth).values('address')[:1]),
+                          dashboard_is_email_confirmed=models.Exists(
+                              EmailAddress.objects.filter(email=models.OuterRef('user__username'),
+                                                          verified=True)))
+                .get(user=user))
 
     def __str__(self):
         return '{} {}'.format(self.first_name, self.last_name)
@@ -133,24 +149,27 @@ class Address(models.Model):
 
     @classmethod
     def assign_pair_to_user(cls, user):
-        if cls.objects.filter(user=user).count() > 0:
-            logger.info('User %s already have address', user.username)
-            return False
-        with transaction.atomic():
-            eth_addr = (cls.objects.select_for_update()
-                        .filter(type=CurrencyType.eth, user=None, is_usable=True).first())
-            if not eth_addr:
+        """
+        Assign ETH and BTC addresses from the pool to user in one statement.
+        Concurrent allocations skip each other's locked addresses instead of queueing on them
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM auth_user WHERE id = %s FOR UPDATE', [user.pk])
+            if cls.objects.filter(user=user).exists():
+                logger.info('User %s already have address', user.username)
+                return False
+
+            cursor.execute(ASSIGN_ADDRESS_PAIR_SQL, {'user_id': user.pk,
+                                                     'eth': CurrencyType.eth,
+                                                     'btc': CurrencyType.btc})
+            assigned = cursor.fetchall()
+            if len(assigned) != 2:
+                transaction.set_rollback(True)
                 logger.error('No more addresses')
                 return False
-            eth_addr.user = user
-            eth_addr.save()
-            logger.info('ETH Address %s is assigned to user %s', eth_addr.address, user.username)
-
-            btc_addr = (cls.objects.select_for_update()
-                        .filter(type=CurrencyType.btc, user=None, is_usable=True).first())
-            btc_addr.user = user
-            btc_addr.save()
-            logger.info('BTC Address %s is assigned to user %s', btc_addr.address, user.username)
+
+        for address_type, address in assigned:
+            logger.info('%s Address %s is assigned to user %s', address_type.upper(), address, user.username)
         return True
 
 
@@ -202,17 +221,222 @@ class Jnt(models.Model):
         return '{} [{}]'.format(str(self.created), self.jnt_value)
 
 
+class SaleTotals(models.Model):
+    """
+    Sale totals counter (single row).
+    Maintained by DB triggers on JNT and presale_jnt tables in the same transaction
+    as the insert/update/delete, see migration 0040_saletotals.
+    """
+    SINGLETON_ID = 1
+
+    id = models.IntegerField(primary_key=True, default=SINGLETON_ID)
+    jnt_value = models.FloatField(default=0)
+    presale_jnt_value = models.FloatField(default=0)
+    presale_round_jnt_value = models.FloatField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'sale_totals'
+
+    def __str__(self):
+        return 'Sale totals [{}, {}, {}]'.format(
+            self.jnt_value, self.presale_jnt_value, self.presale_round_jnt_value)
+
+    @classmethod
+    def get_current(cls):
+        """
+        Get counter row, zero counters if row is not created yet
+        """
+        try:
+            return cls.objects.get(pk=cls.SINGLETON_ID)
+        except cls.DoesNotExist:
+            return cls(pk=cls.SINGLETON_ID)
+
+    @classmethod
+    def reconcile(cls):
+        """
+        Recompute counters from scratch
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE "JNT", presale_jnt IN SHARE MODE')
+            cursor.execute(SALE_TOTALS_RECONCILE_SQL, [cls.SINGLETON_ID])
+        return cls.get_current()
+
+
+SALE_TOTALS_RECONCILE_SQL = """
+INSERT INTO sale_totals (id, jnt_value, presale_jnt_value, presale_round_jnt_value, updated_at)
+SELECT %s,
+       (SELECT COALESCE(SUM(jnt_value), 0) FROM "JNT"
+         WHERE is_sale_allocation),
+       (SELECT COALESCE(SUM(jnt_value), 0) FROM presale_jnt
+         WHERE is_sale_allocation AND NOT COALESCE(is_presale_round, FALSE)),
+       (SELECT COALESCE(SUM(jnt_value), 0) FROM presale_jnt
+         WHERE is_sale_allocation AND COALESCE(is_presale_round, FALSE)),
+       now()
+ON CONFLICT (id) DO UPDATE
+   SET jnt_value = EXCLUDED.jnt_value,
+       presale_jnt_value = EXCLUDED.presale_jnt_value,
+       presale_round_jnt_value = EXCLUDED.presale_round_jnt_value,
+       updated_at = EXCLUDED.updated_at
+"""
+
+
 def get_raised_tokens():
     """
     Get raised tokens amount
     """
-    manual_jnt = (PresaleJnt.objects.filter(is_sale_allocation=True, is_presale_round=False)
-                  .aggregate(models.Sum('jnt_value'))['jnt_value__sum'] or 0)
+    totals = SaleTotals.get_current()
+    return totals.presale_jnt_value + totals.jnt_value + settings.RAISED_TOKENS_SHIFT
+
+
+def refresh_raised_tokens_cache():
+    """
+    Write raised tokens amount through to the cache, it doesn't expire only in the shared cache
+    """
+    raised_tokens = get_raised_tokens()
+    cache.set(settings.RAISED_TOKENS__CACHE_KEY, raised_tokens, timeout=settings.RAISED_TOKENS__CACHE_TTL)
+    return raised_tokens
+
+
+def get_cached_raised_tokens():
+    """
+    Get raised tokens amount from the shared cache, fill the cache if it is empty
+    """
+    raised_tokens = cache.get(settings.RAISED_TOKENS__CACHE_KEY)
+    if raised_tokens is None:
+        raised_tokens = refresh_raised_tokens_cache()
+    return raised_tokens
+
+
+TRANSACTIONS_KIND_PURCHASE = 'transaction'
+TRANSACTIONS_KIND_WITHDRAW = 'withdraw'
+TRANSACTIONS_KIND_PRESALE = 'presale_jnt'
+
+TRANSACTIONS_KEYS_SQL = """
+SELECT kind, id, date
+  FROM (SELECT 'transaction' AS kind, t.id, t.mined AS date
+          FROM transaction t
+          JOIN address a ON a.id = t.address_id
+         WHERE a.user_id = %(user_id)s
+           AND EXISTS (SELECT 1 FROM "JNT" j WHERE j.transaction_id = t.id)
+        UNION ALL
+        SELECT 'withdraw', w.id, w.created
+          FROM withdraw w
+         WHERE w.user_id = %(user_id)s
+        UNION ALL
+        SELECT 'presale_jnt', p.id, p.created
+          FROM presale_jnt p
+         WHERE p.user_id = %(user_id)s) entries
+ {condition}
+ ORDER BY date DESC, kind DESC, id DESC
+ LIMIT %(limit)s
+"""
+
+
+def get_transactions_keys(user, limit, after=None):
+    """
+    Get (kind, id, date) keys of user purchases, withdrawals and presale JNT, newest first.
+    Keyset pagination: `after` is the last key of the previous page
+    """
+    params = {'user_id': user.pk, 'limit': limit}
+    condition = ''
+    if after is not None:
+        condition = 'WHERE (date, kind, id) < (%(after_date)s, %(after_kind)s, %(after_id)s)'
+        params.update(after_kind=after[0], after_id=after[1], after_date=after[2])
+    with connection.cursor() as cursor:
+        cursor.execute(TRANSACTIONS_KEYS_SQL.format(condition=condition), params)
+        return cursor.fetchall()
 
-    jnt = (Jnt.objects.filter(is_sale_allocation=True)
-           .aggregate(models.Sum('jnt_value'))['jnt_value__sum'] or 0)
 
-    return manual_jnt + jnt + settings.RAISED_TOKENS_SHIFT
+class UserBalance(models.Model):
+    """
+    JNT balance of user (successful purchases + presale - withdraws).
+    Maintained by DB triggers together with BalanceLedger entries,
+    see migration 0042_userbalance_balanceledger.
+    No FK constraint, so the rows do not block deletion of users.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, models.DO_NOTHING,
+                                primary_key=True, related_name='balance', db_constraint=False)
+    balance = models.FloatField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'user_balance'
+
+    def __str__(self):
+        return '{} [{}]'.format(self.user_id, self.balance)
+
+    @classmethod
+    def get_balance(cls, user):
+        return cls.objects.filter(user=user).values_list('balance', flat=True).first() or 0
+
+    @classmethod
+    def reconcile(cls):
+        """
+        Post correcting ledger entries for balances which differ from the source tables
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE "JNT", presale_jnt, withdraw, transaction IN SHARE MODE')
+            cursor.execute(USER_BALANCE_RECONCILE_SQL)
+            return cursor.rowcount
+
+
+class UserVersion(models.Model):
+    """
+    Version stamp of user data shown by API (account, addresses, transactions, JNT, withdraws, presale).
+    Bumped by DB triggers in the same transaction as the change, see migration 0043_userversion.
+    No FK constraint, so the rows do not block deletion of users.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, models.DO_NOTHING,
+                                primary_key=True, related_name='version', db_constraint=False)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'user_version'
+
+    def __str__(self):
+        return '{} [{}]'.format(self.user_id, self.version)
+
+    @classmethod
+    def get_version(cls, user):
+        return cls.objects.filter(user=user).values_list('version', flat=True).first() or 0
+
+
+class BalanceLedger(models.Model):
+    """
+    Append-only log of JNT balance changes, kept for deleted users (no FK constraint)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, models.DO_NOTHING, related_name='balance_ledger',
+                             db_constraint=False)
+    delta = models.FloatField()
+    source = models.CharField(max_length=20)
+    source_id = models.IntegerField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'balance_ledger'
+
+    def __str__(self):
+        return '{} {} [{} {}]'.format(self.user_id, self.delta, self.source, self.source_id)
+
+
+USER_BALANCE_RECONCILE_SQL = """
+SELECT user_balance_post(expected.user_id,
+                         expected.balance - COALESCE(user_balance.balance, 0),
+                         'reconcile', NULL)
+  FROM (SELECT auth_user.id AS user_id,
+               (SELECT COALESCE(SUM(j.jnt_value), 0)
+                  FROM "JNT" j
+                  JOIN transaction t ON t.id = j.transaction_id
+                  JOIN address a ON a.id = t.address_id
+                 WHERE a.user_id = auth_user.id AND t.status = 'success')
+             + (SELECT COALESCE(SUM(p.jnt_value), 0) FROM presale_jnt p WHERE p.user_id = auth_user.id)
+             - (SELECT COALESCE(SUM(w.value), 0) FROM withdraw w WHERE w.user_id = auth_user.id) AS balance
+          FROM auth_user) expected
+  LEFT JOIN user_balance ON user_balance.user_id = expected.user_id
+ WHERE abs(expected.balance - COALESCE(user_balance.balance, 0)) > 1e-9
+"""
 
 
 class Withdraw(models.Model):
@@ -226,6 +450,9 @@ class Withdraw(models.Model):
                              related_name='withdraws')
     status = models.CharField(max_length=20, default=TransactionStatus.not_confirmed)
     meta = JSONField(default=dict)  # This field type is a guess.
+    nonce = models.IntegerField(null=True, blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+    raw_tx = models.TextField(null=True, blank=True)
 
     class Meta:
         db_table = 'withdraw'
@@ -241,6 +468,8 @@ class Notification(models.Model):
     sended = models.DateTimeField(null=True)
     is_sended = models.BooleanField(default=False)
     rendered_message = models.TextField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
 
     meta = JSONField(default=dict)  # This field type is a guess.
 
@@ -260,7 +489,24 @@ class Notification(models.Model):
         return NOTIFICATION_KEYS[self.type]
 
     def get_body(self):
-        return render_to_string(self.get_template(), self.meta)
+        return notify.get_notification_template(self.get_key()).render(self.meta)
+
+    def schedule_retry(self):
+        """
+        Count the failed attempt and schedule the next one with exponential backoff and jitter
+        """
+        failed_notifications = self.meta.get('failed_notifications', 0) + 1
+        self.meta['failed_notifications'] = failed_notifications
+        self.next_attempt_at = now() + timedelta(seconds=get_retry_delay(failed_notifications))
+
+
+def get_retry_delay(failed_attempts):
+    """
+    Exponential delay of the next attempt, randomized in its upper half
+    """
+    delay = min(settings.EMAIL_NOTIFICATIONS__RETRY_DELAY * 2 ** (failed_attempts - 1),
+                settings.EMAIL_NOTIFICATIONS__RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
 
 
 class PresaleJnt(models.Model):
@@ -293,6 +539,68 @@ class Affiliate(models.Model):
         db_table = 'affiliate'
 
 
+class OutboxEvent(models.Model):
+    """
+    Side effect of the JNT pipeline, dispatched after the pipeline commit
+    """
+    event = models.CharField(max_length=50)
+    payload = JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    failed_attempts = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'outbox_event'
+
+    def __str__(self):
+        return '{} [{}, {}]'.format(self.event, self.created, self.processed)
+
+
+class AddressPoolCursor(models.Model):
+    """
+    Next derivation index of the deposit address pool of the currency
+    """
+    type = models.CharField(max_length=10, primary_key=True)
+    next_index = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'address_pool_cursor'
+
+    def __str__(self):
+        return '{} [{}]'.format(self.type, self.next_index)
+
+
+class EthNonce(models.Model):
+    """
+    Next nonce to allocate for transactions sent from the address
+    """
+    address = models.CharField(max_length=255, primary_key=True)
+    next_nonce = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'eth_nonce'
+
+    def __str__(self):
+        return '{} [{}]'.format(self.address, self.next_nonce)
+
+
+class EthBlockCursor(models.Model):
+    """
+    Last processed block of the blockchain scanner
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    block_number = models.IntegerField()
+    updated_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'eth_block_cursor'
+
+    def __str__(self):
+        return '{} [{}]'.format(self.name, self.block_number)
+
+
 class OperationError(Exception):
     """
     Operation execution error
@@ -482,3 +790,20 @@ def is_user_email_confirmed(user):
     except EmailAddress.DoesNotExist:
         logger.error('No EmailAddress for user %s!!', user.username)
         return False
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token_cache(sender, instance, **kwargs):
+    """
+    Invalidate the cached lookup of the deleted token: logout, revocation, admin or cascade deletion of the user
+    """
+    cache.delete(get_token_cache_key(instance.key))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens_cache(sender, instance, **kwargs):
+    """
+    Invalidate the cached lookups of user tokens, they hold the user: deactivation, profile changes
+    """
+    keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+    cache.delete_many([get_token_cache_key(key) for key in keys])
@@ -5,6 +5,7 @@ from django.db import transaction
 from django.db.models import Sum
 from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate
+from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.sites.models import Site
 from allauth.account import app_settings as allauth_settings
@@ -100,6 +101,28 @@ class AccountSerializer(serializers.ModelSerializer):
         return is_user_email_confirmed(obj.user)
 
 
+class DashboardAccountSerializer(AccountSerializer):
+    """
+    Account serializer over Account.get_with_dashboard_data(),
+    reads annotated and select_related values instead of per-field queries
+    """
+
+    def get_jnt_balance(self, obj):
+        try:
+            return obj.user.balance.balance
+        except ObjectDoesNotExist:
+            return 0
+
+    def get_btc_address(self, obj):
+        return obj.dashboard_btc_address
+
+    def get_eth_address(self, obj):
+        return obj.dashboard_eth_address
+
+    def get_is_email_confirmed(self, obj):
+        return obj.dashboard_is_email_confirmed
+
+
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
         model = Address
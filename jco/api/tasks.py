@@ -1,4 +1,5 @@
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
 
@@ -12,7 +13,7 @@ from jco.commonutils import person_verify
 from jco.commonutils import ga_integration
 from jco.appprocessor.app_create import celery_app
 from jco.appprocessor import notify as notify_lib
-from jco.api.models import Account, Notification, Operation
+from jco.api.models import Account, Notification, Operation, refresh_raised_tokens_cache
 
 
 logger = logging.getLogger(__name__)
@@ -144,18 +145,77 @@ def retry_uncomplete_verifications():
         verify_user.delay(account.user.pk)
 
 
+def claim_notifications(last_id, batch_size):
+    """
+    Claim the next batch of unsent notifications, rows locked by other dispatchers are skipped.
+    Notifications failed EMAIL_NOTIFICATIONS__RETRY_MAX_ATTEMPTS times are not sent anymore
+    """
+    now = timezone.now()
+    claim_expired = now - timedelta(seconds=settings.EMAIL_NOTIFICATIONS__CLAIM_TIMEOUT)
+    with transaction.atomic():
+        ids = list(Notification.objects
+                   .select_for_update(skip_locked=True)
+                   .filter(is_sended=False, pk__gt=last_id)
+                   .filter(Q(claimed_at=None) | Q(claimed_at__lt=claim_expired))
+                   .filter(Q(next_attempt_at=None) | Q(next_attempt_at__lte=now))
+                   .filter(Q(meta__failed_notifications__isnull=True) |
+                           Q(meta__failed_notifications__lt=settings.EMAIL_NOTIFICATIONS__RETRY_MAX_ATTEMPTS))
+                   .order_by('pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        Notification.objects.filter(pk__in=ids).update(claimed_at=now)
+    return list(Notification.objects.filter(pk__in=ids).order_by('pk'))
+
+
+def send_notifications_email(notifications):
+    # noinspection PyBroadException
+    try:
+        return notify_lib.send_notifications_email(notifications)
+    except Exception:
+        logger.exception('Failed to send notifications %s', [notification.pk for notification in notifications])
+        return [(False, None)] * len(notifications)
+
+
 @celery_app.task()
 def process_all_notifications_runner():
+    """
+    Send unsent notifications, claimed by batches and sent in a pool of threads.
+    Notifications of the same type are sent in one Mailgun batch request.
+    Several runners share the work, a notification is sent by one of them.
+    A failed notification is not claimed again until its next attempt time
+    """
     logger.info('Run notifications processing')
 
-    notifications_to_send = Notification.objects.filter(is_sended=False).all()
-    for notification in notifications_to_send:
-        success, message_id = notify_lib.send_notification(notification.pk)
-        notification.is_sended = success
-        notification.meta['mailgun_message_id'] = message_id
-        notification.rendered_message = notification.get_body()
-
-        notification.save()
+    batch_size = settings.EMAIL_NOTIFICATIONS__BATCH_SIZE
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=settings.EMAIL_NOTIFICATIONS__SEND_THREADS) as executor:
+        while True:
+            notifications = claim_notifications(last_id, batch_size)
+            if len(notifications) == 0:
+                break
+            last_id = notifications[-1].pk
+
+            groups = notify_lib.group_notifications(notifications)
+            results = [result
+                       for group_results in executor.map(send_notifications_email, groups)
+                       for result in group_results]
+            for notification, (success, message_id) in zip(
+                    [notification for group in groups for notification in group], results):
+                notification.is_sended = success
+                if success:
+                    notification.sended = timezone.now()
+                    notification.next_attempt_at = None
+                else:
+                    notification.schedule_retry()
+                    if notification.meta['failed_notifications'] >= settings.EMAIL_NOTIFICATIONS__RETRY_MAX_ATTEMPTS:
+                        logger.error('Notification %s is not sent after %s attempts',
+                                     notification.pk, notification.meta['failed_notifications'])
+                notification.meta['mailgun_message_id'] = message_id
+                notification.claimed_at = None
+                notification.save()
+
+            logger.info('Processed %s notifications', len(notifications))
+            if len(notifications) < batch_size:
+                break
 
     logger.info('Finished notifications processing')
 
@@ -175,3 +235,9 @@ def resend_emails_for_unconfirmed_operations():
             success = op.request_confirmation()
             logger.info('Resend op confirmation: #%s op: %s for %s. %s.',
                         op.pk, op.operation, op.user.username, 'Success' if success else 'Fail')
+
+
+@celery_app.task()
+def refresh_raised_tokens_cache_runner():
+    raised_tokens = refresh_raised_tokens_cache()
+    logger.info('Raised tokens cache refreshed: %s', raised_tokens)
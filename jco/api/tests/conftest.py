@@ -3,12 +3,18 @@ from datetime import datetime
 import pytest
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from allauth.account.models import EmailAddress
 
 from jco.api import models
 from jco.appdb import models as sa_models
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
 @pytest.fixture
 def users():
     users = [
@@ -5,11 +5,13 @@ import pytest
 from django.test import TestCase
 
 from rest_framework.test import RequestsClient
+from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from allauth.account.models import EmailAddress
 from allauth.account.utils import setup_user_email
 
 from jco.api import models
+from jco.api.authentication import CachedTokenAuthentication, delete_user_tokens
 from jco.appdb import models as sa_models
 from jco.appdb.db import session as sa_session
 
@@ -105,6 +107,77 @@ def test_transactions_anon(client):
     assert resp.status_code == 401
 
 
+def test_transactions_pagination(client, users, addresses, transactions, jnt):
+    models.Withdraw.objects.create(
+        transaction_id='3000',
+        value=30000,
+        mined=datetime(2017, 11, 15),
+        created=datetime(2017, 11, 15),
+        block_height=200,
+        status='success',
+        user=users[0],
+    )
+    client.authenticate('user1@main.com', 'password1')
+    all_transactions = client.get('/api/transactions/').json()
+    assert 'Link' not in client.get('/api/transactions/').headers
+
+    resp = client.get('/api/transactions/?limit=3')
+    assert resp.status_code == 200
+    assert resp.json() == all_transactions[:3]
+    assert resp.links['next']['url']
+
+    resp = client.get(resp.links['next']['url'][len(client.base_url):])
+    assert resp.status_code == 200
+    assert resp.json() == all_transactions[3:]
+    assert 'next' not in resp.links
+
+    resp = client.get('/api/transactions/?cursor=xxx')
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize('cache_is_shared', [True, False])
+def test_cached_token_revocation(client, users, settings, cache_is_shared):
+    settings.CACHE_IS_SHARED = cache_is_shared
+    client.authenticate('user1@main.com', 'password1')
+    assert client.get('/api/account/').status_code == 200
+    assert client.get('/api/account/').status_code == 200
+
+    delete_user_tokens(users[0])
+    assert client.get('/api/account/').status_code == 401
+
+    client.authenticate('user1@main.com', 'password1')
+    assert client.get('/api/account/').status_code == 200
+    assert client.post('/auth/logout/').status_code == 200
+    assert client.get('/api/account/').status_code == 401
+
+    client.authenticate('user1@main.com', 'password1')
+    assert client.get('/api/account/').status_code == 200
+    Token.objects.filter(user=users[0]).delete()
+    assert client.get('/api/account/').status_code == 401, "token deleted by admin must be revoked"
+
+    client.authenticate('user1@main.com', 'password1')
+    assert client.get('/api/account/').status_code == 200
+    users[0].is_active = False
+    users[0].save()
+    assert client.get('/api/account/').status_code == 401, "deactivated user must be rejected"
+
+
+@pytest.mark.django_db
+def test_cached_token_authentication_queries(users, settings, django_assert_num_queries):
+    settings.CACHE_IS_SHARED = True
+    token = Token.objects.create(user=users[0])
+    authentication = CachedTokenAuthentication()
+    with django_assert_num_queries(1):
+        assert authentication.authenticate_credentials(token.key)[0] == users[0]
+    with django_assert_num_queries(0):
+        assert authentication.authenticate_credentials(token.key)[0] == users[0]
+
+    users[0].first_name = 'John'
+    users[0].save()
+    with django_assert_num_queries(1):
+        assert authentication.authenticate_credentials(token.key)[0].first_name == 'John'
+
+
 def test_get_account_empty(client, users):
     client.authenticate('user1@main.com', 'password1')
     resp = client.get('/api/account/')
@@ -127,6 +200,67 @@ def test_get_account_empty(client, users):
                            'jnt_balance': 0}
 
 
+def test_dashboard(client, users, addresses, transactions, jnt):
+    EmailAddress.objects.filter(email='user1@main.com').update(verified=True)
+    client.authenticate('user1@main.com', 'password1')
+    account = client.get('/api/account/').json()
+    transactions_list = client.get('/api/transactions/').json()
+
+    resp = client.get('/api/dashboard/')
+    assert resp.status_code == 200
+    assert resp.json() == {'account': account,
+                           'transactions': transactions_list,
+                           'transactions_next_cursor': None}
+    assert account['is_email_confirmed'] is True
+    assert account['btc_address'] == 'aba'
+    assert account['eth_address'] == 'aaa'
+
+
+def test_dashboard_anon(client):
+    resp = client.get('/api/dashboard/')
+    assert resp.status_code == 401
+
+
+def test_user_events_token(client, users, settings):
+    settings.USER_EVENTS__STREAM_DURATION = 0
+    client.authenticate('user1@main.com', 'password1')
+    resp = client.post('/api/events/token/')
+    assert resp.status_code == 200
+    assert resp.json()['expires_in'] == settings.USER_EVENTS__TOKEN_TTL
+    token = resp.json()['token']
+
+    client.headers = {}
+    resp = client.get('/api/events/?token=' + token)
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == 'text/event-stream'
+
+    resp = client.get('/api/events/?token=' + token + 'x')
+    assert resp.status_code == 401
+
+    settings.USER_EVENTS__TOKEN_TTL = -1
+    resp = client.get('/api/events/?token=' + token)
+    assert resp.status_code == 401, "expired token must be rejected"
+
+
+def test_account_etag(client, users, addresses):
+    client.authenticate('user1@main.com', 'password1')
+    resp = client.get('/api/account/')
+    assert resp.status_code == 200
+    etag = client.get('/api/account/').headers['ETag']
+
+    resp = client.get('/api/account/', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+
+    client.put('/api/account/', {'first_name': 'John'})
+    resp = client.get('/api/account/', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.json()['first_name'] == 'John'
+    assert resp.headers['ETag'] != etag
+
+    resp = client.get('/api/transactions/', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+
+
 def test_account_verification_statuses(client, accounts):
     accounts[1].is_document_skipped = True
     accounts[2].is_identity_verified = True
@@ -261,6 +395,42 @@ def test_get_raised_tokens(client, users, transactions, settings):
     assert resp.json() == {'raised_tokens': settings.RAISED_TOKENS_SHIFT + 0.75 + 30}
 
 
+def test_get_raised_tokens_write_through(client, users, settings):
+    resp = client.get('/api/raised-tokens/')
+    assert resp.json() == {'raised_tokens': settings.RAISED_TOKENS_SHIFT + 0}
+
+    models.PresaleJnt.objects.create(
+        jnt_value=10.00,
+        created=datetime.now(),
+        user=users[0],
+        is_presale_round=False,
+        is_sale_allocation=True,
+    )
+    resp = client.get('/api/raised-tokens/')
+    assert resp.json() == {'raised_tokens': settings.RAISED_TOKENS_SHIFT + 0}
+
+    assert models.refresh_raised_tokens_cache() == settings.RAISED_TOKENS_SHIFT + 10
+    resp = client.get('/api/raised-tokens/')
+    assert resp.json() == {'raised_tokens': settings.RAISED_TOKENS_SHIFT + 10}
+
+
+def test_get_raised_tokens_local_cache_expiration(client, users, settings):
+    settings.RAISED_TOKENS__CACHE_TTL = 0
+    resp = client.get('/api/raised-tokens/')
+    assert resp.json() == {'raised_tokens': settings.RAISED_TOKENS_SHIFT + 0}
+
+    models.PresaleJnt.objects.create(
+        jnt_value=10.00,
+        created=datetime.now(),
+        user=users[0],
+        is_presale_round=False,
+        is_sale_allocation=True,
+    )
+    resp = client.get('/api/raised-tokens/')
+    assert resp.json() == {'raised_tokens': settings.RAISED_TOKENS_SHIFT + 10}, \
+        "expired value of the local cache must be refreshed"
+
+
 def test_get_withdraw_address_empty(client, users):
     client.authenticate('user1@main.com', 'password1')
     resp = client.get('/api/withdraw-address/')
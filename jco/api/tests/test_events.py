@@ -0,0 +1,48 @@
+from datetime import datetime
+from itertools import islice
+
+import pytest
+
+from jco.api import models
+from jco.api.events import iter_user_events, format_server_sent_event
+
+
+@pytest.mark.django_db(transaction=True)
+def test_user_events(users, addresses):
+    events = iter_user_events(users[0].pk, duration=10, heartbeat=0.5)
+    assert next(events) is None
+
+    tx = models.Transaction.objects.create(transaction_id='1000',
+                                           value=0.5,
+                                           mined=datetime(2017, 11, 14),
+                                           block_height=100,
+                                           status='pending',
+                                           address=addresses[1])
+    models.Transaction.objects.create(transaction_id='2000',
+                                      value=2.5,
+                                      mined=datetime(2017, 11, 14),
+                                      block_height=100,
+                                      status='pending',
+                                      address=addresses[0])
+    models.Jnt.objects.create(jnt_value=10,
+                              currency_to_usd_rate=1.0,
+                              usd_value=1.0,
+                              jnt_to_usd_rate=1.0,
+                              active=True,
+                              created=datetime.now(),
+                              transaction=tx)
+    withdraw = models.Withdraw.objects.create(to='aaaxxx', value=5.0, created=datetime.now(), user=users[0])
+    withdraw.status = models.TransactionStatus.success
+    withdraw.save()
+
+    received = list(islice((event for event in events if event is not None), 3))
+    events.close()
+    assert [e['event'] for e in received] == ['deposit_detected', 'withdraw_status', 'withdraw_status']
+    assert received[0]['transaction_id'] == '2000'
+    assert received[2]['status'] == models.TransactionStatus.success
+
+
+def test_format_server_sent_event():
+    assert format_server_sent_event(None) == ': keep-alive\n\n'
+    assert format_server_sent_event({'event': 'jnt_credited', 'jnt_value': 1}) == \
+        'event: jnt_credited\ndata: {"event": "jnt_credited", "jnt_value": 1}\n\n'
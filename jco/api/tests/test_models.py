@@ -0,0 +1,150 @@
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.template.loader import render_to_string
+
+from jco.api import models
+from jco.appprocessor import notify
+
+
+@pytest.mark.django_db
+def test_sale_totals_follow_jnt_changes(users, transactions, settings):
+    jnt = models.Jnt.objects.create(
+        jnt_value=1.5,
+        currency_to_usd_rate=1.0,
+        usd_value=1.0,
+        jnt_to_usd_rate=1.0,
+        active=True,
+        created=datetime.now(),
+        transaction=transactions[0])
+    presale = models.PresaleJnt.objects.create(
+        jnt_value=10.0,
+        created=datetime.now(),
+        user=users[0],
+        is_presale_round=True,
+        is_sale_allocation=True)
+    models.PresaleJnt.objects.create(
+        jnt_value=30.0,
+        created=datetime.now(),
+        user=users[1],
+        is_presale_round=False,
+        is_sale_allocation=True)
+
+    totals = models.SaleTotals.get_current()
+    assert totals.jnt_value == 1.5
+    assert totals.presale_jnt_value == 30
+    assert totals.presale_round_jnt_value == 10
+    assert models.get_raised_tokens() == settings.RAISED_TOKENS_SHIFT + 31.5
+
+    jnt.is_sale_allocation = False
+    jnt.save()
+    presale.is_presale_round = False
+    presale.save()
+
+    totals = models.SaleTotals.get_current()
+    assert totals.jnt_value == 0
+    assert totals.presale_jnt_value == 40
+    assert totals.presale_round_jnt_value == 0
+
+
+@pytest.mark.django_db
+def test_sale_totals_reconcile(users, transactions):
+    models.PresaleJnt.objects.create(
+        jnt_value=30.0,
+        created=datetime.now(),
+        user=users[1],
+        is_presale_round=False,
+        is_sale_allocation=True)
+    models.SaleTotals.objects.update(jnt_value=100, presale_jnt_value=0)
+
+    totals = models.SaleTotals.reconcile()
+    assert totals.jnt_value == 0
+    assert totals.presale_jnt_value == 30
+    assert totals.presale_round_jnt_value == 0
+
+
+@pytest.mark.django_db
+def test_user_balance_ledger(users, transactions):
+    models.Jnt.objects.create(
+        jnt_value=1.5,
+        currency_to_usd_rate=1.0,
+        usd_value=1.0,
+        jnt_to_usd_rate=1.0,
+        active=True,
+        created=datetime.now(),
+        transaction=transactions[0])
+    models.PresaleJnt.objects.create(
+        jnt_value=10.0,
+        created=datetime.now(),
+        user=users[0],
+        is_presale_round=True,
+        is_sale_allocation=True)
+    models.Withdraw.objects.create(
+        to='aaaxxx',
+        value=5.0,
+        created=datetime.now(),
+        user=users[0])
+
+    assert models.UserBalance.get_balance(users[0]) == 6.5
+    assert models.UserBalance.get_balance(users[1]) == 0
+    assert [e.delta for e in models.BalanceLedger.objects.filter(user=users[0]).order_by('id')] == [1.5, 10, -5]
+
+    transactions[0].status = models.TransactionStatus.fail
+    transactions[0].save()
+    assert models.UserBalance.get_balance(users[0]) == 5
+
+    models.UserBalance.objects.filter(user=users[0]).update(balance=100)
+    assert models.UserBalance.reconcile() == 1
+    assert models.UserBalance.get_balance(users[0]) == 5
+
+    # presale JNT of the deleted user is deleted in cascade, the trigger posts the ledger entry
+    models.PresaleJnt.objects.create(
+        jnt_value=3.0,
+        created=datetime.now(),
+        user=users[1],
+        is_presale_round=True,
+        is_sale_allocation=True)
+    user_id = users[1].pk
+    users[1].delete()
+    connection.check_constraints()
+    assert [e.delta for e in models.BalanceLedger.objects.filter(user_id=user_id).order_by('id')] == [3, -3], \
+        "ledger must not block deletion of users"
+
+
+@pytest.mark.django_db
+def test_assign_pair_to_user(users, addresses):
+    assert models.Address.assign_pair_to_user(users[2]) is True
+    assert sorted(models.Address.objects.filter(user=users[2]).values_list('address', flat=True)) == ['aac', 'abc']
+
+    assert models.Address.assign_pair_to_user(users[2]) is False
+    assert models.Address.assign_pair_to_user(users[3]) is False
+    assert models.Address.objects.filter(user=users[3]).count() == 0
+
+
+def test_notification_body_rendered_from_compiled_template():
+    notification = models.Notification(email='user1@main.com',
+                                       type=models.NotificationType.account_created,
+                                       meta={'activate_url': 'https://activate'})
+    body = notification.get_body()
+    assert body == render_to_string(notification.get_template(), notification.meta)
+    assert 'https://activate' in body
+
+    with mock.patch('jco.appprocessor.notify.get_template') as get_template:
+        assert notification.get_body() == body
+    get_template.assert_not_called()
+
+
+def test_email_assets_read_once():
+    notify._read_asset.cache_clear()
+    logo = Path(notify.EMAIL_NOTIFICATIONS__TEMPLATES_PATH, 'jibrel_logo.png')
+    try:
+        with mock.patch.object(Path, 'read_bytes', return_value=b'png') as read_bytes:
+            for _ in range(3):
+                files = notify._format_email_files(attachments_inline=[('jibrel_logo.png', logo)])
+                assert files == [('inline', ('jibrel_logo.png', b'png'))]
+        assert read_bytes.call_count == 1
+    finally:
+        notify._read_asset.cache_clear()
@@ -1,3 +1,4 @@
+import json
 from unittest import mock
 from datetime import datetime, timedelta
 
@@ -6,6 +7,7 @@ import pytz
 
 from jco.api import tasks
 from jco.api import models as m
+from jco.commonconfig import config
 
 
 @mock.patch('jco.api.tasks.person_verify')
@@ -152,3 +154,119 @@ def test_resend_emails_for_unconfirmed_operations(mock_get_handler, mock_datetim
         mock.call(mock.ANY, mock.ANY, {'n': 4, 't': 12}),
         mock.call(mock.ANY, mock.ANY, {'n': 5, 't': 12}),
         ])
+
+
+def sent_notification_ids(mock_send):
+    return sorted(notification.pk for call in mock_send.call_args_list for notification in call[0][0])
+
+
+@mock.patch('jco.api.tasks.notify_lib.send_notifications_email')
+def test_process_all_notifications_runner(mock_send, users, live_server, settings):
+    settings.EMAIL_NOTIFICATIONS__BATCH_SIZE = 2
+    notifications = [m.Notification.objects.create(email=user.username,
+                                                   type=m.NotificationType.account_created,
+                                                   meta={'activate_url': 'url'})
+                     for user in users[:5]]
+    claimed = m.Notification.objects.create(email=users[5].username,
+                                            type=m.NotificationType.account_created,
+                                            meta={'activate_url': 'url'},
+                                            claimed_at=datetime.now(pytz.utc))
+    failing_email = notifications[1].email
+    mock_send.side_effect = lambda group: [(notification.email != failing_email, 'id') for notification in group]
+
+    tasks.process_all_notifications_runner()
+
+    assert sent_notification_ids(mock_send) == [n.pk for n in notifications]
+    for notification in notifications:
+        notification.refresh_from_db()
+        assert notification.is_sended == (notification.email != failing_email)
+        assert notification.claimed_at is None
+    claimed.refresh_from_db()
+    assert claimed.is_sended is False, "notification claimed by another dispatcher must be skipped"
+
+    failed = notifications[1]
+    assert failed.meta['failed_notifications'] == 1
+    assert failed.next_attempt_at > datetime.now(pytz.utc)
+
+    mock_send.reset_mock()
+    tasks.process_all_notifications_runner()
+    assert mock_send.call_count == 0, "failed notification must wait for the next attempt"
+
+    failed.next_attempt_at = datetime.now(pytz.utc) - timedelta(seconds=1)
+    failed.save()
+    tasks.process_all_notifications_runner()
+    assert sent_notification_ids(mock_send) == [failed.pk]
+    failed.refresh_from_db()
+    assert failed.meta['failed_notifications'] == 2
+
+    failed.meta['failed_notifications'] = settings.EMAIL_NOTIFICATIONS__RETRY_MAX_ATTEMPTS
+    failed.next_attempt_at = datetime.now(pytz.utc) - timedelta(seconds=1)
+    failed.save()
+    mock_send.reset_mock()
+    tasks.process_all_notifications_runner()
+    assert mock_send.call_count == 0, "notification failed the max attempts must not be sent again"
+
+
+def test_notification_retry_delay(settings):
+    settings.EMAIL_NOTIFICATIONS__RETRY_DELAY = 30
+    settings.EMAIL_NOTIFICATIONS__RETRY_MAX_DELAY = 600
+    for failed_attempts, delay in [(1, 30), (2, 60), (3, 120), (10, 600)]:
+        for _ in range(20):
+            assert delay / 2 <= m.get_retry_delay(failed_attempts) <= delay
+
+
+def test_notification_retry_window(settings):
+    window = sum(m.get_retry_delay(failed_attempts)
+                 for failed_attempts in range(1, settings.EMAIL_NOTIFICATIONS__RETRY_MAX_ATTEMPTS))
+    assert window > 24 * 60 * 60, "notification must not be dropped during a short provider outage"
+
+
+@mock.patch('jco.appprocessor.notify.requests.post')
+def test_process_all_notifications_mailgun_batch(mock_post, users, live_server):
+    mock_post.return_value.json.return_value = {'id': '<batch@mailgun>'}
+    batch = [m.Notification.objects.create(email=user.username,
+                                           type=m.NotificationType.account_created,
+                                           meta={'activate_url': 'https://activate/{}'.format(user.pk)})
+             for user in users[:3]]
+    duplicate = m.Notification.objects.create(email=users[0].username,
+                                              type=m.NotificationType.account_created,
+                                              meta={'activate_url': 'https://activate/again'})
+    sendgrid = m.Notification.objects.create(email='user@yahoo.com',
+                                             type=m.NotificationType.account_created,
+                                             meta={'activate_url': 'https://activate/yahoo'})
+
+    tasks.process_all_notifications_runner()
+
+    assert mock_post.call_count == 3, "batch, duplicate recipient and sendgrid recipient"
+    batch_data = [call[1]['data'] for call in mock_post.call_args_list if isinstance(call[1]['data'], list)]
+    assert len(batch_data) == 1
+    data = dict(batch_data[0])
+    assert [value for name, value in batch_data[0] if name == 'to'] == [n.email for n in batch]
+    assert '%recipient.activate_url%' in data['html']
+    recipient_variables = json.loads(data['recipient-variables'])
+    for notification in batch + [duplicate, sendgrid]:
+        notification.refresh_from_db()
+        assert notification.is_sended is True
+        assert notification.rendered_message == notification.get_body()
+    for notification in batch:
+        assert recipient_variables[notification.email] == {'activate_url': notification.meta['activate_url']}
+        assert notification.meta['mailgun_message_id'] == '<batch@mailgun>'
+
+
+@mock.patch('jco.appprocessor.notify.config.EMAIL_NOTIFICATIONS__BACKUP_ENABLED', True)
+@mock.patch('jco.appprocessor.notify.requests.post')
+def test_process_all_notifications_mailgun_batch_backup(mock_post, users, live_server):
+    mock_post.return_value.json.return_value = {'id': '<batch@mailgun>'}
+    batch = [m.Notification.objects.create(email=user.username,
+                                           type=m.NotificationType.account_created,
+                                           meta={'activate_url': 'https://activate/{}'.format(user.pk)})
+             for user in users[:3]]
+
+    tasks.process_all_notifications_runner()
+
+    assert mock_post.call_count == 2, "one backup copy of the batch"
+    backup_data = mock_post.call_args_list[1][1]['data']
+    assert backup_data['to'] == config.EMAIL_NOTIFICATIONS__BACKUP_ADDRESS
+    assert backup_data['subject'].endswith(' >>> {} and 2 more'.format(batch[0].email))
+    assert batch[0].meta['activate_url'] in backup_data['html']
+    assert '%recipient.' not in backup_data['html']
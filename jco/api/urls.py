@@ -14,6 +14,9 @@ urlpatterns = [
     # url(r'^rest-auth/registration/', include('rest_auth.registration.urls')),
     url(r'^transactions/', views.TransactionsListView.as_view()),
     url(r'^account/', views.AccountView.as_view()),
+    url(r'^dashboard/', views.DashboardView.as_view()),
+    url(r'^events/token/', views.UserEventsTokenView.as_view()),
+    url(r'^events/', views.UserEventsView.as_view()),
     url(r'^raised-tokens/', views.RaisedTokensView.as_view()),
 
     url(r'^withdraw-address/$', views.EthAddressView.as_view()),
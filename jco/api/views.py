@@ -1,19 +1,27 @@
 from datetime import datetime
-from itertools import chain
 from operator import itemgetter
+import base64
+import binascii
+import hashlib
+import json
 import logging
 
 from rest_framework.views import APIView
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
-from rest_framework import authentication, permissions
+from rest_framework import permissions
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.http import StreamingHttpResponse
 from django.utils.translation import ugettext_lazy as _
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework_extensions.cache.decorators import cache_response
 from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
-from django.db import transaction
+from rest_framework.utils.urls import replace_query_param
+from django.db import connection, transaction
 
 from allauth.account.models import EmailAddress
 from allauth.account.utils import send_email_confirmation
@@ -21,14 +29,20 @@ from jco.api.models import (
     Transaction,
     Address,
     Account,
-    get_raised_tokens,
+    get_cached_raised_tokens,
     Withdraw,
     PresaleJnt,
     Operation,
-    OperationError
+    OperationError,
+    get_transactions_keys,
+    UserVersion,
+    TRANSACTIONS_KIND_PURCHASE,
+    TRANSACTIONS_KIND_WITHDRAW,
+    TRANSACTIONS_KIND_PRESALE,
 )
 from jco.api.serializers import (
     AccountSerializer,
+    DashboardAccountSerializer,
     AddressSerializer,
     EthAddressSerializer,
     ResendEmailConfirmationSerializer,
@@ -40,6 +54,10 @@ from jco.api.serializers import (
     OperationConfirmSerializer,
 )
 from jco.api import tasks
+from jco.api.authentication import (CachedTokenAuthentication,
+                                    UserEventsTokenAuthentication,
+                                    make_user_events_token)
+from jco.api.events import iter_user_events, format_server_sent_event
 from jco.appprocessor import commands
 from jco.commonutils import ga_integration
 
@@ -47,6 +65,15 @@ from jco.commonutils import ga_integration
 logger = logging.getLogger(__name__)
 
 
+def user_version_etag(request, *args, **kwargs):
+    """
+    ETag of per-user resource, changes with UserVersion of the user and the requested URL
+    """
+    version = UserVersion.get_version(request.user)
+    tag = '{}:{}:{}'.format(request.user.pk, version, request.get_full_path())
+    return hashlib.md5(tag.encode()).hexdigest()
+
+
 class TransactionsListView(APIView):
     """
     View to list all transactions  for user binded ETH and BTC addresses.
@@ -54,22 +81,74 @@ class TransactionsListView(APIView):
     * Requires token authentication.
     """
 
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
 
+    @method_decorator(condition(etag_func=user_version_etag))
     def get(self, request):
-        txs_qs = Transaction.objects.filter(address__user=request.user).exclude(jnt=None)
-        withdrawals_qs = Withdraw.objects.filter(user=request.user)
-        presale_jnt_qs = PresaleJnt.objects.filter(user=request.user)
+        try:
+            after = decode_transactions_cursor(request.query_params.get('cursor'))
+            limit = int(request.query_params.get('limit', settings.TRANSACTIONS_LIST__PAGE_SIZE))
+        except ValueError:
+            return Response({'detail': _('Invalid cursor or limit')}, status=400)
+        limit = max(1, min(limit, settings.TRANSACTIONS_LIST__MAX_PAGE_SIZE))
 
-        txs = TransactionSerializer(txs_qs, many=True).data
-        withdrawals = WithdrawSerializer(withdrawals_qs, many=True).data
-        presale_jnt = PresaleJntSerializer(presale_jnt_qs, many=True).data
+        result_list, next_key = get_transactions_list(request.user, limit, after)
+        headers = {}
+        if next_key is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor',
+                                           encode_transactions_cursor(next_key))
+            headers['Link'] = '<{}>; rel="next"'.format(next_url)
+        return Response(result_list, headers=headers)
 
-        result_list = sorted(
-            chain(presale_jnt, txs, withdrawals),
-            key=lambda t: t.pop('_date'),
-            reverse=True)
-        return Response(result_list)
+
+TRANSACTIONS_SERIALIZERS = {
+    TRANSACTIONS_KIND_PURCHASE: (Transaction.objects.select_related('jnt', 'address'), TransactionSerializer),
+    TRANSACTIONS_KIND_WITHDRAW: (Withdraw.objects.all(), WithdrawSerializer),
+    TRANSACTIONS_KIND_PRESALE: (PresaleJnt.objects.all(), PresaleJntSerializer),
+}
+
+
+def get_transactions_list(user, limit=settings.TRANSACTIONS_LIST__PAGE_SIZE, after=None):
+    """
+    Get page of user purchases, withdrawals and presale JNT, newest first.
+    Returns serialized page and the key to continue after, None if it is the last page
+    """
+    keys = get_transactions_keys(user, limit + 1, after)
+    next_key = keys[limit - 1] if len(keys) > limit else None
+    keys = keys[:limit]
+
+    rows = {}
+    for kind, (queryset, serializer_class) in TRANSACTIONS_SERIALIZERS.items():
+        ids = [key[1] for key in keys if key[0] == kind]
+        if not ids:
+            continue
+        objects = list(queryset.filter(pk__in=ids))
+        for obj, data in zip(objects, serializer_class(objects, many=True).data):
+            data.pop('_date')
+            rows[(kind, obj.pk)] = data
+
+    result_list = [rows[(kind, pk)] for kind, pk, date in keys if (kind, pk) in rows]
+    return result_list, next_key
+
+
+def encode_transactions_cursor(key):
+    kind, pk, date = key
+    cursor = json.dumps([kind, pk, date.isoformat()])
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_transactions_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        kind, pk, date = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        date = parse_datetime(date)
+        pk = int(pk)
+    except (TypeError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        date = None
+    if date is None:
+        raise ValueError('Invalid cursor {}'.format(cursor))
+    return kind, pk, date
 
 
 class AccountView(GenericAPIView):
@@ -85,7 +164,7 @@ class AccountView(GenericAPIView):
     Updates account info for current user.
     """
 
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = AccountSerializer
 
     def ensure_account(self, request):
@@ -95,6 +174,7 @@ class AccountView(GenericAPIView):
             account = Account.objects.create(user=request.user)
         return account
 
+    @method_decorator(condition(etag_func=user_version_etag))
     def get(self, request):
         account = self.ensure_account(request)
         serializer = AccountSerializer(account)
@@ -120,6 +200,73 @@ class AccountView(GenericAPIView):
             Address.assign_pair_to_user(account.user)
 
 
+class DashboardView(APIView):
+    """
+    View to get account info and transactions list of current user in one request.
+
+    * Requires token authentication.
+    """
+
+    authentication_classes = (CachedTokenAuthentication,)
+
+    @method_decorator(condition(etag_func=user_version_etag))
+    def get(self, request):
+        try:
+            account = Account.get_with_dashboard_data(request.user)
+        except Account.DoesNotExist:
+            Account.objects.create(user=request.user)
+            account = Account.get_with_dashboard_data(request.user)
+        transactions_list, next_key = get_transactions_list(request.user)
+        return Response({
+            'account': DashboardAccountSerializer(account).data,
+            'transactions': transactions_list,
+            'transactions_next_cursor': encode_transactions_cursor(next_key) if next_key else None,
+        })
+
+
+class UserEventsTokenView(APIView):
+    """
+    Short-lived token of the user events stream, it's passed in the `token` query parameter of /api/events/.
+    A new token is requested when the stream is reconnected after the token is expired.
+
+    * Requires token authentication.
+    """
+
+    authentication_classes = (CachedTokenAuthentication,)
+
+    def post(self, request):
+        return Response({'token': make_user_events_token(request.user),
+                         'expires_in': settings.USER_EVENTS__TOKEN_TTL})
+
+
+class UserEventsView(APIView):
+    """
+    Server-sent events stream of deposits, JNT credits and withdraw status changes of current user.
+    Streams are served by the gevent instance (uwsgi-events.yml), events come from the shared listener.
+
+    * Requires the events token (see UserEventsTokenView) or token authentication.
+    """
+
+    authentication_classes = (CachedTokenAuthentication, UserEventsTokenAuthentication)
+
+    def get(self, request):
+        user_id = request.user.pk
+
+        def stream():
+            # the request connection is not held for the stream duration
+            connection.close()
+            yield 'retry: {}\n\n'.format(settings.USER_EVENTS__RETRY_MS)
+            for event in iter_user_events(user_id,
+                                          settings.USER_EVENTS__STREAM_DURATION,
+                                          settings.USER_EVENTS__HEARTBEAT_INTERVAL):
+                yield format_server_sent_event(event)
+
+        response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
 class ResendEmailConfirmationView(GenericAPIView):
     """
     Re-send email confirmation email
@@ -149,9 +296,8 @@ class RaisedTokensView(GenericAPIView):
 
     permission_classes = (permissions.AllowAny,)
 
-    @cache_response(20)
     def get(self, request):
-        data = {'raised_tokens': get_raised_tokens()}
+        data = {'raised_tokens': get_cached_raised_tokens()}
         return Response(data)
 
 
@@ -160,7 +306,7 @@ class EthAddressView(GenericAPIView):
     Get/set withdraw address for account
     """
 
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = EthAddressSerializer
 
     def ensure_account(self, request):
@@ -348,7 +494,7 @@ class DocumentView(APIView):
     Creates a document for current user.
     """
 
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = DocumentSerializer
     parser_classes = (JSONParser, FormParser, MultiPartParser,)
 
@@ -67,6 +67,11 @@ class NotificationType:
     presale_account_created    = 'presale_account_created'
 
 
+class OutboxEventType:
+    transaction_received = 'transaction_received'
+    transaction_received_sold_out = 'transaction_received_sold_out'
+
+
 # account_01_01 = "Password change request"
 # account_01_02 = "Your password was updated"
 # account_02_01 = "ETH Address change request"
@@ -324,6 +329,24 @@ class Address(db.Model):
         }
 
 
+# Assign free ETH and BTC addresses to the user in one statement, shared by the API and the processor.
+# Concurrent assignments skip each other's locked addresses instead of queueing on them
+ASSIGN_ADDRESS_PAIR_SQL = """
+WITH eth AS (SELECT id FROM address
+              WHERE type = %(eth)s AND user_id IS NULL AND is_usable
+              ORDER BY id LIMIT 1
+                FOR UPDATE SKIP LOCKED),
+     btc AS (SELECT id FROM address
+              WHERE type = %(btc)s AND user_id IS NULL AND is_usable
+              ORDER BY id LIMIT 1
+                FOR UPDATE SKIP LOCKED)
+UPDATE address
+   SET user_id = %(user_id)s
+ WHERE id IN (SELECT id FROM eth UNION ALL SELECT id FROM btc)
+RETURNING type, address
+"""
+
+
 class Transaction(db.Model):
     # Fields
     id = db.Column(db.Integer, primary_key=True)
@@ -513,10 +536,17 @@ class Withdraw(db.Model):
     status = db.Column(db.String(20), nullable=False, default=TransactionStatus.not_confirmed)
     meta = db.Column(JSONB, nullable=False, default=lambda: {})
     user_id = db.Column(db.Integer, db.ForeignKey('auth_user.id'), unique=False)
+    nonce = db.Column(db.Integer, nullable=True)
+    sent = db.Column(db.DateTime, nullable=True)
+    raw_tx = db.Column(db.Unicode, nullable=True)
 
     # Relationships
     user = db.relationship(User, back_populates="withdraws")  # type: User
 
+    # Meta keys
+    meta_key_gas_price = 'gas_price'
+    meta_key_transaction_ids = 'transaction_ids'
+
     # Methods
     def as_dict(self):
         return {
@@ -529,6 +559,31 @@ class Withdraw(db.Model):
             'status': self.status,
         }
 
+    def get_gas_price(self) -> Optional[int]:
+        if self.meta_key_gas_price not in self.meta:
+            return None
+        return self.meta[self.meta_key_gas_price]
+
+    def set_gas_price(self, value: int):
+        if self.meta is None:
+            self.meta = {}
+        self.meta[self.meta_key_gas_price] = value
+        flag_modified(self, "meta")
+
+    def get_transaction_ids(self) -> List[str]:
+        """
+        Hashes of all transactions broadcasted for the withdraw, any of them can be mined
+        """
+        if self.meta_key_transaction_ids not in self.meta:
+            return [self.transaction_id] if self.transaction_id else []
+        return self.meta[self.meta_key_transaction_ids]
+
+    def set_transaction_ids(self, value: List[str]):
+        if self.meta is None:
+            self.meta = {}
+        self.meta[self.meta_key_transaction_ids] = value
+        flag_modified(self, "meta")
+
     def __repr__(self):
         fieldsToPrint = (('id', self.id),
                          ('transaction_id', self.transaction_id),
@@ -557,6 +612,8 @@ class Notification(db.Model):
     is_sended = db.Column(db.Boolean, nullable=False, default=False)
     rendered_message = db.Column(db.Unicode, nullable=True)
     meta = db.Column(JSONB, nullable=False, default=lambda: {})
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
     user = db.relationship(User, back_populates="notifications")  # type: User
@@ -677,6 +734,119 @@ class PresaleJnt(db.Model):
     user = db.relationship(User, back_populates="presales")  # type: User
 
 
+class OutboxEvent(db.Model):
+    """
+    Side effect of the JNT pipeline, persisted with the same commit as the pipeline changes
+    """
+    __tablename__ = 'outbox_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(50), nullable=False)
+    payload = db.Column(JSONB, nullable=False, default=lambda: {})
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed = db.Column(db.DateTime, nullable=True)
+    failed_attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        fieldsToPrint = (('id', self.id),
+                         ('event', self.event),
+                         ('payload', self.payload),
+                         ('created', self.created),
+                         ('processed', self.processed),
+                         ('failed_attempts', self.failed_attempts))
+
+        argsString = ', '.join(['{}={}'.format(f[0], '"' + f[1] + '"' if (type(f[1]) == str) else f[1])
+                                for f in fieldsToPrint])
+        return '<{}({})>'.format(self.__class__.__name__, argsString)
+
+
+class SaleTotals(db.Model):
+    """
+    Sale totals counter (single row), maintained by DB triggers on JNT and presale_jnt
+    """
+    __tablename__ = 'sale_totals'
+
+    singleton_id = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    jnt_value = db.Column(db.Float, nullable=False, default=0)
+    presale_jnt_value = db.Column(db.Float, nullable=False, default=0)
+    presale_round_jnt_value = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class UserBalance(db.Model):
+    """
+    JNT balance of user, maintained by DB triggers together with balance_ledger entries
+    """
+    __tablename__ = 'user_balance'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('auth_user.id'), primary_key=True)
+    balance = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class AddressPoolCursor(db.Model):
+    """
+    Next derivation index of the deposit address pool of the currency
+    """
+    __tablename__ = 'address_pool_cursor'
+
+    type = db.Column(db.String(10), primary_key=True)
+    next_index = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class EthNonce(db.Model):
+    """
+    Next nonce to allocate for transactions sent from the address
+    """
+    __tablename__ = 'eth_nonce'
+
+    address = db.Column(db.String(255), primary_key=True)
+    next_nonce = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class EthBlockCursor(db.Model):
+    """
+    Last processed block of the blockchain scanner
+    """
+    __tablename__ = 'eth_block_cursor'
+
+    name = db.Column(db.String(50), primary_key=True)
+    block_number = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+    # Names
+    withdraw_transfers = 'withdraw_transfers'
+
+
+class UserVersion(db.Model):
+    """
+    Version stamp of user data shown by API, bumped by DB triggers
+    """
+    __tablename__ = 'user_version'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class BalanceLedger(db.Model):
+    """
+    Append-only log of JNT balance changes
+    """
+    __tablename__ = 'balance_ledger'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('auth_user.id'), nullable=False, index=True)
+    delta = db.Column(db.Float, nullable=False)
+    source = db.Column(db.String(20), nullable=False)
+    source_id = db.Column(db.Integer, nullable=True)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
 class UserJntPrice(db.Model):
     """
     # 71 Custom JNT price for user
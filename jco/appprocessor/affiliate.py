@@ -10,6 +10,7 @@ import logging
 
 from sqlalchemy.sql.expression import and_, or_
 from sqlalchemy.types import Integer as sa_Integer
+from sqlalchemy.dialects.postgresql import insert
 
 from jco.appdb.db import session
 from jco.appdb.models import *
@@ -82,6 +83,25 @@ def get_affiliate_url(_account: Account, _event: str, _transaction: Optional[Tra
     return ""
 
 
+def add_transaction_affiliate(_account: Account, _transaction: Transaction) -> bool:
+    """
+    Add affiliate transaction event in the session transaction, commit is up to the caller.
+    The event of the transaction is added once, it's unique by the affiliate_transaction index
+    """
+    if get_affiliate(_account) is None:
+        return False
+
+    _event = AffiliateEvent.transaction
+    result = session.execute(insert(Affiliate)
+                             .values(user_id=_account.user_id,
+                                     event=_event,
+                                     url=get_affiliate_url(_account, _event, _transaction),
+                                     created=datetime.utcnow(),
+                                     meta={Affiliate.meta_key_transaction_id: _transaction.id})
+                             .on_conflict_do_nothing())
+    return result.rowcount > 0
+
+
 def check_new_events():
     check_new_registartions()
     check_new_transactions()
@@ -151,11 +171,7 @@ def check_new_transactions():
 
         for transaction, account in records:
             try:
-                affiliate = Affiliate(user_id=account.user_id,
-                                      event=_event,
-                                      url=get_affiliate_url(account, _event, transaction),
-                                      meta={Affiliate.meta_key_transaction_id: transaction.id})
-                session.add(affiliate)
+                add_transaction_affiliate(account, transaction)
                 session.commit()
             except Exception:
                 exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
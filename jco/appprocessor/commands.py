@@ -3,6 +3,7 @@ import string
 import time
 import sys
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Tuple, Optional, Dict, List
 import requests
@@ -13,15 +14,16 @@ from mnemonic import Mnemonic
 from pycoin.key.BIP32Node import BIP32Node
 from sqlalchemy.sql.expression import not_, or_, and_
 from sqlalchemy.types import Boolean, Integer
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, distinct
 from sqlalchemy.orm.util import aliased
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects.postgresql import insert, array
 from sqlalchemy.sql import func
 from psycopg2 import tz
 
 from jco.appdb.db import session
 from jco.appdb.models import *
 from jco.commonutils.crypto import HDPrivateKey, HDKey
+from jco.commonutils.address_derivation import derive_addresses, iter_address_chunks
 from jco.commonutils.bitfinex import Bitfinex
 from jco.commonconfig.config import (INVESTMENTS__TOKEN_PRICE_IN_USD,
                                      INVESTMENTS__PUBLIC_SALE__START_DATE,
@@ -38,19 +40,71 @@ from jco.commonconfig.config import (INVESTMENTS__TOKEN_PRICE_IN_USD,
                                      RAISED_TOKENS_SHIFT,
                                      TOKENS__TOTAL_SUPPLY,
                                      EMAIL_NOTIFICATIONS__SUPPORT_ADDRESS,
-                                     ETH_CONTRACT__MAX_PENDING_COUNT)
+                                     ETH_CONTRACT__MAX_PENDING_COUNT,
+                                     ETH_NONCE__STUCK_TIMEOUT,
+                                     ETH_MANAGER__ADDRESS,
+                                     ETH_MULTI_TRANSFER__ADDRESS,
+                                     ETH_MULTI_TRANSFER__BATCH_SIZE,
+                                     ETH_WITHDRAW_SIGNING__PROCESSES,
+                                     ETH_WITHDRAW_LOGS__CONFIRMATIONS,
+                                     ETH_WITHDRAW_LOGS__MAX_BLOCK_RANGE,
+                                     ETH_WITHDRAW_LOGS__INITIAL_DEPTH,
+                                     OUTBOX__BATCH_SIZE,
+                                     OUTBOX__MAX_ATTEMPTS,
+                                     ADDRESS_POOL__ETH_XPUB,
+                                     ADDRESS_POOL__BTC_XPUB,
+                                     ADDRESS_POOL__MIN_FREE,
+                                     ADDRESS_POOL__BATCH_SIZE,
+                                     ADDRESS_DERIVATION__PROCESSES,
+                                     ADDRESS_DERIVATION__CHUNK_SIZE)
 from jco.commonconfig.config import ETHERSCAN_API_KEY, ETHERSCAN_TIMEOUT, BLOCKCHAININFO_TIMEOUT
 from jco.commonutils.utils import *
 from jco.commonutils.ga_integration import *
 from jco.commonutils.formats import *
 from jco.commonutils.ethaddress_verify import is_valid_address
-from jco.commonutils.contract import mintJNT, getTransactionInfo
+from jco.commonutils.contract import (signJNTTransfers,
+                                     signNonceFiller,
+                                     getTransactionHash,
+                                     sendSignedTransaction,
+                                     getTransferGasPrice,
+                                     getTransactionsInfo,
+                                     getManagerNonce,
+                                     getBlockNumber,
+                                     getWithdrawTransferLogs)
+from jco.commonutils.ethjsonrpc import hex_to_dec
+from jco.appprocessor.affiliate import add_transaction_affiliate
+from jco.appprocessor.nonce_manager import allocate_nonce, resync_nonce, release_nonces
 
 
 #
 # Generate btc/eth addresses
 #
 
+def insert_addresses(addresses: List[str], currency: str, is_usable: bool) -> int:
+    """
+    Insert addresses with a single multi-row INSERT, existing addresses are skipped
+    """
+    if not addresses:
+        return 0
+    result = session.execute(insert(Address)
+                             .values([{'address': address,
+                                       'type': currency,
+                                       'is_usable': is_usable,
+                                       'meta': {}} for address in addresses])
+                             .on_conflict_do_nothing(index_elements=['address']))
+    return result.rowcount
+
+
+def generate_addresses(currency: str, xpub: str, key_count: int, offset: int, is_usable: bool) -> int:
+    inserted_count = 0
+    for addresses in iter_address_chunks(currency, xpub, offset, key_count,
+                                         processes=ADDRESS_DERIVATION__PROCESSES,
+                                         chunk_size=ADDRESS_DERIVATION__CHUNK_SIZE):
+        inserted_count += insert_addresses(addresses, currency, is_usable)
+    session.commit()
+    return inserted_count
+
+
 def generate_eth_addresses(mnemonic: str, key_count: int, *, offset: int = 0, is_usable: bool = True) -> bool:
     logging.getLogger(__name__).info("Start to generate ETH addresses")
 
@@ -62,18 +116,10 @@ def generate_eth_addresses(mnemonic: str, key_count: int, *, offset: int = 0, is
     # print('Account Master Public Key (Hex): ' + acct_pub_key.to_hex())
     # print('XPUB format: ' + acct_pub_key.to_b58check())
 
-    # Generate addresses for external chain (not change address)
-    change = 0
-    for index in range(offset, key_count + offset):
-        keys = HDKey.from_path(acct_pub_key, '{change}/{index}'.format(change=change, index=index))
-        address = Address()
-        address.address = checksum_encode(keys[-1].address()[2:])
-        address.type = CurrencyType.eth
-        address.is_usable = is_usable
-        session.add(address)
-    session.commit()
+    inserted_count = generate_addresses(CurrencyType.eth, acct_pub_key.to_b58check(), key_count, offset, is_usable)
 
-    logging.getLogger(__name__).info("Finished to generate ETH addresses")
+    logging.getLogger(__name__).info("Finished to generate ETH addresses, {} of {} are new"
+                                     .format(inserted_count, key_count))
     return True
 
 
@@ -85,18 +131,87 @@ def generate_btc_addresses(mnemonic: str, key_count: int, *, offset: int = 0, is
     # print('xprv', node.wallet_key(True))
     # print('XPUB format:', node.wallet_key())
 
-    # Generate addresses
-    for index in range(offset, key_count + offset):
-        subnode = node.subkey_for_path("44'/0'/0'/0/%d" % index)
-        address = Address()
-        address.address = subnode.address()
-        address.type = CurrencyType.btc
-        address.is_usable = is_usable
-        session.add(address)
+    inserted_count = generate_addresses(CurrencyType.btc, node.subkey_for_path("44'/0'/0'").hwif(),
+                                        key_count, offset, is_usable)
 
-    session.commit()
+    logging.getLogger(__name__).info("Finished to generate BTC addresses, {} of {} are new"
+                                     .format(inserted_count, key_count))
+    return True
+
+
+#
+# Replenish deposit address pool
+#
+
+def get_free_addresses_count(currency: str) -> int:
+    return session.query(func.count(Address.id)) \
+        .filter(Address.type == currency) \
+        .filter(Address.user_id.is_(None)) \
+        .filter(Address.is_usable == True) \
+        .scalar()
+
+
+def get_addresses_count(currency: str) -> int:
+    return session.query(func.count(Address.id)) \
+        .filter(Address.type == currency) \
+        .scalar()
+
+
+def replenish_address_pool(*,
+                           xpubs: Optional[Dict[str, str]] = None,
+                           min_free: int = ADDRESS_POOL__MIN_FREE,
+                           batch_size: int = ADDRESS_POOL__BATCH_SIZE) -> bool:
+    if xpubs is None:
+        xpubs = {CurrencyType.eth: ADDRESS_POOL__ETH_XPUB,
+                 CurrencyType.btc: ADDRESS_POOL__BTC_XPUB}
+
+    for currency, xpub in xpubs.items():
+        # noinspection PyBroadException
+        try:
+            if not xpub:
+                continue
+
+            free_count = get_free_addresses_count(currency)
+            if free_count >= min_free:
+                continue
+
+            logging.getLogger(__name__).info("{} free {} addresses left, start to replenish the pool"
+                                             .format(free_count, currency))
+
+            # addresses generated from the mnemonic take the first indexes of the same xpub
+            session.execute(insert(AddressPoolCursor)
+                            .values(type=currency,
+                                    next_index=get_addresses_count(currency),
+                                    updated_at=datetime.utcnow())
+                            .on_conflict_do_nothing(index_elements=['type']))
+            cursor = session.query(AddressPoolCursor) \
+                .filter(AddressPoolCursor.type == currency) \
+                .with_for_update() \
+                .one()  # type: AddressPoolCursor
+
+            # the pool could be replenished by another worker while the cursor was locked
+            free_count = get_free_addresses_count(currency)
+            inserted_count = 0
+            while free_count < min_free:
+                # celery workers are daemonic processes and can't have a process pool
+                addresses = derive_addresses(currency, xpub, cursor.next_index, batch_size, processes=1)
+                # addresses of the range could be already generated from the mnemonic
+                batch_inserted_count = insert_addresses(addresses, currency, True)
+
+                cursor.next_index += batch_size
+                inserted_count += batch_inserted_count
+                free_count += batch_inserted_count
+            cursor.updated_at = datetime.utcnow()
+            session.commit()
+
+            logging.getLogger(__name__).info("Added {} {} addresses to the pool, next index is {}"
+                                             .format(inserted_count, currency, cursor.next_index))
+        except Exception:
+            exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+            logging.getLogger(__name__).error("Failed to replenish {} address pool due to error:\n{}"
+                                              .format(currency, exception_str))
+            session.rollback()
 
-    logging.getLogger(__name__).info("Finished to generate BTC addresses")
     return True
 
 
@@ -700,15 +815,12 @@ def get_user_custom_price(user_id: int) -> Optional[float]:
 # Get total JNT tokens
 #
 def get_total_jnt_amount() -> float:
-    total_presale_jnt = session.query(func.coalesce(func.sum(PresaleJnt.jnt_value), 0)) \
-        .filter(PresaleJnt.is_sale_allocation == True).as_scalar()
-
-    total_ico_jnt = session.query(func.coalesce(func.sum(JNT.jnt_value), 0)) \
-        .filter(JNT.is_sale_allocation == True).as_scalar()
-
-    jnt_sum = session.query(total_presale_jnt + total_ico_jnt) \
-        .one()  # type: tuple[float]
-    return RAISED_TOKENS_SHIFT + jnt_sum[0]
+    jnt_sum = session.query(SaleTotals.jnt_value
+                            + SaleTotals.presale_jnt_value
+                            + SaleTotals.presale_round_jnt_value) \
+        .filter(SaleTotals.id == SaleTotals.singleton_id) \
+        .scalar()  # type: Optional[float]
+    return RAISED_TOKENS_SHIFT + (jnt_sum or 0)
 
 
 #
@@ -741,7 +853,7 @@ def calculate_jnt_purchases():
             # noinspection PyBroadException
             try:
                 if tx.mined >= INVESTMENTS__PUBLIC_SALE__END_DATE.replace(tzinfo=tz.FixedOffsetTimezone(offset=0, name=None)):
-                    send_email_transaction_received_sold_out(tx.address.user.email, tx.address.user_id, tx.as_dict())
+                    add_outbox_event(OutboxEventType.transaction_received_sold_out, {'transaction_id': tx.id})
                     tx.set_skip_jnt_calculation(True)
                     session.commit()
                     continue
@@ -766,9 +878,9 @@ def calculate_jnt_purchases():
                                                       .format(account.user_id))
                 elif get_total_jnt_amount() + tx_jnt_value > TOKENS__TOTAL_SUPPLY:
                     tx.set_skip_jnt_calculation(True)
-                    session.commit()
                     if account and account.is_sale_allocation:
-                        send_email_transaction_received_sold_out(tx.address.user.email, tx.address.user_id, tx.as_dict())
+                        add_outbox_event(OutboxEventType.transaction_received_sold_out, {'transaction_id': tx.id})
+                    session.commit()
                     continue
 
                 jnt = JNT()
@@ -779,19 +891,9 @@ def calculate_jnt_purchases():
                 jnt.transaction = tx
                 jnt.is_sale_allocation = account.is_sale_allocation if account else True
 
+                add_outbox_event(OutboxEventType.transaction_received, {'transaction_id': tx.id})
                 session.commit()
 
-                send_email_transaction_received(tx.address.user.email, tx.address.user_id,
-                                                tx.as_dict(), jnt.as_dict())
-
-                try:
-                    on_transaction_received(tx.address.user.account, tx, jnt)
-                except Exception:
-                    exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
-                    logging.getLogger(__name__).error(
-                        "Failed GA tracking for TX {} due to exception:\n{}"
-                        .format(tx.id, exception_str))
-
                 logging.getLogger(__name__).info("New JNT purchase persisted: {}".format(jnt))
             except Exception:
                 exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
@@ -807,6 +909,116 @@ def calculate_jnt_purchases():
         session.rollback()
 
 
+#
+# Transactional outbox of the JNT pipeline side effects
+#
+
+class OutboxDispatchError(Exception):
+    pass
+
+
+def add_outbox_event(event: str, payload: dict) -> OutboxEvent:
+    """
+    Add side effect event to the session, it is persisted with the same commit as the caller changes
+    """
+    outbox_event = OutboxEvent(event=event, payload=payload)
+    session.add(outbox_event)
+    return outbox_event
+
+
+def _dispatch_transaction_received(payload: dict) -> List:
+    tx = session.query(Transaction) \
+        .filter(Transaction.id == payload['transaction_id']) \
+        .one()  # type: Transaction
+    jnt = tx.jnt_purchase
+    user = tx.address.user
+
+    if not send_email_transaction_received(user.email, user.id, tx.as_dict(), jnt.as_dict(), commit=False):
+        raise OutboxDispatchError("Failed to add notification for TX {}".format(tx.id))
+    if user.account:
+        add_transaction_affiliate(user.account, tx)
+
+    def _track_ga():
+        on_transaction_received(user.account, tx, jnt)
+
+    return [_track_ga]
+
+
+def _dispatch_transaction_received_sold_out(payload: dict) -> List:
+    tx = session.query(Transaction) \
+        .filter(Transaction.id == payload['transaction_id']) \
+        .one()  # type: Transaction
+    user = tx.address.user
+
+    if not send_email_transaction_received_sold_out(user.email, user.id, tx.as_dict(), commit=False):
+        raise OutboxDispatchError("Failed to add sold out notification for TX {}".format(tx.id))
+    return []
+
+
+OUTBOX_DISPATCHERS = {
+    OutboxEventType.transaction_received: _dispatch_transaction_received,
+    OutboxEventType.transaction_received_sold_out: _dispatch_transaction_received_sold_out,
+}
+
+
+def dispatch_outbox_events(*, batch_size: int = OUTBOX__BATCH_SIZE):
+    """
+    Drain outbox in batches: notifications and affiliates are persisted in the batch transaction,
+    GA requests are sent after the batch commit
+    """
+    # noinspection PyBroadException
+    try:
+        logging.getLogger(__name__).info("Start to dispatch outbox events")
+
+        last_event_id = 0
+        while True:
+            events = session.query(OutboxEvent) \
+                .filter(OutboxEvent.processed.is_(None)) \
+                .filter(OutboxEvent.failed_attempts < OUTBOX__MAX_ATTEMPTS) \
+                .filter(OutboxEvent.id > last_event_id) \
+                .order_by(OutboxEvent.id) \
+                .limit(batch_size) \
+                .with_for_update(skip_locked=True) \
+                .all()  # type: List[OutboxEvent]
+            if len(events) == 0:
+                break
+            last_event_id = events[-1].id
+
+            post_commit_callbacks = []
+            for event in events:
+                # noinspection PyBroadException
+                try:
+                    with session.begin_nested():
+                        post_commit_callbacks.extend(OUTBOX_DISPATCHERS[event.event](event.payload))
+                    event.processed = datetime.utcnow()
+                except Exception:
+                    event.failed_attempts += 1
+                    exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+                    logging.getLogger(__name__).error("Failed to dispatch outbox event {} due to exception:\n{}"
+                                                      .format(event.id, exception_str))
+            session.commit()
+
+            for callback in post_commit_callbacks:
+                # noinspection PyBroadException
+                try:
+                    callback()
+                except Exception:
+                    exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+                    logging.getLogger(__name__).error("Failed outbox post commit callback due to exception:\n{}"
+                                                      .format(exception_str))
+
+            logging.getLogger(__name__).info("Dispatched {} outbox events".format(len(events)))
+            if len(events) < batch_size:
+                break
+
+        logging.getLogger(__name__).info("Finished to dispatch outbox events")
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to dispatch outbox events due to exception:\n{}"
+                                          .format(exception_str))
+        session.rollback()
+
+
 def get_ticker_price(fixed_currency: str, variable_currency: str, _time) -> Optional[float]:
     td = timedelta(minutes=5)
 
@@ -1124,18 +1336,9 @@ def assign_addresses(user_id: int) -> bool:
         if user is None:
             return False
 
-        for currency in [CurrencyType.btc, CurrencyType.eth]:
-            addressIdSubquery = session.query(Address.id) \
-                .filter(Address.type == currency) \
-                .filter(Address.is_usable == True) \
-                .filter(Address.user_id.is_(None)) \
-                .order_by(Address.id) \
-                .limit(1) \
-                .subquery()
-            session.query(Address) \
-                .filter(Address.id.in_(addressIdSubquery)) \
-                .update({Address.user_id: user_id}, synchronize_session=False)
-
+        session.connection().execute(ASSIGN_ADDRESS_PAIR_SQL, {'user_id': user_id,
+                                                               'eth': CurrencyType.eth,
+                                                               'btc': CurrencyType.btc})
         session.commit()
 
         logging.getLogger(__name__).info("Addresses assigned for a user with ID '{}'"
@@ -1153,46 +1356,220 @@ def assign_addresses(user_id: int) -> bool:
         return False
 
 
-def withdraw_processing():
+def group_withdraws_by_nonce(withdraws: List[Withdraw]) -> List[List[Withdraw]]:
+    groups = {}  # type: Dict[int, List[Withdraw]]
+    for withdraw in withdraws:
+        groups.setdefault(withdraw.nonce, []).append(withdraw)
+    return [groups[nonce] for nonce in sorted(groups)]
+
+
+def set_withdraws_signed(withdraws: List[Withdraw], raw_tx: str, gas_price: int):
+    """
+    Store the signed transaction of withdraws sharing a nonce. They are pending with the transaction hash
+    before the broadcast, so a lost or rejected broadcast is handled by resync and confirmation of pending withdraws
+    """
+    tx_id = getTransactionHash(raw_tx)
+    for withdraw in withdraws:
+        tx_ids = withdraw.get_transaction_ids()
+        if tx_id not in tx_ids:
+            withdraw.set_transaction_ids(tx_ids + [tx_id])
+        withdraw.raw_tx = raw_tx
+        withdraw.transaction_id = tx_id
+        withdraw.status = TransactionStatus.pending
+        withdraw.set_gas_price(gas_price)
+
+
+def resign_withdraws(withdraws: List[Withdraw], gas_price: int):
+    """
+    Sign the transaction of withdraws sharing a nonce again with another gas price
+    """
+    raw_tx = signJNTTransfers([(withdraw.to, withdraw.value) for withdraw in withdraws], withdraws[0].nonce, gas_price)
+    set_withdraws_signed(withdraws, raw_tx, gas_price)
+
+
+def release_withdraw(withdraw: Withdraw):
+    """
+    Return the withdraw which nonce is used by another transaction to the confirmed ones, it's signed with a new nonce
+    """
+    logging.getLogger(__name__).warning("Nonce {} of withdraw {} is used by another transaction, "
+                                        "transactions {} are not mined"
+                                        .format(withdraw.nonce, withdraw.id, withdraw.get_transaction_ids()))
+    withdraw.status = TransactionStatus.confirmed
+    withdraw.transaction_id = None
+    withdraw.set_transaction_ids([])
+    withdraw.nonce = None
+    withdraw.raw_tx = None
+    withdraw.sent = None
+
+
+def send_nonce_fillers(nonces: List[int], gas_price: int):
+    """
+    Broadcast transactions without value with the nonces abandoned by withdraws
+    """
+    for nonce in nonces:
+        if sendSignedTransaction(signNonceFiller(nonce, gas_price)):
+            logging.getLogger(__name__).info("Nonce {} is filled".format(nonce))
+        else:
+            logging.getLogger(__name__).error("Failed to fill nonce {}".format(nonce))
+
+
+def send_withdraws(withdraws: List[Withdraw]) -> bool:
+    """
+    Broadcast the signed transaction of withdraws sharing a nonce, it must be committed before.
+    Only the time of the attempt is stored, even if it fails, the node could still have the transaction
+    """
+    tx_id = sendSignedTransaction(withdraws[0].raw_tx)
+
+    sent = datetime.utcnow()
+    for withdraw in withdraws:
+        withdraw.sent = sent
+    session.commit()
+    return tx_id is not None
+
+
+def sign_transfers(transfers: List[List[Tuple[str, float]]],
+                   nonces: List[int],
+                   gas_price: int,
+                   processes: int = 1) -> List[str]:
+    """
+    Sign transactions of the JNT transfers offline, in a pool of `processes` if there are several
+    """
+    if processes <= 1 or len(transfers) <= 1:
+        return [signJNTTransfers(group, nonce, gas_price) for group, nonce in zip(transfers, nonces)]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(signJNTTransfers, transfers, nonces, [gas_price] * len(transfers)))
+
+
+def sign_withdraws(*, processes: int = ETH_WITHDRAW_SIGNING__PROCESSES):
+    """
+    Allocate nonces to the next confirmed withdraws and store their signed transactions,
+    they are pending until `withdraw_processing` broadcasts them
+    """
     # noinspection PyBroadException
     try:
-        logging.getLogger(__name__).info("Start to process new withdraws")
+        logging.getLogger(__name__).info("Start to sign new withdraws")
+
+        nonce_latest, nonce_pending = getManagerNonce()
+        if nonce_latest is None or nonce_pending is None:
+            logging.getLogger(__name__).error("Failed to sign new withdraws. Can't get nonce of the manager")
+            return
+
+        not_sent = session.query(Withdraw) \
+            .filter(Withdraw.status == TransactionStatus.confirmed) \
+            .filter(or_(Withdraw.transaction_id == "",
+                        Withdraw.transaction_id.is_(None)))
 
-        pending_withdraws = session.query(Withdraw) \
+        pending_count = session.query(func.count(distinct(Withdraw.transaction_id))) \
             .filter(Withdraw.status == TransactionStatus.pending) \
             .filter(Withdraw.transaction_id != "") \
-            .order_by(Withdraw.id) \
-            .all()  # type: List[Withdraw]
+            .scalar()
 
-        _limit_count = ETH_CONTRACT__MAX_PENDING_COUNT - len(pending_withdraws)
+        _limit_count = ETH_CONTRACT__MAX_PENDING_COUNT - pending_count
 
         if _limit_count <= 0:
-            logging.getLogger(__name__).info("Finished to process new withdraws. Over the limit.")
+            logging.getLogger(__name__).info("Finished to sign new withdraws. Over the limit.")
             return
 
-        withdraws = session.query(Withdraw) \
-            .filter(Withdraw.status == TransactionStatus.confirmed) \
-            .filter(or_(Withdraw.transaction_id == "",
-                        Withdraw.transaction_id.is_(None))) \
+        batch_size = ETH_MULTI_TRANSFER__BATCH_SIZE if ETH_MULTI_TRANSFER__ADDRESS else 1
+
+        # withdraws with allocated nonces go first, they fill gaps and are signed with the same group
+        groups = group_withdraws_by_nonce(not_sent
+                                          .filter(Withdraw.nonce.isnot(None))
+                                          .all())
+
+        withdraws = not_sent \
+            .filter(Withdraw.nonce.is_(None)) \
             .order_by(Withdraw.id) \
-            .limit(_limit_count)  # type: List[Withdraw]
+            .limit(max(_limit_count - len(groups), 0) * batch_size) \
+            .all()  # type: List[Withdraw]
+        groups += [withdraws[i:i + batch_size] for i in range(0, len(withdraws), batch_size)]
+        groups = groups[:_limit_count]
 
-        for withdraw in withdraws:
+        if len(groups) == 0:
+            logging.getLogger(__name__).info("Finished to sign new withdraws. No withdraws.")
+            return
+
+        gas_price = getTransferGasPrice()
+        if gas_price is None:
+            logging.getLogger(__name__).error("Failed to sign new withdraws. Can't get gas price")
+            return
+
+        for group in groups:
+            if group[0].nonce is None:
+                allocate_nonce(group, ETH_MANAGER__ADDRESS, nonce_pending)
+
+        raw_txs = sign_transfers([[(withdraw.to, withdraw.value) for withdraw in group] for group in groups],
+                                 [group[0].nonce for group in groups],
+                                 gas_price,
+                                 processes=processes)
+        for group, raw_tx in zip(groups, raw_txs):
+            set_withdraws_signed(group, raw_tx, gas_price)
+        session.commit()
+
+        logging.getLogger(__name__).info("Finished to sign new withdraws. Signed {} transactions of {} withdraws"
+                                         .format(len(groups), sum(len(group) for group in groups)))
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to sign withdraws due to exception:\n{}"
+                                          .format(exception_str))
+        session.rollback()
+
+
+def withdraw_processing():
+    """
+    Broadcast signed withdraws, lost and stuck pending withdraws are broadcasted again.
+    Stuck transactions are replaced with the bumped gas price, lost ones with a stale gas price are signed again.
+    Nonces abandoned by withdraws are filled, they block next transactions
+    """
+    # noinspection PyBroadException
+    try:
+        logging.getLogger(__name__).info("Start to process new withdraws")
+
+        nonce_latest, nonce_pending = getManagerNonce()
+        if nonce_latest is None or nonce_pending is None:
+            logging.getLogger(__name__).error("Failed to process new withdraws. Can't get nonce of the manager")
+            return
+
+        groups = group_withdraws_by_nonce(resync_nonce(ETH_MANAGER__ADDRESS, nonce_latest, nonce_pending))
+        gaps = release_nonces(ETH_MANAGER__ADDRESS, nonce_pending)
+        if len(groups) == 0 and len(gaps) == 0:
+            logging.getLogger(__name__).info("Finished to process new withdraws. No withdraws.")
+            return
+
+        gas_price = getTransferGasPrice()
+        if gas_price is None:
+            logging.getLogger(__name__).error("Failed to process new withdraws. Can't get gas price")
+            return
+
+        send_nonce_fillers(gaps, gas_price)
+
+        for group in groups:
             try:
-                tx_id = mintJNT(withdraw.to, withdraw.value)
-                if tx_id:
-                    withdraw.transaction_id = tx_id
-                    withdraw.status = TransactionStatus.pending
-                    session.commit()
+                if group[0].nonce < nonce_pending:
+                    # stuck in the node, the replacement with the same nonce must have the bumped gas price
+                    replacement_gas_price = getTransferGasPrice(group[0].get_gas_price() or gas_price)
+                    if replacement_gas_price is None:
+                        continue
+                    resign_withdraws(group, replacement_gas_price)
+                elif not group[0].raw_tx or (group[0].get_gas_price() or 0) < gas_price:
+                    # unknown to the node, it rejects the stale gas price
+                    resign_withdraws(group, gas_price)
+
+                # the hash of the replacement is stored before the broadcast, otherwise the withdraw mined
+                # by an unknown transaction is released and paid again
+                session.commit()
+
+                if send_withdraws(group):
                     logging.getLogger(__name__).info(
-                            "Process withdraw. withdraw_id: {}".format(withdraw.id))
+                        "Process withdraws. withdraw_ids: {}".format([w.id for w in group]))
                 else:
                     logging.getLogger(__name__).error(
-                        "Process withdraw failed. withdraw_id: {}".format(withdraw.id))
+                        "Process withdraws failed. withdraw_ids: {}".format([w.id for w in group]))
             except Exception:
                 exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
                 logging.getLogger(__name__).error(
-                    "Failed to process withdraw due to exception:\n{}".format(exception_str))
+                    "Failed to process withdraws due to exception:\n{}".format(exception_str))
                 session.rollback()
 
         logging.getLogger(__name__).info("Finished to process new withdraws")
@@ -1203,6 +1580,81 @@ def withdraw_processing():
         session.rollback()
 
 
+def set_withdraw_succeeded(withdraw: Withdraw, block_height: int):
+    send_email_withdrawal_request_succeeded(withdraw.user.email,
+                                            withdraw.user_id,
+                                            withdraw.as_dict())
+    withdraw.status = TransactionStatus.success
+    withdraw.block_height = block_height
+
+
+def confirm_withdraws_by_logs():
+    """
+    Confirm pending withdraws by JNT Transfer logs of withdraws in blocks after the cursor,
+    all withdraws of a multi-transfer are confirmed by the logs of their shared transaction.
+    Failed transactions don't emit logs, they are left to check_withdraw_transactions
+    """
+    # noinspection PyBroadException
+    try:
+        logging.getLogger(__name__).info("Start to confirm withdraws by transfer logs")
+
+        last_block = getBlockNumber()
+        if last_block is None:
+            return
+        to_block = last_block - ETH_WITHDRAW_LOGS__CONFIRMATIONS
+
+        session.execute(insert(EthBlockCursor)
+                        .values(name=EthBlockCursor.withdraw_transfers,
+                                block_number=max(to_block - ETH_WITHDRAW_LOGS__INITIAL_DEPTH, 0),
+                                updated_at=datetime.utcnow())
+                        .on_conflict_do_nothing(index_elements=['name']))
+        cursor = session.query(EthBlockCursor) \
+            .filter(EthBlockCursor.name == EthBlockCursor.withdraw_transfers) \
+            .with_for_update() \
+            .one()  # type: EthBlockCursor
+
+        from_block = cursor.block_number + 1
+        to_block = min(to_block, from_block + ETH_WITHDRAW_LOGS__MAX_BLOCK_RANGE - 1)
+        if from_block > to_block:
+            session.commit()
+            logging.getLogger(__name__).info("Finished to confirm withdraws by transfer logs. No new blocks.")
+            return
+
+        logs = getWithdrawTransferLogs(from_block, to_block)
+        if logs is None:
+            session.rollback()
+            return
+
+        mined = {log['transactionHash'].lower(): hex_to_dec(log['blockNumber'])
+                 for log in logs if not log.get('removed')}
+
+        withdraws = []
+        if mined:
+            withdraws = session.query(Withdraw) \
+                .filter(Withdraw.status == TransactionStatus.pending) \
+                .filter(or_(func.lower(Withdraw.transaction_id).in_(list(mined)),
+                            Withdraw.meta[Withdraw.meta_key_transaction_ids].has_any(array(list(mined))))) \
+                .all()  # type: List[Withdraw]
+
+        for withdraw in withdraws:
+            # replaced transactions can be mined as well
+            withdraw.transaction_id = next(tx_id for tx_id in withdraw.get_transaction_ids()
+                                           if tx_id.lower() in mined)
+            set_withdraw_succeeded(withdraw, mined[withdraw.transaction_id.lower()])
+
+        cursor.block_number = to_block
+        cursor.updated_at = datetime.utcnow()
+        session.commit()
+
+        logging.getLogger(__name__).info("Finished to confirm withdraws by transfer logs of blocks {}-{}, "
+                                         "{} withdraws succeeded".format(from_block, to_block, len(withdraws)))
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to confirm withdraws by transfer logs due to exception:\n{}"
+                                          .format(exception_str))
+        session.rollback()
+
+
 def check_withdraw_transactions():
     """
     Check Contract Execution Status
@@ -1211,23 +1663,36 @@ def check_withdraw_transactions():
     try:
         logging.getLogger(__name__).info("Start to check withdraw transactions")
 
+        nonce_latest, _ = getManagerNonce()
+        stuck_time = datetime.utcnow() - timedelta(seconds=ETH_NONCE__STUCK_TIMEOUT)
+
         withdraws = session.query(Withdraw) \
             .filter(Withdraw.status == TransactionStatus.pending) \
             .filter(Withdraw.transaction_id != "") \
             .order_by(Withdraw.id) \
             .all()  # type: List[Withdraw]
 
+        tx_infos = getTransactionsInfo([tx_id for withdraw in withdraws for tx_id in withdraw.get_transaction_ids()])
+
         for withdraw in withdraws:
-            tx_info = getTransactionInfo(withdraw.transaction_id)
+            tx_ids = withdraw.get_transaction_ids()
+            tx_id = next((tx_id for tx_id in tx_ids if tx_infos.get(tx_id) and tx_infos[tx_id].get("status")), None)
 
-            if tx_info and tx_info.get("status"):
+            if tx_id:
+                tx_info = tx_infos[tx_id]
+                withdraw.transaction_id = tx_id
                 if tx_info["status"] == '0x1':
-                    send_email_withdrawal_request_succeeded(withdraw.user.email,
-                                                            withdraw.user_id,
-                                                            withdraw.as_dict())
-                    withdraw.status = TransactionStatus.success
+                    set_withdraw_succeeded(withdraw, hex_to_dec(tx_info["blockNumber"]))
                 elif tx_info["status"] == '0x0':
                     withdraw.status = TransactionStatus.fail
+            elif nonce_latest is not None \
+                    and withdraw.nonce is not None \
+                    and withdraw.nonce < nonce_latest \
+                    and withdraw.sent is not None \
+                    and withdraw.sent < stuck_time \
+                    and all(tx_id in tx_infos for tx_id in tx_ids):
+                # the nonce is mined, but none of the withdraw transactions
+                release_withdraw(withdraw)
             try:
                 session.commit()
             except Exception:
@@ -1260,7 +1725,6 @@ def add_withdraw_jnt(user_id: int) -> Optional[int]:
         addresses = session.query(Address) \
             .filter(Address.user_id == user_id).all()
         assert len(addresses) == 2, 'User has {} addresses, not 2'.format(len(addresses))
-        addresses_ids = [a.id for a in addresses]
 
         if not account or not addresses:
             logging.getLogger(__name__).error(
@@ -1268,19 +1732,13 @@ def add_withdraw_jnt(user_id: int) -> Optional[int]:
             session.rollback()
             return None
 
-        total_jnt = session.query(func.coalesce(func.sum(JNT.jnt_value), 0)) \
-            .outerjoin(Transaction, Transaction.id == JNT.transaction_id) \
-            .outerjoin(Address, Address.id == Transaction.address_id) \
-            .filter(Address.id.in_(addresses_ids), Transaction.status == TransactionStatus.success).as_scalar()
-
-        total_presale_jnt = session.query(func.coalesce(func.sum(PresaleJnt.jnt_value), 0)) \
-            .filter(PresaleJnt.user_id == user_id).as_scalar()
-
-        total_withdraw_jnt = session.query(func.coalesce(func.sum(Withdraw.value), 0)) \
-            .filter(Withdraw.user_id == user_id).as_scalar()
-
-        withdrawable_balance = session.query(total_jnt + total_presale_jnt - total_withdraw_jnt).one()
-        if withdrawable_balance[0] <= 0.0:
+        # Balance row lock serializes concurrent withdraws of the same user,
+        # the withdraw insert is debited from the balance by DB trigger
+        user_balance = session.query(UserBalance) \
+            .filter(UserBalance.user_id == user_id) \
+            .with_for_update() \
+            .one_or_none()  # type: UserBalance
+        if user_balance is None or user_balance.balance <= 0.0:
             session.rollback()
             return None
 
@@ -1288,7 +1746,7 @@ def add_withdraw_jnt(user_id: int) -> Optional[int]:
             .values(user_id=user_id,
                     status=TransactionStatus.not_confirmed,
                     to=account.withdraw_address,
-                    value=total_jnt + total_presale_jnt - total_withdraw_jnt,
+                    value=user_balance.balance,
                     transaction_id='')
 
         result = session.execute(insert_query)
@@ -1310,7 +1768,8 @@ def add_withdraw_jnt(user_id: int) -> Optional[int]:
 # Persist notification to the database
 #
 
-def add_notification(email: str, type: str, user_id: Optional[int] = None, data: Optional[dict] = None):
+def add_notification(email: str, type: str, user_id: Optional[int] = None, data: Optional[dict] = None,
+                     *, commit: bool = True):
     # noinspection PyBroadException
     try:
         logging.getLogger(__name__).info("Start persist notification to the database. email: {}, user_id: {}"
@@ -1328,7 +1787,8 @@ def add_notification(email: str, type: str, user_id: Optional[int] = None, data:
                                     meta=data if data else {})
 
         session.add(notification)
-        session.commit()
+        if commit:
+            session.commit()
 
         logging.getLogger(__name__).info("Finished to persist notification to the database. email: {}, account_id: {}"
                                          .format(email, user_id))
@@ -1338,12 +1798,14 @@ def add_notification(email: str, type: str, user_id: Optional[int] = None, data:
         exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
         logging.getLogger(__name__).error(
             "Failed to persist notification to the database due to exception:\n{}".format(exception_str))
-        session.rollback()
+        if commit:
+            session.rollback()
         return False
 
 
 def send_email_transaction_received(email: str, user_id: int, transaction: dict,
-                                    jnt: dict, type: Optional[str] = NotificationType.transaction_received) -> bool:
+                                    jnt: dict, type: Optional[str] = NotificationType.transaction_received,
+                                    *, commit: bool = True) -> bool:
     ctx = {
         'jnt_id': jnt['id'],
         'transaction_id': transaction['id'],
@@ -1354,7 +1816,7 @@ def send_email_transaction_received(email: str, user_id: int, transaction: dict,
         'transaction_currency_conversion_rate': format_conversion_rate(jnt['currency_to_usd_rate']),
     }
 
-    return add_notification(email, user_id=user_id, type=type, data=ctx)
+    return add_notification(email, user_id=user_id, type=type, data=ctx, commit=commit)
 
 
 def send_email_withdrawal_request(email: str, user_id: int, withdraw: dict,
@@ -1367,7 +1829,8 @@ def send_email_withdrawal_request(email: str, user_id: int, withdraw: dict,
     return add_notification(email, user_id=user_id, type=type, data=ctx)
 
 
-def send_email_transaction_received_sold_out(email: str, user_id: int, transaction: dict) -> bool:
+def send_email_transaction_received_sold_out(email: str, user_id: int, transaction: dict,
+                                             *, commit: bool = True) -> bool:
     ctx = {
         'transaction_id': transaction['id'],
         'account_email': email,
@@ -1375,8 +1838,10 @@ def send_email_transaction_received_sold_out(email: str, user_id: int, transacti
         'transaction_currency_name': transaction['currency'],
     }
 
-    success_user = add_notification(email, user_id=user_id, type=NotificationType.transaction_received_sold_out, data=ctx)
-    success_support = add_notification(EMAIL_NOTIFICATIONS__SUPPORT_ADDRESS, user_id=user_id, type=NotificationType.transaction_received_sold_out_admin, data=ctx)
+    success_user = add_notification(email, user_id=user_id, type=NotificationType.transaction_received_sold_out, data=ctx,
+                                    commit=commit)
+    success_support = add_notification(EMAIL_NOTIFICATIONS__SUPPORT_ADDRESS, user_id=user_id, type=NotificationType.transaction_received_sold_out_admin, data=ctx,
+                                       commit=commit)
 
     return success_user and success_support
 
@@ -0,0 +1,120 @@
+"""
+Nonce allocation for withdraw transactions sent from the ETH manager address.
+
+Nonces are handed out from the eth_nonce row under a row lock. An allocated nonce stays bound to its withdraw
+until the node uses it for another transaction, so a withdraw can't be paid twice.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy.sql.expression import or_
+from sqlalchemy.dialects.postgresql import insert
+
+from jco.appdb.db import session
+from jco.appdb.models import *
+from jco.commonconfig.config import ETH_NONCE__STUCK_TIMEOUT
+
+
+def lock_nonce(address: str, node_nonce: int) -> EthNonce:
+    """
+    Lock the nonce row of the address until the end of DB transaction,
+    a missing row is created with the pending nonce of the node
+    """
+    session.execute(insert(EthNonce)
+                    .values(address=address, next_nonce=node_nonce, updated_at=datetime.utcnow())
+                    .on_conflict_do_nothing(index_elements=['address']))
+    return session.query(EthNonce) \
+        .filter(EthNonce.address == address) \
+        .with_for_update() \
+        .one()
+
+
+def allocate_nonce(withdraws: List[Withdraw], address: str, node_nonce: int) -> int:
+    """
+    Bind the next nonce of the address to the withdraws sent in one transaction,
+    committed before the transaction is broadcasted
+    """
+    eth_nonce = lock_nonce(address, node_nonce)
+    nonce = eth_nonce.next_nonce
+    for withdraw in withdraws:
+        withdraw.nonce = nonce
+    eth_nonce.next_nonce += 1
+    eth_nonce.updated_at = datetime.utcnow()
+    session.commit()
+
+    logging.getLogger(__name__).info("Allocated nonce {} for withdraws {}"
+                                     .format(nonce, [withdraw.id for withdraw in withdraws]))
+    return nonce
+
+
+def resync_nonce(address: str, node_latest_nonce: int, node_pending_nonce: int) -> List[Withdraw]:
+    """
+    Resynchronize allocated nonces with the node. Returns pending withdraws to broadcast:
+    - unknown to the node (nonce is not below the node pending nonce): signed and not broadcasted yet,
+      or lost by the node, they leave a gap for next transactions
+    - not mined for ETH_NONCE__STUCK_TIMEOUT
+    """
+    eth_nonce = lock_nonce(address, node_pending_nonce)
+    if eth_nonce.next_nonce < node_pending_nonce:
+        logging.getLogger(__name__).warning("Next nonce {} of {} is behind the node pending nonce {}, "
+                                            "transactions were sent outside of the allocator"
+                                            .format(eth_nonce.next_nonce, address, node_pending_nonce))
+        eth_nonce.next_nonce = node_pending_nonce
+        eth_nonce.updated_at = datetime.utcnow()
+
+    stuck_time = datetime.utcnow() - timedelta(seconds=ETH_NONCE__STUCK_TIMEOUT)
+    withdraws = session.query(Withdraw) \
+        .filter(Withdraw.status == TransactionStatus.pending) \
+        .filter(Withdraw.nonce >= node_latest_nonce) \
+        .filter(or_(Withdraw.nonce >= node_pending_nonce,
+                    Withdraw.sent < stuck_time)) \
+        .order_by(Withdraw.nonce) \
+        .all()  # type: List[Withdraw]
+    session.commit()
+
+    for withdraw in withdraws:
+        logging.getLogger(__name__).warning("Withdraw {} with nonce {} is {} (node nonces: latest {}, pending {})"
+                                            .format(withdraw.id,
+                                                    withdraw.nonce,
+                                                    'lost' if withdraw.nonce >= node_pending_nonce else 'stuck',
+                                                    node_latest_nonce,
+                                                    node_pending_nonce))
+    return withdraws
+
+
+def release_nonces(address: str, node_pending_nonce: int) -> List[int]:
+    """
+    Release nonces abandoned by withdraws. Returns unused nonces below the allocated ones,
+    they block next transactions until transactions with them are broadcasted:
+    - allocated to withdraws not signed before the nonce was used by the node, they get new nonces
+    - unused at the end are allocated again
+    """
+    eth_nonce = lock_nonce(address, node_pending_nonce)
+
+    released = session.query(Withdraw) \
+        .filter(Withdraw.status == TransactionStatus.confirmed) \
+        .filter(Withdraw.nonce < node_pending_nonce) \
+        .all()  # type: List[Withdraw]
+    for withdraw in released:
+        logging.getLogger(__name__).warning("Nonce {} of withdraw {} is used by the node, it's released"
+                                            .format(withdraw.nonce, withdraw.id))
+        withdraw.nonce = None
+
+    used = set(nonce for nonce, in session.query(Withdraw.nonce)
+               .filter(Withdraw.status.in_([TransactionStatus.confirmed, TransactionStatus.pending]))
+               .filter(Withdraw.nonce >= node_pending_nonce)
+               .distinct())
+    next_nonce = max(used) + 1 if used else node_pending_nonce
+    if next_nonce < eth_nonce.next_nonce:
+        logging.getLogger(__name__).warning("Nonces {}-{} of {} are not used, they are allocated again"
+                                            .format(next_nonce, eth_nonce.next_nonce - 1, address))
+        eth_nonce.next_nonce = next_nonce
+        eth_nonce.updated_at = datetime.utcnow()
+
+    gaps = [nonce for nonce in range(node_pending_nonce, eth_nonce.next_nonce) if nonce not in used]
+    session.commit()
+
+    if gaps:
+        logging.getLogger(__name__).warning("Nonces {} of {} are not used by withdraws".format(gaps, address))
+    return gaps
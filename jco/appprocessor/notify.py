@@ -7,11 +7,16 @@ import time
 import sys
 import traceback
 import uuid
+import json
+import functools
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List, Any, Tuple
 from email.utils import formatdate
 from jinja2 import FileSystemLoader, Environment
+from django.template.loader import get_template
+from django.utils.html import conditional_escape
 from jco.commonconfig import config
 from jco.appdb.models import *
 from jco.api import models as api_models
@@ -20,6 +25,8 @@ from jco.api import models as api_models
 EMAIL_NOTIFICATIONS__TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
 logger = logging.getLogger(__name__)
 
+MAILGUN__RECIPIENT_PLACEHOLDER = '%recipient.{}%'
+
 
 def _format_jnt_value(value: float) -> str:
     return "{0:.0f}".format(int(value))
@@ -45,18 +52,39 @@ def _format_date_period(start_date: datetime, end_date: datetime) -> str:
     return '{0:%d %b %Y} - {1:%d %b %Y}'.format(start_date, end_date)
 
 
+_templates = {}  # type: Dict[str, Any]
+_templates_lock = threading.Lock()
+
+
+def get_notification_template(key: str):
+    """
+    Compiled template of the notification key, all templates of NOTIFICATION_KEYS are compiled on the first use
+    """
+    if not _templates:
+        with _templates_lock:
+            if not _templates:
+                _templates.update({template_key: get_template("{}.html".format(template_key))
+                                   for template_key in set(NOTIFICATION_KEYS.values())})
+    return _templates[key]
+
+
+@functools.lru_cache(maxsize=None)
+def _read_asset(path: Path) -> bytes:
+    return path.read_bytes()
+
+
 def _format_email_files(*,
                         attachments: List[Tuple[str, Path]] = (),
                         attachments_inline: List[Tuple[str, Path]] = ()) -> List:
     # read attachments
     attachments_data = []  # type: List[Tuple[str, bytes]]
     for attachment_name, attachment_path in attachments:
-        attachment_bytes = attachment_path.read_bytes()
+        attachment_bytes = _read_asset(attachment_path)
         attachments_data.append((attachment_name, attachment_bytes))
 
     attachments_inline_data = []  # type: List[Tuple[str, bytes]]
     for attachment_name, attachment_path in attachments_inline:
-        attachment_bytes = attachment_path.read_bytes()
+        attachment_bytes = _read_asset(attachment_path)
         attachments_inline_data.append((attachment_name, attachment_bytes))
 
     # format files
@@ -111,13 +139,17 @@ def get_failed_mails() -> List[str]:
         return None
 
 
+def _is_sendgrid_recipient(email: str) -> bool:
+    return any(domain in email for domain in config.EMAIL_NOTIFICATIONS__SENDGRID_DOMAINS)
+
+
 def _send_email(recipient: str,
                 email_subject: str,
                 email_body: str,
                 proposal_id: str,
                 *, files: List = ()) -> Tuple[bool, Optional[str]]:
 
-    if any(domain in recipient for domain in config.EMAIL_NOTIFICATIONS__SENDGRID_DOMAINS):
+    if _is_sendgrid_recipient(recipient):
         return _send_email_sendgrid(config.EMAIL_NOTIFICATIONS__SENDGRID_SENDER,
                                     recipient,
                                     email_subject,
@@ -138,58 +170,58 @@ def _send_email_mailgun(sender: str,
                 email_body: str,
                 proposal_id: str,
                 *, files: List = ()) -> Tuple[bool, Optional[str]]:
-    # send data
-    max_attempts = 2
+    # send data, a failed email is retried by the caller
     success = True
     message_id = None
 
-    for attempt in range(max_attempts):
-        # noinspection PyBroadException
-        try:
-            data = {
-                "from": sender,
-                "to": recipient,
-                "subject": email_subject,
-                "html": email_body
-            }
-            response = requests.post(config.MAILGUN__API_MESSAGES_URL, auth=("api", config.MAILGUN__API_KEY), data=data, files=files)
-            # check that a request is successful
-            response.raise_for_status()
+    # noinspection PyBroadException
+    try:
+        data = {
+            "from": sender,
+            "to": recipient,
+            "subject": email_subject,
+            "html": email_body
+        }
+        response = requests.post(config.MAILGUN__API_MESSAGES_URL, auth=("api", config.MAILGUN__API_KEY), data=data, files=files)
+        # check that a request is successful
+        response.raise_for_status()
+
+        message_id = response.json().get("id")
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to send email '{}' to '{}' due to error.\n{}"
+                                          .format(proposal_id, recipient, exception_str))
+        success = False
 
-            message_id = response.json().get("id")
-
-            break
-        except Exception:
-            exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
-            if attempt < max_attempts - 1:
-                logging.getLogger(__name__).error(("Failed to send email '{}' to '{}' due to error." +
-                                                   " Sleep and try again.\n{}")
-                                                  .format(proposal_id, recipient, exception_str))
-                time.sleep(20)
-            else:
-                logging.getLogger(__name__).error("Failed to send email '{}' to '{}' due to error. Abort.\n{}"
-                                                  .format(proposal_id, recipient, exception_str))
-                success = False
-
-    if config.EMAIL_NOTIFICATIONS__BACKUP_ENABLED:
-        # noinspection PyBroadException
-        try:
-            data = {
-                "from": config.EMAIL_NOTIFICATIONS__BACKUP_SENDER,
-                "to": config.EMAIL_NOTIFICATIONS__BACKUP_ADDRESS,
-                "subject": email_subject + ' >>> ' + recipient,
-                "html": email_body
-            }
-
-            requests.post(config.MAILGUN__API_MESSAGES_URL, auth=("api", config.MAILGUN__API_KEY), data=data, files=files)
-        except Exception:
-            exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
-            logging.getLogger(__name__).error("Failed to send backup email '{}' due to error:\n{}"
-                                              .format(proposal_id, exception_str))
+    _send_email_backup(recipient, email_subject, email_body, proposal_id, files=files)
 
     return success, message_id
 
 
+def _send_email_backup(recipient: str,
+                       email_subject: str,
+                       email_body: str,
+                       proposal_id: str,
+                       *, files: List = ()):
+    if not config.EMAIL_NOTIFICATIONS__BACKUP_ENABLED:
+        return
+
+    # noinspection PyBroadException
+    try:
+        data = {
+            "from": config.EMAIL_NOTIFICATIONS__BACKUP_SENDER,
+            "to": config.EMAIL_NOTIFICATIONS__BACKUP_ADDRESS,
+            "subject": email_subject + ' >>> ' + recipient,
+            "html": email_body
+        }
+
+        requests.post(config.MAILGUN__API_MESSAGES_URL, auth=("api", config.MAILGUN__API_KEY), data=data, files=files)
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to send backup email '{}' due to error:\n{}"
+                                          .format(proposal_id, exception_str))
+
+
 def _send_email_sendgrid(sender: str,
                          recipient: str,
                          email_subject: str,
@@ -203,42 +235,72 @@ def _send_email_sendgrid(sender: str,
     }
 
     template_logo = "jibrel_logo.png"
-    with open(Path(EMAIL_NOTIFICATIONS__TEMPLATES_PATH, template_logo), 'rb') as f:
-        data['files[' + template_logo + ']'] = f.read()
+    data['files[' + template_logo + ']'] = _read_asset(Path(EMAIL_NOTIFICATIONS__TEMPLATES_PATH, template_logo))
     data["content[" + template_logo + "]"] = template_logo
 
-    # send data
-    max_attempts = 2
+    # send data, a failed email is retried by the caller
     success = True
     message_id = None
 
-    for attempt in range(max_attempts):
-        # noinspection PyBroadException
-        try:
-            response = requests.post(config.SENDGRID__API_MESSAGES_URL,
-                                     data=data,
-                                     headers = {
-                                                "Authorization": "Bearer {}".format(config.SENDGRID__API_KEY),
-                                                "Accept": "*/*"
-                                                }
-                                     )
-            # check that a request is successful
-            response.raise_for_status()
+    # noinspection PyBroadException
+    try:
+        response = requests.post(config.SENDGRID__API_MESSAGES_URL,
+                                 data=data,
+                                 headers = {
+                                            "Authorization": "Bearer {}".format(config.SENDGRID__API_KEY),
+                                            "Accept": "*/*"
+                                            }
+                                 )
+        # check that a request is successful
+        response.raise_for_status()
+
+        message_id = str(uuid.uuid4())
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to send email '{}' to '{}' due to error.\n{}"
+                                          .format(proposal_id, recipient, exception_str))
+        success = False
+
+    return success, message_id
 
-            message_id = str(uuid.uuid4())
-
-            break
-        except Exception:
-            exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
-            if attempt < max_attempts - 1:
-                logging.getLogger(__name__).error(("Failed to send email '{}' to '{}' due to error." +
-                                                   " Sleep and try again.\n{}")
-                                                  .format(proposal_id, recipient, exception_str))
-                time.sleep(20)
-            else:
-                logging.getLogger(__name__).error("Failed to send email '{}' to '{}' due to error. Abort.\n{}"
-                                                  .format(proposal_id, recipient, exception_str))
-                success = False
+
+def _send_email_mailgun_batch(sender: str,
+                              recipient_variables: Dict[str, Dict[str, str]],
+                              email_subject: str,
+                              email_body: str,
+                              *, files: List = ()) -> Tuple[bool, Optional[str]]:
+    """
+    Send the email to several recipients in one request, %recipient.<name>% placeholders of the subject and
+    the body are replaced by Mailgun with the recipient variables. Every recipient gets its own email,
+    one backup copy of the batch is sent with the variables of the first recipient
+    """
+    success = True
+    message_id = None
+
+    # noinspection PyBroadException
+    try:
+        data = [("from", sender)] + \
+               [("to", recipient) for recipient in recipient_variables] + \
+               [("subject", email_subject),
+                ("html", email_body),
+                ("recipient-variables", json.dumps(recipient_variables))]
+        response = requests.post(config.MAILGUN__API_MESSAGES_URL, auth=("api", config.MAILGUN__API_KEY), data=data, files=files)
+        # check that a request is successful
+        response.raise_for_status()
+
+        message_id = response.json().get("id")
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to send batch email to {} recipients due to error.\n{}"
+                                          .format(len(recipient_variables), exception_str))
+        success = False
+
+    recipient, variables = next(iter(recipient_variables.items()))
+    _send_email_backup('{} and {} more'.format(recipient, len(recipient_variables) - 1),
+                       _substitute_recipient_variables(email_subject, variables),
+                       _substitute_recipient_variables(email_body, variables),
+                       'batch of {} recipients'.format(len(recipient_variables)),
+                       files=files)
 
     return success, message_id
 
@@ -287,8 +349,17 @@ def send_notification(notification_id):
         logger.warn('Notification #%s aready sent', notification_id)
         return False, None
 
+    return send_notification_email(notification)
+
+
+def send_notification_email(notification: api_models.Notification) -> Tuple[bool, Optional[str]]:
+    """
+    Render and send email of the notification, without database queries.
+    The body is rendered once and kept in `notification.rendered_message`
+    """
     subject = notification.get_subject()
     body = notification.get_body()
+    notification.rendered_message = body
     email_files = _format_email_files(
     attachments_inline=[("jibrel_logo.png",
                          Path(EMAIL_NOTIFICATIONS__TEMPLATES_PATH, "jibrel_logo.png"))])
@@ -302,6 +373,99 @@ def send_notification(notification_id):
     )
 
 
+def _substitute_recipient_variables(text: str, variables: Dict[str, str]) -> str:
+    for name, value in variables.items():
+        text = text.replace(MAILGUN__RECIPIENT_PLACEHOLDER.format(name), value)
+    return text
+
+
+def group_notifications(notifications: List[api_models.Notification]) -> List[List[api_models.Notification]]:
+    """
+    Group notifications of the same type to Mailgun recipients by MAILGUN__BATCH_SIZE,
+    a recipient is in a group once. Other notifications are sent one by one
+    """
+    groups = {}  # type: Dict[str, List[Tuple[List[api_models.Notification], set]]]
+    single = []  # type: List[List[api_models.Notification]]
+    for notification in notifications:
+        if _is_sendgrid_recipient(notification.email):
+            single.append([notification])
+            continue
+        type_groups = groups.setdefault(notification.type, [])
+        group, emails = next(((group, emails) for group, emails in type_groups
+                              if len(group) < config.MAILGUN__BATCH_SIZE and notification.email not in emails),
+                             ([], set()))
+        if not group:
+            type_groups.append((group, emails))
+        group.append(notification)
+        emails.add(notification.email)
+    return single + [group for type_groups in groups.values() for group, emails in type_groups]
+
+
+def _render_batch(notifications: List[api_models.Notification]) \
+        -> Tuple[str, str, Dict[str, Dict[str, str]], List[api_models.Notification]]:
+    """
+    Render the template of the notifications once with recipient placeholders.
+    Notifications rendered with their own values differently from the substituted template
+    (template logic depends on the values) are returned to be sent one by one
+    """
+    names = set(name for notification in notifications for name in notification.meta)
+    placeholders = {name: MAILGUN__RECIPIENT_PLACEHOLDER.format(name) for name in names}
+    key = notifications[0].get_key()
+    subject = NOTIFICATION_SUBJECTS[key].format(**placeholders)
+    body = get_notification_template(key).render(placeholders)
+
+    recipient_variables = {}  # type: Dict[str, Dict[str, str]]
+    rest = []  # type: List[api_models.Notification]
+    for notification in notifications:
+        variables = {name: conditional_escape(notification.meta.get(name, '')) for name in names}
+        rendered_message = notification.get_body()
+        notification.rendered_message = rendered_message
+        if (_substitute_recipient_variables(body, variables) == rendered_message and
+                _substitute_recipient_variables(subject, variables) == notification.get_subject()):
+            recipient_variables[notification.email] = variables
+        else:
+            rest.append(notification)
+    return subject, body, recipient_variables, rest
+
+
+def send_notifications_email(notifications: List[api_models.Notification]) -> List[Tuple[bool, Optional[str]]]:
+    """
+    Send emails of the group of notifications, in one Mailgun batch request if there are several.
+    Results are in the order of notifications, the batch message id is shared by its notifications
+    """
+    if len(notifications) == 1:
+        return [send_notification_email(notifications[0])]
+
+    # noinspection PyBroadException
+    try:
+        subject, body, recipient_variables, rest = _render_batch(notifications)
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed to render batch of notifications due to error.\n{}"
+                                          .format(exception_str))
+        subject, body, recipient_variables, rest = None, None, {}, notifications
+
+    results = {}  # type: Dict[int, Tuple[bool, Optional[str]]]
+    if len(recipient_variables) > 1:
+        email_files = _format_email_files(
+            attachments_inline=[("jibrel_logo.png",
+                                 Path(EMAIL_NOTIFICATIONS__TEMPLATES_PATH, "jibrel_logo.png"))])
+        logger.info('Sending batch of %s notifications, type %s', len(recipient_variables), notifications[0].type)
+        result = _send_email_mailgun_batch(config.EMAIL_NOTIFICATIONS__MAILGUN_SENDER,
+                                           recipient_variables,
+                                           subject,
+                                           body,
+                                           files=email_files)
+        results.update((id(notification), result) for notification in notifications
+                       if notification.email in recipient_variables)
+    else:
+        rest = notifications
+
+    for notification in rest:
+        results[id(notification)] = send_notification_email(notification)
+    return [results[id(notification)] for notification in notifications]
+
+
 def send_email_verify_email(email, activate_url, user_id=None):
     ctx = {
         'activate_url': activate_url,
@@ -1,6 +1,7 @@
 import os,sys
 import traceback
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
 import time
 import logging
@@ -8,6 +9,8 @@ from hashlib import *
 from base58 import *
 
 import requests
+from mnemonic import Mnemonic
+from pycoin.key.BIP32Node import BIP32Node
 from sqlalchemy.types import Boolean
 from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import not_, or_
@@ -19,7 +22,10 @@ from jco.appdb.models import *
 from jco.commonutils.utils import *
 from jco.commonutils.app_init import initialize_app
 from jco.commonutils.contract import mintJNT
+from jco.commonutils.crypto import HDPrivateKey, HDKey
+from jco.appprocessor.nonce_manager import allocate_nonce, resync_nonce, release_nonces
 from jco.appprocessor.affiliate import (
+    add_transaction_affiliate,
     scan_affiliates,
     check_new_transactions,
     check_new_registartions,
@@ -29,6 +35,7 @@ from jco.appprocessor.affiliate import (
 from jco.appprocessor.commands import (
     generate_eth_addresses,
     generate_btc_addresses,
+    replenish_address_pool,
     fetch_tickers_price,
     fetch_ticker_price,
     # add_proposal,
@@ -48,12 +55,15 @@ from jco.appprocessor.commands import (
     add_withdraw_jnt,
     assign_addresses,
     withdraw_processing,
+    sign_withdraws,
+    dispatch_outbox_events,
     add_notification,
     calculate_jnt_purchases,
     check_withdraw_addresses,
     get_btc_addresses_with_positive_balance,
     get_eth_addresses_with_positive_balance,
     check_withdraw_transactions,
+    confirm_withdraws_by_logs,
     get_user_custom_price,
     get_total_jnt_amount
 )
@@ -79,6 +89,7 @@ def create_user(user_name, email) -> User:
 class TestCommands(unittest.TestCase):
     def clear_all_tables(selfself):
         session.query(UserJntPrice).delete()
+        session.query(OutboxEvent).delete()
         session.query(Notification).delete()
         session.query(Withdraw).delete()
         session.query(JNT).delete()
@@ -86,8 +97,14 @@ class TestCommands(unittest.TestCase):
         session.query(Affiliate).delete()
         session.query(Price).delete()
         session.query(Address).delete()
+        session.query(AddressPoolCursor).delete()
+        session.query(EthNonce).delete()
+        session.query(EthBlockCursor).delete()
         session.query(Account).delete()
         session.query(PresaleJnt).delete()
+        session.query(BalanceLedger).delete()
+        session.query(UserBalance).delete()
+        session.query(UserVersion).delete()
         session.query(User).delete()
         session.commit()
         pass
@@ -160,6 +177,47 @@ class TestCommands(unittest.TestCase):
         self.assertEqual(len(address_types), 1, "must generate Bitcoin addresses")
         self.assertEqual(address_types.pop(), 'BTC', "must generate Bitcoin addresses")
 
+    def test_generate_addresses_overlapping_ranges(self):
+        generate_eth_addresses(self.mnemonic, 5, is_usable=False)
+        generate_eth_addresses(self.mnemonic, 5, offset=3)
+        addresses = session.query(Address).order_by(Address.id).all()  # type: List[Address]
+        self.assertEqual(len(addresses), 8, "existing addresses must be skipped")
+        self.assertEqual([a.is_usable for a in addresses], [False] * 5 + [True] * 3)
+        self.assertEqual(addresses[0].address, '0x7039D52049134cA39ff431bF11e439cBbe281BFF')
+        self.assertEqual(addresses[5].address, '0x22AF2deC86eb46e4159e389b8b27AFC3d1a8272B')
+
+    def test_replenish_address_pool(self):
+        eth_xpub = HDKey.from_path(HDPrivateKey.master_key_from_mnemonic(self.mnemonic),
+                                   "m/44'/60'/0'")[-1].public_key.to_b58check()
+        btc_xpub = BIP32Node.from_master_secret(Mnemonic.to_seed(self.mnemonic), 'BTC') \
+            .subkey_for_path("44'/0'/0'").hwif()
+        xpubs = {CurrencyType.eth: eth_xpub, CurrencyType.btc: btc_xpub}
+
+        # first addresses are already generated from the mnemonic, the pool continues after them
+        generate_eth_addresses(self.mnemonic, 3)
+        replenish_address_pool(xpubs=xpubs, min_free=5, batch_size=5)
+        self.assertEqual(session.query(Address).filter(Address.type == CurrencyType.eth).count(), 8)
+        self.assertEqual(session.query(Address).filter(Address.type == CurrencyType.btc).count(), 5)
+
+        # pool is full enough
+        replenish_address_pool(xpubs=xpubs, min_free=5, batch_size=5)
+        self.assertEqual(session.query(Address).count(), 13)
+
+        # several batches are derived until the pool is full enough
+        replenish_address_pool(xpubs=xpubs, min_free=12, batch_size=5)
+        self.assertEqual(session.query(Address).filter(Address.type == CurrencyType.btc).count(), 15)
+        pool_addresses = [a.address for a in session.query(Address)
+                          .filter(Address.type == CurrencyType.eth)
+                          .order_by(Address.address)]
+        cursor = session.query(AddressPoolCursor).filter(AddressPoolCursor.type == CurrencyType.eth).one()
+        self.assertEqual(cursor.next_index, 13)
+
+        session.query(Address).delete()
+        session.commit()
+        generate_eth_addresses(self.mnemonic, 13)
+        generated_addresses = [a.address for a in session.query(Address).order_by(Address.address)]
+        self.assertEqual(pool_addresses, generated_addresses, "pool addresses must match BIP44 specs")
+
     def test_fetch_tickers_price(self):
         fetch_tickers_price()
         btc_prices = session.query(Price) \
@@ -803,6 +861,13 @@ class TestCommands(unittest.TestCase):
 
         calculate_jnt_purchases()
 
+        self.assertEqual(session.query(Notification).count(), 0)
+        self.assertEqual(session.query(OutboxEvent).filter(OutboxEvent.processed.is_(None)).count(), 2)
+
+        dispatch_outbox_events()
+
+        self.assertEqual(session.query(OutboxEvent).filter(OutboxEvent.processed.is_(None)).count(), 0)
+
         jnt = session.query(JNT) \
             .filter(JNT.transaction_id == eth_transaction1.id) \
             .one()
@@ -911,6 +976,281 @@ class TestCommands(unittest.TestCase):
         self.assertEqual(len(withdraws), 1)
         self.assertEqual(withdraws[0].status, TransactionStatus.fail)
 
+    def test_confirm_withdraws_by_logs(self):
+        user = create_user("test@test.local", "test@test.local")
+        withdraws = [Withdraw(transaction_id="0xAA{}".format(i), user_id=user.id, to="0xabcdef", value=0.001,
+                              status=TransactionStatus.pending) for i in range(2)]
+        session.add_all(withdraws)
+        session.commit()
+
+        logs = [{'transactionHash': '0xaa1', 'blockNumber': '0x64', 'removed': False}]
+        with mock.patch('jco.appprocessor.commands.getBlockNumber', return_value=101), \
+                mock.patch('jco.appprocessor.commands.getWithdrawTransferLogs', return_value=logs) as get_logs:
+            confirm_withdraws_by_logs()
+            confirm_withdraws_by_logs()
+
+        self.assertEqual(get_logs.call_count, 1, "logs of the same blocks must not be requested again")
+        self.assertEqual(session.query(EthBlockCursor).one().block_number, 100)
+        self.assertEqual(withdraws[0].status, TransactionStatus.pending)
+        self.assertEqual(withdraws[1].status, TransactionStatus.success)
+        self.assertEqual(withdraws[1].block_height, 100)
+
+    def test_confirm_batched_withdraws_by_logs(self):
+        user = create_user("test@test.local", "test@test.local")
+        withdraws = [Withdraw(transaction_id="0xbb", user_id=user.id, to="0x{:040x}".format(i), value=0.001,
+                              nonce=7, status=TransactionStatus.pending) for i in range(3)]
+        session.add_all(withdraws)
+        session.commit()
+
+        # multi-transfer emits a Transfer log for every withdraw address in the shared transaction
+        logs = [{'transactionHash': '0xBB', 'blockNumber': '0x64', 'removed': False, 'logIndex': hex(i)}
+                for i in range(3)]
+        with mock.patch('jco.commonutils.contract.ETH_MULTI_TRANSFER__ADDRESS', '0xmultitransfer'), \
+                mock.patch('jco.commonutils.contract.ETH_MANAGER__ADDRESS', '0xmanager'), \
+                mock.patch('jco.appprocessor.commands.getBlockNumber', return_value=101), \
+                mock.patch('jco.commonutils.contract.get_contract') as get_contract:
+            get_contract.return_value.getTransferLogs.return_value = logs
+            confirm_withdraws_by_logs()
+
+        get_contract.return_value.getTransferLogs.assert_called_once_with(mock.ANY, 100,
+                                                                         ['0xmanager', '0xmultitransfer'])
+        self.assertEqual([(w.status, w.block_height) for w in withdraws], [(TransactionStatus.success, 100)] * 3)
+
+    def test_nonce_manager(self):
+        user = create_user("test@test.local", "test@test.local")
+        manager_address = "0xmanager"
+
+        withdraws = [Withdraw(user_id=user.id, to="0xabcdef", value=0.001, status=TransactionStatus.confirmed)
+                     for _ in range(3)]
+        session.add_all(withdraws)
+        session.commit()
+
+        self.assertEqual(resync_nonce(manager_address, 5, 5), [])
+        self.assertEqual([allocate_nonce([withdraw], manager_address, 5) for withdraw in withdraws], [5, 6, 7])
+
+        for withdraw in withdraws:
+            withdraw.transaction_id = "0x{}".format(withdraw.nonce)
+            withdraw.status = TransactionStatus.pending
+            withdraw.sent = datetime.utcnow()
+        session.commit()
+
+        # node knows only nonce 5, nonces 6 and 7 are lost
+        self.assertEqual([w.nonce for w in resync_nonce(manager_address, 5, 6)], [6, 7])
+
+        # nonce 5 is not mined for a long time
+        withdraws[0].sent = datetime.utcnow() - timedelta(days=1)
+        session.commit()
+        self.assertEqual([w.nonce for w in resync_nonce(manager_address, 5, 8)], [5])
+
+        # transactions were sent outside of the allocator
+        self.assertEqual(resync_nonce(manager_address, 10, 10), [])
+        self.assertEqual(session.query(EthNonce).one().next_nonce, 10)
+
+    def test_release_nonces(self):
+        user = create_user("test@test.local", "test@test.local")
+        manager_address = "0xmanager"
+
+        withdraws = [Withdraw(user_id=user.id, to="0xabcdef", value=0.001, status=TransactionStatus.confirmed)
+                     for _ in range(5)]
+        session.add_all(withdraws)
+        session.commit()
+        self.assertEqual([allocate_nonce([withdraw], manager_address, 5) for withdraw in withdraws],
+                         [5, 6, 7, 8, 9])
+
+        # nonces 6, 8 and 9 are abandoned, only 6 is below the allocated ones
+        for withdraw, status in zip(withdraws, [TransactionStatus.pending,
+                                                TransactionStatus.fail,
+                                                TransactionStatus.pending,
+                                                TransactionStatus.fail,
+                                                TransactionStatus.fail]):
+            withdraw.status = status
+        session.commit()
+        self.assertEqual(release_nonces(manager_address, 5), [6])
+        self.assertEqual(session.query(EthNonce).one().next_nonce, 8)
+
+        # confirmed withdraw which nonce is used by the node gets a new one
+        withdraws[4].status = TransactionStatus.confirmed
+        withdraws[4].nonce = 7
+        session.commit()
+        self.assertEqual(release_nonces(manager_address, 8), [])
+        self.assertIsNone(withdraws[4].nonce)
+        self.assertEqual(session.query(EthNonce).one().next_nonce, 8)
+
+    def test_withdraw_processing_stuck(self):
+        user = create_user("test@test.local", "test@test.local")
+
+        withdraws = [Withdraw(user_id=user.id, to="0x{:040x}".format(i), value=0.001,
+                              status=TransactionStatus.confirmed)
+                     for i in range(3)]
+        session.add_all(withdraws)
+        session.commit()
+
+        with mock.patch('jco.appprocessor.commands.getManagerNonce', return_value=(7, 7)), \
+                mock.patch('jco.appprocessor.commands.getTransferGasPrice',
+                           side_effect=lambda previous=None: previous * 2 if previous else 20), \
+                mock.patch('jco.appprocessor.commands.signJNTTransfers',
+                           side_effect=lambda transfers, nonce, gas_price: "0xraw{}_{}".format(nonce, gas_price)), \
+                mock.patch('jco.appprocessor.commands.getTransactionHash',
+                           side_effect=lambda raw_tx: raw_tx.replace("raw", "tx")), \
+                mock.patch('jco.appprocessor.commands.signNonceFiller',
+                           side_effect=lambda nonce, gas_price: "0xfiller{}".format(nonce)), \
+                mock.patch('jco.appprocessor.commands.sendSignedTransaction',
+                           side_effect=lambda raw_tx: raw_tx) as send_mock:
+            sign_withdraws(processes=1)
+            withdraw_processing()
+
+            # nonce 7 is not mined for a long time, the node lost nonces 8 and 9, withdraw of nonce 8 is cancelled
+            withdraws[0].sent = datetime.utcnow() - timedelta(days=1)
+            withdraws[1].status = TransactionStatus.fail
+            session.commit()
+            with mock.patch('jco.appprocessor.commands.getManagerNonce', return_value=(7, 8)):
+                withdraw_processing()
+
+        self.assertEqual(send_mock.call_args_list,
+                         [mock.call("0xraw7_20"), mock.call("0xraw8_20"), mock.call("0xraw9_20"),
+                          mock.call("0xfiller8"), mock.call("0xraw7_40"), mock.call("0xraw9_20")])
+        session.expire_all()
+        self.assertEqual((withdraws[0].transaction_id, withdraws[0].get_transaction_ids()),
+                         ("0xtx7_40", ["0xtx7_20", "0xtx7_40"]))
+
+        # the replaced transaction is mined
+        logs = [{'transactionHash': '0xtx7_20', 'blockNumber': '0x64', 'removed': False}]
+        with mock.patch('jco.appprocessor.commands.getBlockNumber', return_value=101), \
+                mock.patch('jco.appprocessor.commands.getWithdrawTransferLogs', return_value=logs):
+            confirm_withdraws_by_logs()
+
+        self.assertEqual((withdraws[0].status, withdraws[0].transaction_id),
+                         (TransactionStatus.success, "0xtx7_20"))
+
+    def test_withdraw_processing_multi_transfer(self):
+        user = create_user("test@test.local", "test@test.local")
+
+        withdraws = [Withdraw(user_id=user.id, to="0x{:040x}".format(i), value=0.001,
+                              status=TransactionStatus.confirmed)
+                     for i in range(5)]
+        session.add_all(withdraws)
+        session.commit()
+
+        with mock.patch('jco.appprocessor.commands.ETH_MULTI_TRANSFER__ADDRESS', '0xmultitransfer'), \
+                mock.patch('jco.appprocessor.commands.ETH_MULTI_TRANSFER__BATCH_SIZE', 3), \
+                mock.patch('jco.appprocessor.commands.getManagerNonce', return_value=(7, 7)), \
+                mock.patch('jco.appprocessor.commands.getTransferGasPrice', return_value=20000000000), \
+                mock.patch('jco.appprocessor.commands.signJNTTransfers',
+                           side_effect=lambda transfers, nonce, gas_price: "0xraw{}".format(nonce)) as sign_mock, \
+                mock.patch('jco.appprocessor.commands.getTransactionHash',
+                           side_effect=lambda raw_tx: raw_tx.replace("raw", "tx")), \
+                mock.patch('jco.appprocessor.commands.sendSignedTransaction',
+                           side_effect=lambda raw_tx: raw_tx.replace("raw", "tx")) as send_mock:
+            sign_withdraws(processes=1)
+
+            self.assertEqual(sign_mock.call_args_list,
+                             [mock.call([(w.to, w.value) for w in withdraws[:3]], 7, 20000000000),
+                              mock.call([(w.to, w.value) for w in withdraws[3:]], 8, 20000000000)])
+            self.assertFalse(send_mock.called, "signing must not broadcast")
+            self.assertEqual([(w.nonce, w.raw_tx, w.transaction_id, w.status, w.sent) for w in withdraws],
+                             [(7, "0xraw7", "0xtx7", TransactionStatus.pending, None)] * 3 +
+                             [(8, "0xraw8", "0xtx8", TransactionStatus.pending, None)] * 2)
+
+            # signed withdraws are not signed again
+            sign_withdraws(processes=1)
+            self.assertEqual(sign_mock.call_count, 2)
+
+            withdraw_processing()
+
+        self.assertEqual(send_mock.call_args_list, [mock.call("0xraw7"), mock.call("0xraw8")])
+
+        session.expire_all()
+        self.assertEqual([(w.nonce, w.transaction_id, w.status) for w in withdraws],
+                         [(7, "0xtx7", TransactionStatus.pending)] * 3 +
+                         [(8, "0xtx8", TransactionStatus.pending)] * 2)
+        self.assertTrue(all(w.sent for w in withdraws))
+        self.assertEqual(session.query(EthNonce).one().next_nonce, 9)
+
+    def test_withdraw_processing_failed_broadcast(self):
+        user = create_user("test@test.local", "test@test.local")
+
+        withdraw = Withdraw(user_id=user.id, to="0x{:040x}".format(1), value=0.001, status=TransactionStatus.confirmed)
+        session.add(withdraw)
+        session.commit()
+
+        gas_prices = [20000000000]
+        with mock.patch('jco.appprocessor.commands.getManagerNonce', return_value=(7, 7)), \
+                mock.patch('jco.appprocessor.commands.getTransferGasPrice', side_effect=lambda: gas_prices[-1]), \
+                mock.patch('jco.appprocessor.commands.signJNTTransfers',
+                           side_effect=lambda transfers, nonce, gas_price: "0xraw{}_{}".format(nonce, gas_price)), \
+                mock.patch('jco.appprocessor.commands.getTransactionHash',
+                           side_effect=lambda raw_tx: raw_tx.replace("raw", "tx")), \
+                mock.patch('jco.appprocessor.commands.sendSignedTransaction', return_value=None) as send_mock:
+            sign_withdraws(processes=1)
+            withdraw_processing()
+
+            # the broadcast failed, the withdraw is pending with the hash of the signed transaction
+            session.expire_all()
+            self.assertEqual((withdraw.transaction_id, withdraw.status),
+                             ("0xtx7_20000000000", TransactionStatus.pending))
+            self.assertIsNotNone(withdraw.sent)
+
+            # the node rejects the stale gas price, the transaction is signed again with the current one
+            gas_prices.append(30000000000)
+            withdraw_processing()
+
+        self.assertEqual(send_mock.call_args_list, [mock.call("0xraw7_20000000000"), mock.call("0xraw7_30000000000")])
+        session.expire_all()
+        self.assertEqual((withdraw.nonce, withdraw.transaction_id, withdraw.get_gas_price()),
+                         (7, "0xtx7_30000000000", 30000000000))
+
+    def test_withdraw_processing_failed_commit_after_broadcast(self):
+        user = create_user("test@test.local", "test@test.local")
+
+        withdraw = Withdraw(user_id=user.id, to="0x{:040x}".format(1), value=0.001, status=TransactionStatus.confirmed)
+        session.add(withdraw)
+        session.commit()
+
+        gas_prices = [20000000000]
+        with mock.patch('jco.appprocessor.commands.getManagerNonce', return_value=(7, 7)), \
+                mock.patch('jco.appprocessor.commands.getTransferGasPrice', side_effect=lambda: gas_prices[-1]), \
+                mock.patch('jco.appprocessor.commands.signJNTTransfers',
+                           side_effect=lambda transfers, nonce, gas_price: "0xraw{}_{}".format(nonce, gas_price)), \
+                mock.patch('jco.appprocessor.commands.getTransactionHash',
+                           side_effect=lambda raw_tx: raw_tx.replace("raw", "tx")), \
+                mock.patch('jco.appprocessor.commands.sendSignedTransaction', return_value=None):
+            sign_withdraws(processes=1)
+            withdraw_processing()
+
+            # the replacement is broadcasted, the commit after the broadcast fails
+            gas_prices.append(30000000000)
+            commit = session.commit
+
+            def fail_after_broadcast():
+                if withdraw.sent is not None and withdraw.sent > sent:
+                    raise OSError("connection is lost")
+                commit()
+
+            session.expire_all()
+            sent = withdraw.sent
+            with mock.patch('jco.appprocessor.commands.session.commit', side_effect=fail_after_broadcast), \
+                    mock.patch('jco.appprocessor.commands.sendSignedTransaction',
+                               side_effect=lambda raw_tx: raw_tx.replace("raw", "tx")) as send_mock:
+                withdraw_processing()
+            self.assertEqual(send_mock.call_args_list, [mock.call("0xraw7_30000000000")])
+
+        # the replacement is mined, the nonce is used by a known transaction
+        session.expire_all()
+        self.assertEqual(withdraw.get_transaction_ids(), ["0xtx7_20000000000", "0xtx7_30000000000"])
+
+        withdraw.sent = datetime.utcnow() - timedelta(days=1)
+        session.commit()
+        tx_infos = {"0xtx7_20000000000": {}, "0xtx7_30000000000": {'status': '0x1', 'blockNumber': '0x64'}}
+        with mock.patch('jco.appprocessor.commands.getManagerNonce', return_value=(8, 8)), \
+                mock.patch('jco.appprocessor.commands.getTransactionsInfo', return_value=tx_infos), \
+                mock.patch('jco.appprocessor.commands.send_email_withdrawal_request_succeeded'):
+            check_withdraw_transactions()
+
+        session.expire_all()
+        self.assertEqual((withdraw.nonce, withdraw.status, withdraw.transaction_id),
+                         (7, TransactionStatus.success, "0xtx7_30000000000"),
+                         "the withdraw must not be released and paid again")
+
     def test_mintJNT(self):
         #tx_id = mintJNT("0xa5e03f38d0a6811d38aa1cf1ddb22a5c6cfa0bd2", 0.001)
         #self.assertTrue(not tx_id is None)
@@ -997,6 +1337,11 @@ class TestCommands(unittest.TestCase):
         self.assertEqual(affiliates[1].url,
                          "https://454048.cpa.clicksure.com/postback?transactionRef=0xffaaaddcc1&clickID=abcdf")
 
+        # the outbox dispatcher adds the event of the same transaction once
+        self.assertFalse(add_transaction_affiliate(account1, transaction1))
+        session.commit()
+        self.assertEqual(session.query(Affiliate).filter(Affiliate.event == AffiliateEvent.transaction).count(), 2)
+
     def test_check_new_registartions(self):
         user1 = create_user("user1", "user1@local")
         user2 = create_user("user2", "user2@local")
@@ -0,0 +1,121 @@
+"""
+Public derivation of deposit addresses m/44'/coin'/0'/0/i from account-level extended public keys (xpub).
+
+The external chain node (xpub/0) is derived once per range. Child points are computed with libsecp256k1
+if `coincurve` is installed, with the pure Python implementation of `crypto` otherwise.
+Large ranges are split in chunks and derived in a process pool, chunks are yielded in the index order.
+"""
+import hashlib
+import hmac
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Iterator, List
+
+from pycoin.encoding import hash160, hash160_sec_to_bitcoin_address
+from rlp.utils import encode_hex
+
+from jco.commonutils.crypto import HDKey, HDPublicKey, bitcoin_curve, sha3
+from jco.commonutils.utils import checksum_encode
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+
+ETH = 'ETH'
+BTC = 'BTC'
+
+EXTERNAL_CHAIN = 0
+
+
+def get_external_chain_key(xpub: str) -> HDPublicKey:
+    acct_pub_key = HDKey.from_b58check(xpub)
+    if not isinstance(acct_pub_key, HDPublicKey):
+        raise ValueError("Account key must be an extended public key")
+    return HDPublicKey.from_parent(acct_pub_key, EXTERNAL_CHAIN)
+
+
+def format_address(currency: str, public_key: bytes) -> str:
+    """
+    Format address of the uncompressed (65 bytes) public key
+    """
+    if currency == ETH:
+        return checksum_encode(encode_hex(sha3(public_key[1:])[12:]))
+    if currency == BTC:
+        prefix = b'\x03' if public_key[-1] & 1 else b'\x02'
+        return hash160_sec_to_bitcoin_address(hash160(prefix + public_key[1:33]))
+    raise ValueError("Unsupported currency '{}'".format(currency))
+
+
+def _child_tweak(chain_key: HDPublicKey, index: int) -> bytes:
+    I = hmac.new(chain_key.chain_code,
+                 chain_key.compressed_bytes + index.to_bytes(length=4, byteorder='big'),
+                 hashlib.sha512).digest()
+    if int.from_bytes(I[:32], 'big') >= bitcoin_curve.n:
+        raise ValueError("Invalid child key with index {}".format(index))
+    return I[:32]
+
+
+def _derive_public_keys_secp256k1(chain_key: HDPublicKey, offset: int, key_count: int) -> List[bytes]:
+    parent = coincurve.PublicKey(chain_key.compressed_bytes)
+    return [parent.add(_child_tweak(chain_key, index)).format(compressed=False)
+            for index in range(offset, key_count + offset)]
+
+
+def _derive_public_keys_python(chain_key: HDPublicKey, offset: int, key_count: int) -> List[bytes]:
+    public_keys = []
+    for index in range(offset, key_count + offset):
+        child_key = HDPublicKey.from_parent(chain_key, index)
+        if child_key is None:
+            raise ValueError("Invalid child key with index {}".format(index))
+        public_keys.append(bytes(child_key._key))
+    return public_keys
+
+
+def derive_public_keys(chain_key: HDPublicKey, offset: int, key_count: int) -> List[bytes]:
+    """
+    Derive uncompressed public keys of children [offset, offset + key_count) of the chain key
+    """
+    if coincurve is not None:
+        return _derive_public_keys_secp256k1(chain_key, offset, key_count)
+    return _derive_public_keys_python(chain_key, offset, key_count)
+
+
+def _derive_addresses_chunk(currency: str, xpub: str, offset: int, key_count: int) -> List[str]:
+    chain_key = get_external_chain_key(xpub)
+    return [format_address(currency, public_key)
+            for public_key in derive_public_keys(chain_key, offset, key_count)]
+
+
+def iter_address_chunks(currency: str, xpub: str, offset: int, key_count: int, *,
+                        processes: int = 1, chunk_size: int = 1000) -> Iterator[List[str]]:
+    """
+    Derive addresses of the external chain of the account xpub by chunks of `chunk_size`, ordered by index.
+    At most `processes` chunks are derived ahead of the consumer
+    """
+    starts = range(offset, key_count + offset, chunk_size)
+    if processes <= 1 or key_count <= chunk_size:
+        for start in starts:
+            yield _derive_addresses_chunk(currency, xpub, start, min(chunk_size, key_count + offset - start))
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for start in starts:
+            pending.append(executor.submit(_derive_addresses_chunk, currency, xpub,
+                                           start, min(chunk_size, key_count + offset - start)))
+            if len(pending) >= processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def derive_addresses(currency: str, xpub: str, offset: int, key_count: int, *,
+                     processes: int = 1, chunk_size: int = 1000) -> List[str]:
+    """
+    Derive addresses of the external chain of the account xpub, ordered by index
+    """
+    return list(chain.from_iterable(iter_address_chunks(currency, xpub, offset, key_count,
+                                                        processes=processes, chunk_size=chunk_size)))
@@ -2,9 +2,10 @@ import sys
 import os
 import json
 import logging
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List, Dict
 from decimal import Decimal
 import traceback
+import threading
 
 import rlp
 from ethereum import transactions
@@ -12,9 +13,13 @@ from ethereum import utils
 from ethereum import abi
 from eth_utils import currency
 
-from jco.commonutils.ethjsonrpc import EthJsonRpc
+from jco.commonutils.ethjsonrpc import EthJsonRpc, BadResponseError, hex_to_dec
+from jco.commonutils.gas_oracle import GasPriceOracle
 from jco.settings import (
     ETH_NODE__ADDRESS,
+    ETH_NODE__BATCH_SIZE,
+    ETH_NODE__TIMEOUT,
+    ETH_NODE__POOL_SIZE,
     ETH_NETWORK__ID,
     ETH_MANAGER__PRIVATE_KEY,
     ETH_MANAGER__ADDRESS,
@@ -22,14 +27,38 @@ from jco.settings import (
     ETH_CONTRACT__GAZ_MULTIPLICATOR,
     ETH_CONTRACT__ADDRESS,
     ETH_CONTRACT__ABI,
+    ETH_MULTI_TRANSFER__ADDRESS,
+    ETH_MULTI_TRANSFER__BASE_GAS,
+    ETH_MULTI_TRANSFER__GAS_PER_TRANSFER,
+    ETH_MULTI_TRANSFER__ABI,
+    ETH_NONCE__REPLACEMENT_GAS_BUMP,
+    ETH_NONCE__FILLER_GAS_LIMIT,
+    GAS_ORACLE__BLOCK_COUNT,
+    GAS_ORACLE__PERCENTILE,
+    GAS_ORACLE__TTL,
+    GAS_ORACLE__MIN_PRICE,
+    GAS_ORACLE__MAX_PRICE,
 )
 
 
+TRANSFER_EVENT_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
 class Contract:
     def __init__(self, host: str, expectedNetworkId: int):
         self._host = host  # type: str
         self._networkId = int(expectedNetworkId)  # type: int
-        self._ethJsonRpc = EthJsonRpc(self._host, tls=True)  # type: EthJsonRpc
+        self._ethJsonRpc = EthJsonRpc(self._host,
+                                      tls=True,
+                                      timeout=ETH_NODE__TIMEOUT,
+                                      pool_maxsize=ETH_NODE__POOL_SIZE)  # type: EthJsonRpc
+        self._gasOracle = GasPriceOracle(self._ethJsonRpc,
+                                         block_count=GAS_ORACLE__BLOCK_COUNT,
+                                         percentile=GAS_ORACLE__PERCENTILE,
+                                         ttl=GAS_ORACLE__TTL,
+                                         min_price=GAS_ORACLE__MIN_PRICE,
+                                         max_price=GAS_ORACLE__MAX_PRICE,
+                                         fallback_multiplier=ETH_CONTRACT__GAZ_MULTIPLICATOR)  # type: GasPriceOracle
 
 
     @classmethod
@@ -68,8 +97,7 @@ class Contract:
 
 
     def getNonce(self, address: str) -> Tuple[Optional[int], Optional[int]]:
-        _latest = self._ethJsonRpc.eth_getTransactionCount(address)
-        _pending = self._ethJsonRpc.eth_getTransactionCount(address, 'pending')
+        _latest, _pending = self._ethJsonRpc.batch_eth_getTransactionCount(address, ['latest', 'pending'])
 
         return (_latest, _pending)
 
@@ -78,6 +106,12 @@ class Contract:
         return self._ethJsonRpc.eth_gasPrice()
 
 
+    def getOracleGasPrice(self, previous: Optional[int] = None) -> Optional[int]:
+        if previous:
+            return self._gasOracle.get_replacement_gas_price(previous, ETH_NONCE__REPLACEMENT_GAS_BUMP)
+        return self._gasOracle.get_gas_price()
+
+
     def getGasLimit(self, to_address: str, from_address: str, data: str) -> Decimal:
         return self._ethJsonRpc.eth_estimateGas(to_address=to_address, from_address=from_address, data=data)
 
@@ -90,31 +124,139 @@ class Contract:
         return self._ethJsonRpc.eth_getTransactionReceipt(_tx_id)
 
 
-def mintJNT(to_address: str, value: float) -> str:
-    try:
-        logging.getLogger(__name__).info("Start mintJNT to:{}, value:{}".format(to_address, value))
+    def getTransactionReceipts(self, _tx_ids: List[str]) -> List[Optional[dict]]:
+        """
+        Receipts of the transactions, a failed one is returned as BadResponseError
+        """
+        return self._ethJsonRpc.batch_eth_getTransactionReceipt(_tx_ids, item_errors=True)
 
-        contract = Contract(ETH_NODE__ADDRESS, ETH_NETWORK__ID)
 
-        _value_wei = currency.to_wei(value, 'ether')
+    def getBlockNumber(self) -> int:
+        return self._ethJsonRpc.eth_blockNumber()
 
-        _abi = ETH_CONTRACT__ABI
-        _tx_data = Contract.encodeFunctionTxData(_abi,
-                                                 "transfer",
-                                                 [to_address, _value_wei])
 
-        _tx_nonce_latest, _tx_nonce_pending = contract.getNonce(ETH_MANAGER__ADDRESS)
-        _tx_gas_price = int(contract.getGasPrice() * ETH_CONTRACT__GAZ_MULTIPLICATOR)
+    def getTransferLogs(self, from_block: int, to_block: int, from_addresses: List[str]) -> List[dict]:
+        """
+        Transfer events of the token contract sent from any of the addresses in the block range
+        """
+        return self._ethJsonRpc.eth_getLogs({
+            'fromBlock': hex(from_block),
+            'toBlock': hex(to_block),
+            'address': ETH_CONTRACT__ADDRESS,
+            'topics': [TRANSFER_EVENT_TOPIC,
+                       ['0x' + from_address.lower()[2:].rjust(64, '0') for from_address in from_addresses]],
+        })
+
+
+_contract = None  # type: Optional[Contract]
+_contract_pid = None  # type: Optional[int]
+_contract_lock = threading.Lock()
+
+
+def get_contract() -> Contract:
+    """
+    Process-wide Contract, created on the first use. Connections to the node are kept alive and
+    shared by all threads of the process, a forked process creates its own Contract
+    """
+    global _contract, _contract_pid
+
+    with _contract_lock:
+        if _contract is None or _contract_pid != os.getpid():
+            _contract = Contract(ETH_NODE__ADDRESS, ETH_NETWORK__ID)
+            _contract_pid = os.getpid()
+        return _contract
+
+
+def signJNTTransfers(transfers: List[Tuple[str, float]], nonce: int, gas_price: int) -> str:
+    """
+    Sign the transaction of JNT transfers from the manager address offline, without requests to the node.
+    A single transfer is sent to the token contract, several transfers to the multi-transfer contract
+    """
+    if len(transfers) == 1:
+        to_address, value = transfers[0]
+        _tx_to = ETH_CONTRACT__ADDRESS
+        _tx_data = Contract.encodeFunctionTxData(ETH_CONTRACT__ABI,
+                                                 "transfer",
+                                                 [to_address, currency.to_wei(value, 'ether')])
         _tx_gas_limit = ETH_CONTRACT__GAS_LIMIT
+    else:
+        _tx_to = ETH_MULTI_TRANSFER__ADDRESS
+        _tx_data = Contract.encodeFunctionTxData(ETH_MULTI_TRANSFER__ABI,
+                                                 "multiTransfer",
+                                                 [[to_address for to_address, value in transfers],
+                                                  [currency.to_wei(value, 'ether') for to_address, value in transfers]])
+        _tx_gas_limit = ETH_MULTI_TRANSFER__BASE_GAS + ETH_MULTI_TRANSFER__GAS_PER_TRANSFER * len(transfers)
+
+    return Contract.signTransaction(privateKey=ETH_MANAGER__PRIVATE_KEY,
+                                    to=_tx_to,
+                                    value=0,
+                                    nonce=nonce,
+                                    gasPrice=gas_price,
+                                    gas=_tx_gas_limit,
+                                    data=_tx_data,
+                                    network_id=ETH_NETWORK__ID)
+
+
+def signNonceFiller(nonce: int, gas_price: int) -> str:
+    """
+    Sign the transaction without value from the manager address to itself,
+    it uses the nonce abandoned by withdraws so that the next transactions are mined
+    """
+    return Contract.signTransaction(privateKey=ETH_MANAGER__PRIVATE_KEY,
+                                    to=ETH_MANAGER__ADDRESS,
+                                    value=0,
+                                    nonce=nonce,
+                                    gasPrice=gas_price,
+                                    gas=ETH_NONCE__FILLER_GAS_LIMIT,
+                                    network_id=ETH_NETWORK__ID)
+
+
+def getTransactionHash(tx_sign_data: str) -> str:
+    """
+    Hash of the signed transaction, known before it's broadcasted
+    """
+    return '0x' + utils.sha3(utils.decode_hex(tx_sign_data[2:])).hex()
+
+
+def getTransferGasPrice(previous: Optional[int] = None) -> Optional[int]:
+    """
+    Gas price of withdraws from the gas price oracle of the process,
+    bumped above the previous price of the replaced transaction if it is given.
+    None if the bumped price is above GAS_ORACLE__MAX_PRICE
+    """
+    try:
+        return get_contract().getOracleGasPrice(previous)
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed getTransferGasPrice due to exception:\n{}"
+                                          .format(exception_str))
+        return None
+
 
-        _tx_sign_data = Contract.signTransaction(privateKey=ETH_MANAGER__PRIVATE_KEY,
-                                                 to=ETH_CONTRACT__ADDRESS,
-                                                 value=0,
-                                                 nonce=_tx_nonce_pending,
-                                                 gasPrice=_tx_gas_price,
-                                                 gas=_tx_gas_limit,
-                                                 data=_tx_data,
-                                                 network_id=ETH_NETWORK__ID)
+def sendSignedTransaction(tx_sign_data: str) -> Optional[str]:
+    try:
+        return get_contract().sendRawTransaction(tx_sign_data)
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed sendSignedTransaction due to exception:\n{}"
+                                          .format(exception_str))
+        return None
+
+
+def mintJNT(to_address: str, value: float, nonce: Optional[int] = None) -> str:
+    """
+    Send JNT transfer from the manager address, with the pending nonce of the node if `nonce` is not given
+    """
+    try:
+        logging.getLogger(__name__).info("Start mintJNT to:{}, value:{}, nonce:{}".format(to_address, value, nonce))
+
+        contract = get_contract()
+
+        if nonce is None:
+            _tx_nonce_latest, nonce = contract.getNonce(ETH_MANAGER__ADDRESS)
+        _tx_gas_price = contract.getOracleGasPrice()
+
+        _tx_sign_data = signJNTTransfers([(to_address, value)], nonce, _tx_gas_price)
 
         try:
             _tx_id = contract.sendRawTransaction(_tx_sign_data)
@@ -133,9 +275,99 @@ def mintJNT(to_address: str, value: float) -> str:
         return None
 
 
+def multiTransferJNT(transfers: List[Tuple[str, float]], nonce: int) -> Optional[str]:
+    """
+    Send JNT to several addresses from the manager address in one transaction of the multi-transfer contract
+    """
+    try:
+        logging.getLogger(__name__).info("Start multiTransferJNT of {} transfers, nonce:{}"
+                                         .format(len(transfers), nonce))
+
+        contract = get_contract()
+
+        _tx_gas_price = contract.getOracleGasPrice()
+        _tx_sign_data = signJNTTransfers(transfers, nonce, _tx_gas_price)
+
+        _tx_id = contract.sendRawTransaction(_tx_sign_data)
+
+        logging.getLogger(__name__).info("Finished multiTransferJNT of {} transfers".format(len(transfers)))
+        return _tx_id
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed multiTransferJNT due to exception:\n{}"
+                                          .format(exception_str))
+        return None
+
+
+def getManagerNonce() -> Tuple[Optional[int], Optional[int]]:
+    """
+    Latest (mined) and pending transaction count of the manager address
+    """
+    try:
+        return get_contract().getNonce(ETH_MANAGER__ADDRESS)
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed getManagerNonce due to exception:\n{}"
+                                          .format(exception_str))
+        return None, None
+
+
+def getTransactionsInfo(tx_ids: List[str]) -> Dict[str, Optional[dict]]:
+    """
+    Receipts of the transactions, fetched by batch requests of ETH_NODE__BATCH_SIZE.
+    Transactions which receipts failed to be fetched are missed
+    """
+    contract = get_contract()
+
+    receipts = {}
+    for i in range(0, len(tx_ids), ETH_NODE__BATCH_SIZE):
+        batch = tx_ids[i:i + ETH_NODE__BATCH_SIZE]
+        try:
+            batch_receipts = contract.getTransactionReceipts(batch)
+        except Exception:
+            exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+            logging.getLogger(__name__).error("Failed getTransactionsInfo of {} transactions due to exception:\n{}"
+                                              .format(len(batch), exception_str))
+            continue
+
+        for tx_id, receipt in zip(batch, batch_receipts):
+            if isinstance(receipt, BadResponseError):
+                logging.getLogger(__name__).error("Failed getTransactionsInfo of {}: {}".format(tx_id, receipt))
+                continue
+            receipts[tx_id] = receipt
+    return receipts
+
+
+def getBlockNumber() -> Optional[int]:
+    try:
+        return get_contract().getBlockNumber()
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed getBlockNumber due to exception:\n{}"
+                                          .format(exception_str))
+        return None
+
+
+def getWithdrawTransferLogs(from_block: int, to_block: int) -> Optional[List[dict]]:
+    """
+    JNT transfers of withdraws in the block range. They are sent from the manager address,
+    or from the multi-transfer contract if it holds JNT and transfers them itself
+    """
+    from_addresses = [ETH_MANAGER__ADDRESS]
+    if ETH_MULTI_TRANSFER__ADDRESS:
+        from_addresses.append(ETH_MULTI_TRANSFER__ADDRESS)
+    try:
+        return get_contract().getTransferLogs(from_block, to_block, from_addresses)
+    except Exception:
+        exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+        logging.getLogger(__name__).error("Failed getWithdrawTransferLogs due to exception:\n{}"
+                                          .format(exception_str))
+        return None
+
+
 def getTransactionInfo(tx_id: str) -> Optional[dict]:
     try:
-        contract = Contract(ETH_NODE__ADDRESS, ETH_NETWORK__ID)
+        contract = get_contract()
 
         return contract.getTransactionReceipt(tx_id)
     except Exception:
@@ -40,6 +40,156 @@ def get_bytes(s):
     return b
 
 
+class FixedBaseTable(object):
+    """ Precomputed multiples of the secp256k1 generator point for
+    windowed fixed-base scalar multiplication.
+
+    For every window j of WINDOW_BITS bits of the scalar the table
+    keeps d * 2^(WINDOW_BITS * j) * G for d = 1 .. 2^WINDOW_BITS - 1,
+    so k * G takes one point addition per non-zero window and no
+    doublings. Additions are done in Jacobian coordinates with a single
+    inversion at the end.
+
+    Args:
+        window_bits (int): Number of scalar bits per window.
+    """
+    P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+    N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+    GX = 0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798
+    GY = 0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8
+
+    WINDOW_BITS = 8
+
+    def __init__(self, window_bits=WINDOW_BITS):
+        self.window_bits = window_bits
+        self.windows = []
+
+        window_size = 1 << window_bits
+        base = (self.GX, self.GY)
+        for _ in range((256 + window_bits - 1) // window_bits):
+            multiples = [(base[0], base[1], 1)]
+            for _ in range(window_size - 1):
+                multiples.append(self._add_mixed(multiples[-1], base))
+            multiples = self._batch_to_affine(multiples)
+            base = multiples.pop()
+            self.windows.append(multiples)
+
+    def _double(self, a):
+        P = self.P
+        x, y, z = a
+        if y == 0:
+            return None
+        yy = y * y % P
+        s = 4 * x * yy % P
+        m = 3 * x * x % P
+        x3 = (m * m - 2 * s) % P
+        y3 = (m * (s - x3) - 8 * yy * yy) % P
+        z3 = 2 * y * z % P
+        return x3, y3, z3
+
+    def _add_mixed(self, a, b):
+        """ Adds an affine point b to a Jacobian point a.
+        None stands for the point at infinity.
+        """
+        if a is None:
+            return b[0], b[1], 1
+
+        P = self.P
+        x1, y1, z1 = a
+        x2, y2 = b
+        z1z1 = z1 * z1 % P
+        h = (x2 * z1z1 - x1) % P
+        r = (y2 * z1 * z1z1 - y1) % P
+        if h == 0:
+            return self._double(a) if r == 0 else None
+
+        hh = h * h % P
+        hhh = h * hh % P
+        v = x1 * hh % P
+        x3 = (r * r - hhh - 2 * v) % P
+        y3 = (r * (v - x3) - y1 * hhh) % P
+        z3 = z1 * h % P
+        return x3, y3, z3
+
+    def _to_affine(self, a):
+        P = self.P
+        x, y, z = a
+        z_inv = pow(z, P - 2, P)
+        z_inv2 = z_inv * z_inv % P
+        return x * z_inv2 % P, y * z_inv2 * z_inv % P
+
+    def _batch_to_affine(self, points):
+        """ Converts Jacobian points to affine with a single inversion
+        (Montgomery's trick).
+        """
+        P = self.P
+        products = []
+        acc = 1
+        for _, _, z in points:
+            acc = acc * z % P
+            products.append(acc)
+
+        acc_inv = pow(acc, P - 2, P)
+        affine = [None] * len(points)
+        for i in range(len(points) - 1, -1, -1):
+            x, y, z = points[i]
+            z_inv = acc_inv * products[i - 1] % P if i else acc_inv
+            acc_inv = acc_inv * z % P
+            z_inv2 = z_inv * z_inv % P
+            affine[i] = (x * z_inv2 % P, y * z_inv2 * z_inv % P)
+        return affine
+
+    def multiply(self, k):
+        """ Computes k * G.
+
+        Args:
+            k (int): The scalar, 0 < k < n.
+
+        Returns:
+            tuple: Affine (x, y) coordinates of k * G.
+        """
+        k %= self.N
+        if k == 0:
+            raise ValueError("k must be in the range 0 < k < n.")
+
+        mask = (1 << self.window_bits) - 1
+        acc = None
+        for multiples in self.windows:
+            d = k & mask
+            if d:
+                acc = self._add_mixed(acc, multiples[d - 1])
+            k >>= self.window_bits
+            if not k:
+                break
+        return self._to_affine(acc)
+
+
+FIXED_BASE_TABLE_ENABLED = True
+_fixed_base_table = None
+
+
+def base_point_mult(k):
+    """ Computes the public point k * G on the secp256k1 curve.
+
+    Uses the precomputed FixedBaseTable, which is built on the first
+    call in the process, unless FIXED_BASE_TABLE_ENABLED is False.
+
+    Args:
+        k (int): The private key.
+
+    Returns:
+        ECPointAffine: The public point.
+    """
+    global _fixed_base_table
+    if not FIXED_BASE_TABLE_ENABLED:
+        return bitcoin_curve.public_key(k)
+
+    if _fixed_base_table is None:
+        _fixed_base_table = FixedBaseTable()
+    x, y = _fixed_base_table.multiply(k)
+    return ECPointAffine(bitcoin_curve, x, y)
+
+
 class PrivateKeyBase(object):
     """ Base class for both PrivateKey and HDPrivateKey.
 
@@ -380,8 +530,7 @@ class PrivateKey(PrivateKeyBase):
                 private key.
         """
         if self._public_key is None:
-            self._public_key = PublicKey.from_point(
-                bitcoin_curve.public_key(self.key))
+            self._public_key = PublicKey.from_point(base_point_mult(self.key))
         return self._public_key
 
     def raw_sign(self, message, do_hash=True):
@@ -1539,8 +1688,7 @@ class HDPublicKey(HDKey, PublicKeyBase):
                 if parse_Il >= bitcoin_curve.n:
                     return None
 
-                temp_priv_key = PrivateKey(parse_Il)
-                Ki = temp_priv_key.public_key.point + parent_key._key.point
+                Ki = base_point_mult(parse_Il) + parent_key._key.point
                 if Ki.infinity:
                     return None
 
@@ -3,7 +3,8 @@ import warnings
 
 import requests
 from requests.adapters import HTTPAdapter
-from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+from requests.packages.urllib3.util.retry import Retry
 from ethereum import utils
 from ethereum.abi import encode_abi, decode_abi
 
@@ -96,6 +97,8 @@ ETH_DEFAULT_RPC_PORT = 8545
 PARITY_DEFAULT_RPC_PORT = 8545
 PYETHAPP_DEFAULT_RPC_PORT = 4000
 MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.3
+DEFAULT_POOL_MAXSIZE = 10
 JSON_MEDIA_TYPE = 'application/json'
 
 
@@ -107,41 +110,92 @@ class EthJsonRpc(object):
     DEFAULT_GAS_PER_TX = 90000
     DEFAULT_GAS_PRICE = 50 * 10**9  # 50 gwei
 
-    def __init__(self, host='localhost', tls=False):
+    def __init__(self, host='localhost', tls=False, timeout=None, pool_maxsize=DEFAULT_POOL_MAXSIZE):
         self.host = host
         self.tls = tls
-        self.session = requests.Session()
-        self.session.mount(self.host, HTTPAdapter(max_retries=MAX_RETRIES))
-
-    def _call(self, method, params=None, _id=1):
-
-        params = params or []
-        data = {
-            'jsonrpc': '2.0',
-            'method':  method,
-            'params':  params,
-            'id':      _id,
-        }
+        self.timeout = timeout
         scheme = 'http'
         if self.tls:
             scheme += 's'
-        url = '{}://{}'.format(scheme, self.host)
+        self.url = '{}://{}'.format(scheme, self.host)
+        # Connections are kept alive in the pool of the session, urllib3 pool is thread-safe.
+        # Only failed connects are retried, a request that could reach the node (eth_sendRawTransaction)
+        # is never sent again
+        retry = Retry(total=MAX_RETRIES,
+                      connect=MAX_RETRIES,
+                      read=0,
+                      redirect=0,
+                      status=0,
+                      backoff_factor=RETRY_BACKOFF_FACTOR,
+                      raise_on_status=False)
+        self.session = requests.Session()
+        self.session.mount(self.url, HTTPAdapter(max_retries=retry,
+                                                 pool_connections=1,
+                                                 pool_maxsize=pool_maxsize))
+
+    def _post(self, data):
         headers = {'Content-Type': JSON_MEDIA_TYPE}
         try:
-            r = self.session.post(url, headers=headers, data=json.dumps(data))
-        except RequestsConnectionError:
+            r = self.session.post(self.url, headers=headers, data=json.dumps(data), timeout=self.timeout)
+        except (RequestsConnectionError, Timeout):
             raise ConnectionError
         if r.status_code / 100 != 2:
             raise BadStatusCodeError(r.status_code)
         try:
-            response = r.json()
+            return r.json()
         except ValueError:
             raise BadJsonError(r.text)
+
+    def _call(self, method, params=None, _id=1):
+
+        params = params or []
+        data = {
+            'jsonrpc': '2.0',
+            'method':  method,
+            'params':  params,
+            'id':      _id,
+        }
+        response = self._post(data)
         try:
             return response['result']
         except KeyError:
             raise BadResponseError(response)
 
+    def _batch_call(self, calls, item_errors=False):
+        '''
+        Send several methods in one JSON-RPC batch request.
+        `calls` is a list of (method, params), results are returned in the same order,
+        matched with responses by id. An error of one call raises BadResponseError,
+        or is returned in place of its result if `item_errors` is set
+        '''
+        if not calls:
+            return []
+
+        data = [
+            {
+                'jsonrpc': '2.0',
+                'method':  method,
+                'params':  params or [],
+                'id':      _id,
+            }
+            for _id, (method, params) in enumerate(calls)
+        ]
+        response = self._post(data)
+        if not isinstance(response, list):
+            raise BadResponseError(response)
+
+        responses = {item.get('id'): item for item in response if isinstance(item, dict)}
+        results = []
+        for _id in range(len(calls)):
+            try:
+                results.append(responses[_id]['result'])
+            except KeyError:
+                error = BadResponseError(responses.get(_id, response))
+                if not item_errors:
+                    raise error
+                results.append(error)
+        return results
+
     def _encode_function(self, signature, param_values):
 
         prefix = utils.big_endian_to_int(utils.sha3(signature)[:4])
@@ -344,6 +398,14 @@ class EthJsonRpc(object):
         block = validate_block(block)
         return hex_to_dec(self._call('eth_getTransactionCount', [address, block]))
 
+    def batch_eth_getTransactionCount(self, address, blocks):
+        '''
+        eth_getTransactionCount of the address at several blocks in one batch request
+        '''
+        return [hex_to_dec(count)
+                for count in self._batch_call([('eth_getTransactionCount', [address, validate_block(block)])
+                                               for block in blocks])]
+
     def eth_getBlockTransactionCountByHash(self, block_hash):
         '''
         https://github.com/ethereum/wiki/wiki/JSON-RPC#eth_getblocktransactioncountbyhash
@@ -494,6 +556,12 @@ class EthJsonRpc(object):
         block = validate_block(block)
         return self._call('eth_getBlockByNumber', [block, tx_objects])
 
+    def batch_eth_getBlockByNumber(self, blocks, tx_objects=True):
+        '''
+        eth_getBlockByNumber of several blocks in one batch request
+        '''
+        return self._batch_call([('eth_getBlockByNumber', [validate_block(block), tx_objects]) for block in blocks])
+
     def eth_getTransactionByHash(self, tx_hash):
         '''
         https://github.com/ethereum/wiki/wiki/JSON-RPC#eth_gettransactionbyhash
@@ -527,6 +595,13 @@ class EthJsonRpc(object):
         '''
         return self._call('eth_getTransactionReceipt', [tx_hash])
 
+    def batch_eth_getTransactionReceipt(self, tx_hashes, item_errors=False):
+        '''
+        eth_getTransactionReceipt of several transactions in one batch request
+        '''
+        return self._batch_call([('eth_getTransactionReceipt', [tx_hash]) for tx_hash in tx_hashes],
+                                item_errors=item_errors)
+
     def eth_getUncleByBlockHashAndIndex(self, block_hash, index=0):
         '''
         https://github.com/ethereum/wiki/wiki/JSON-RPC#eth_getunclebyblockhashandindex
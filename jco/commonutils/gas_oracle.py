@@ -0,0 +1,96 @@
+"""
+Gas price oracle of the withdraw transactions.
+
+Gas prices of transactions in the recent blocks are sampled with one batch request to the node, the percentile
+of them is kept in memory for `ttl` seconds and served to all signers of the process.
+"""
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional
+
+from jco.commonutils.ethjsonrpc import EthJsonRpc, hex_to_dec
+
+
+def percentile_gas_price(blocks: List[dict], percentile: float) -> Optional[int]:
+    """
+    Nearest-rank percentile of gas prices of the block transactions, None if there are no transactions
+    """
+    gas_prices = sorted(hex_to_dec(tx['gasPrice'])
+                        for block in blocks if block
+                        for tx in block.get('transactions', []))
+    if not gas_prices:
+        return None
+    rank = max(int(math.ceil(percentile / 100 * len(gas_prices))), 1)
+    return gas_prices[rank - 1]
+
+
+class GasPriceOracle:
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 rpc: EthJsonRpc,
+                 block_count: int,
+                 percentile: float,
+                 ttl: float,
+                 min_price: int,
+                 max_price: int,
+                 fallback_multiplier: float):
+        self._rpc = rpc
+        self._block_count = block_count
+        self._percentile = percentile
+        self._ttl = ttl
+        self._min_price = min_price
+        self._max_price = max_price
+        self._fallback_multiplier = fallback_multiplier
+        self._lock = threading.Lock()
+        self._price = None  # type: Optional[int]
+        self._updated = None  # type: Optional[float]
+
+    def sample(self) -> int:
+        """
+        Percentile gas price of the recent blocks, the node gas price (with the multiplier)
+        if there are no transactions in them
+        """
+        latest = self._rpc.eth_blockNumber()
+        blocks = self._rpc.batch_eth_getBlockByNumber(range(max(latest - self._block_count + 1, 0), latest + 1))
+        price = percentile_gas_price(blocks, self._percentile)
+        if price is None:
+            price = int(self._rpc.eth_gasPrice() * self._fallback_multiplier)
+        return min(max(price, self._min_price), self._max_price)
+
+    def get_gas_price(self) -> int:
+        """
+        Cached gas price, sampled again after `ttl`. The previous price is served if the node fails,
+        the sampling is retried on the next call
+        """
+        with self._lock:
+            if self._updated is None or time.monotonic() - self._updated >= self._ttl:
+                # noinspection PyBroadException
+                try:
+                    self._price = self.sample()
+                    self._updated = time.monotonic()
+                    self._logger.info("Gas price {} sampled from {} blocks".format(self._price, self._block_count))
+                except Exception:
+                    if self._price is None:
+                        raise
+                    exception_str = ''.join(traceback.format_exception(*sys.exc_info()))
+                    self._logger.error("Failed to sample gas price, serve the previous one {} due to exception:\n{}"
+                                       .format(self._price, exception_str))
+            return self._price
+
+    def get_replacement_gas_price(self, previous: int, bump: float) -> Optional[int]:
+        """
+        Gas price of a transaction replacing the pending one with the same nonce,
+        the node accepts the replacement only if its price is bumped.
+        None if the bumped price is above the max price, the transaction is not replaced
+        """
+        bumped = int(math.ceil(previous * bump))
+        if bumped > self._max_price:
+            self._logger.warning("Replacement gas price {} is above the max price {}, the transaction is not replaced"
+                                 .format(bumped, self._max_price))
+            return None
+        return max(self.get_gas_price(), bumped)
@@ -0,0 +1,73 @@
+import unittest
+
+from mnemonic import Mnemonic
+from pycoin.key.BIP32Node import BIP32Node
+
+from jco.commonutils import address_derivation
+from jco.commonutils.address_derivation import (
+    ETH,
+    BTC,
+    derive_addresses,
+    format_address,
+    get_external_chain_key,
+    _derive_public_keys_python,
+    _derive_public_keys_secp256k1,
+)
+from jco.commonutils.crypto import HDPrivateKey, HDKey
+from jco.commonutils.utils import checksum_encode
+
+
+MNEMONIC = "panel random cargo number belt faint pave dignity various glare able segment shy connect agent cruise service burst tenant space unhappy amused immune start"
+
+
+class TestAddressDerivation(unittest.TestCase):
+    def setUp(self):
+        self.eth_acct_key = HDKey.from_path(HDPrivateKey.master_key_from_mnemonic(MNEMONIC), "m/44'/60'/0'")[-1]
+        self.eth_xpub = self.eth_acct_key.public_key.to_b58check()
+        self.btc_node = BIP32Node.from_master_secret(Mnemonic.to_seed(MNEMONIC), 'BTC')
+        self.btc_xpub = self.btc_node.subkey_for_path("44'/0'/0'").hwif()
+
+    def legacy_eth_addresses(self, offset, key_count):
+        return [checksum_encode(HDKey.from_path(self.eth_acct_key.public_key, '0/{}'.format(index))[-1].address()[2:])
+                for index in range(offset, key_count + offset)]
+
+    def legacy_btc_addresses(self, offset, key_count):
+        return [self.btc_node.subkey_for_path("44'/0'/0'/0/%d" % index).address()
+                for index in range(offset, key_count + offset)]
+
+    def test_derive_eth_addresses(self):
+        addresses = derive_addresses(ETH, self.eth_xpub, 0, 3)
+        self.assertEqual(addresses, ['0x7039D52049134cA39ff431bF11e439cBbe281BFF',
+                                     '0xf404d1942cE1e4F10fA638616c5A0F3acEc31FF8',
+                                     '0xA3EB7cE1D9083c7138Cff55cE7b9a442203fF2e6'])
+        self.assertEqual(derive_addresses(ETH, self.eth_xpub, 17, 5), self.legacy_eth_addresses(17, 5))
+
+    def test_derive_btc_addresses(self):
+        addresses = derive_addresses(BTC, self.btc_xpub, 0, 3)
+        self.assertEqual(addresses, ['1PXTe9LKPK7gNN997v3cQtCuNpiCRQSrdW',
+                                     '1CWKsFYaTRb5UEmYagSgjB3B6J3p2YtmYe',
+                                     '1Gw2TkJZhSSzJQ2dovuaGbTGYCiEJyG3BJ'])
+        self.assertEqual(derive_addresses(BTC, self.btc_xpub, 17, 5), self.legacy_btc_addresses(17, 5))
+
+    def test_derive_addresses_process_pool(self):
+        self.assertEqual(derive_addresses(ETH, self.eth_xpub, 3, 10, processes=3, chunk_size=4),
+                         self.legacy_eth_addresses(3, 10))
+        self.assertEqual(derive_addresses(BTC, self.btc_xpub, 3, 10, processes=3, chunk_size=4),
+                         self.legacy_btc_addresses(3, 10))
+
+    @unittest.skipIf(address_derivation.coincurve is None, "coincurve is not installed")
+    def test_secp256k1_backend(self):
+        chain_key = get_external_chain_key(self.eth_xpub)
+        self.assertEqual(_derive_public_keys_secp256k1(chain_key, 0, 10),
+                         _derive_public_keys_python(chain_key, 0, 10))
+
+    def test_format_address(self):
+        public_key = bytes(get_external_chain_key(self.eth_xpub)._key)
+        self.assertEqual(len(public_key), 65)
+        self.assertTrue(format_address(ETH, public_key).startswith('0x'))
+        with self.assertRaises(ValueError):
+            format_address('JNT', public_key)
+
+    def test_private_xpub_is_rejected(self):
+        with self.assertRaises(ValueError):
+            derive_addresses(ETH, self.eth_acct_key.to_b58check(), 0, 1)
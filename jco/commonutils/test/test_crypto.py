@@ -0,0 +1,77 @@
+import unittest
+import random
+import time
+import logging
+
+from jco.commonutils import crypto
+from jco.commonutils.crypto import (
+    FixedBaseTable,
+    HDKey,
+    HDPrivateKey,
+    PrivateKey,
+    base_point_mult,
+    bitcoin_curve,
+)
+
+
+MNEMONIC = "panel random cargo number belt faint pave dignity various glare able segment shy connect agent cruise service burst tenant space unhappy amused immune start"
+
+
+class TestFixedBaseTable(unittest.TestCase):
+    _logger = logging.getLogger('unittest')
+
+    def setUp(self):
+        self.keys = [1, 2, 255, 256, 257, bitcoin_curve.n - 1, 2 ** 255] + \
+                    [random.SystemRandom().randrange(1, bitcoin_curve.n) for _ in range(50)]
+
+    def test_multiply(self):
+        for window_bits in (4, 5, FixedBaseTable.WINDOW_BITS):
+            table = FixedBaseTable(window_bits)
+            for k in self.keys:
+                point = bitcoin_curve.public_key(k)
+                self.assertEqual(table.multiply(k), (point.x, point.y),
+                                 "k * G must match two1 result for k={}, window={}".format(k, window_bits))
+
+    def test_multiply_zero(self):
+        with self.assertRaises(ValueError):
+            FixedBaseTable().multiply(bitcoin_curve.n)
+
+    def test_derivation_matches_generic_multiplication(self):
+        master_key = HDPrivateKey.master_key_from_mnemonic(MNEMONIC)
+        acct_pub_key = HDKey.from_path(master_key, "m/44'/60'/0'")[-1].public_key
+        private_keys = [PrivateKey(k) for k in self.keys[:10]]
+
+        fast_keys = [key.public_key.compressed_bytes for key in HDKey.from_path(acct_pub_key, '0/0/1/2')]
+        fast_private_keys = [key.public_key.compressed_bytes for key in HDKey.from_path(master_key, "m/44'/60'/0'/0/5")]
+        fast_public_keys = [bytes(key.public_key) for key in private_keys]
+
+        crypto.FIXED_BASE_TABLE_ENABLED = False
+        try:
+            master_key = HDPrivateKey.master_key_from_mnemonic(MNEMONIC)
+            acct_pub_key = HDKey.from_path(master_key, "m/44'/60'/0'")[-1].public_key
+            private_keys = [PrivateKey(k) for k in self.keys[:10]]
+
+            self.assertEqual(fast_keys, [key.public_key.compressed_bytes
+                                         for key in HDKey.from_path(acct_pub_key, '0/0/1/2')])
+            self.assertEqual(fast_private_keys, [key.public_key.compressed_bytes
+                                                 for key in HDKey.from_path(master_key, "m/44'/60'/0'/0/5")])
+            self.assertEqual(fast_public_keys, [bytes(key.public_key) for key in private_keys])
+        finally:
+            crypto.FIXED_BASE_TABLE_ENABLED = True
+
+    def test_benchmark(self):
+        keys = self.keys * 4
+        base_point_mult(1)
+
+        start_time = time.time()
+        for k in keys:
+            bitcoin_curve.public_key(k)
+        generic_time = time.time() - start_time
+
+        start_time = time.time()
+        for k in keys:
+            base_point_mult(k)
+        table_time = time.time() - start_time
+
+        self._logger.info('k * G for {} keys: generic {:.3f}s, fixed-base table {:.3f}s'
+                          .format(len(keys), generic_time, table_time))
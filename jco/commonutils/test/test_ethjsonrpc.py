@@ -0,0 +1,156 @@
+import json
+import logging
+import threading
+import time
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from jco.commonutils.ethjsonrpc import EthJsonRpc, BadResponseError
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self._data = data
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """
+    Answers JSON-RPC batch in reversed order, as a node is allowed to
+    """
+    def __init__(self, results):
+        self.results = results
+        self.requests = []
+
+    def post(self, url, headers, data, **kwargs):
+        request = json.loads(data)
+        self.requests.append(request)
+        return FakeResponse([{'jsonrpc': '2.0', 'id': item['id'], 'result': self.results[item['method']]}
+                             for item in reversed(request)])
+
+
+class TestEthJsonRpcBatch(unittest.TestCase):
+    def setUp(self):
+        self.rpc = EthJsonRpc('localhost:8545')
+        self.rpc.session = FakeSession({'eth_gasPrice': '0x4a817c800',
+                                        'eth_blockNumber': '0x10',
+                                        'eth_getTransactionReceipt': None})
+
+    def test_batch_call(self):
+        results = self.rpc._batch_call([('eth_gasPrice', []), ('eth_blockNumber', None)])
+
+        self.assertEqual(results, ['0x4a817c800', '0x10'], "results must be matched by id")
+        self.assertEqual(len(self.rpc.session.requests), 1, "batch must be sent in one request")
+        self.assertEqual([item['method'] for item in self.rpc.session.requests[0]], ['eth_gasPrice', 'eth_blockNumber'])
+
+    def test_batch_receipts(self):
+        self.assertEqual(self.rpc.batch_eth_getTransactionReceipt(['0x1', '0x2']), [None, None])
+        self.assertEqual(self.rpc._batch_call([]), [])
+
+    def test_batch_error(self):
+        self.rpc.session.post = lambda url, headers, data, **kwargs: FakeResponse(
+            [{'jsonrpc': '2.0', 'id': 0, 'error': {'code': -32601, 'message': 'Method not found'}}])
+
+        with self.assertRaises(BadResponseError):
+            self.rpc._batch_call([('eth_unknown', [])])
+
+    def test_batch_item_errors(self):
+        self.rpc.session.post = lambda url, headers, data, **kwargs: FakeResponse(
+            [{'jsonrpc': '2.0', 'id': 1, 'result': {'status': '0x1'}},
+             {'jsonrpc': '2.0', 'id': 0, 'error': {'code': -32000, 'message': 'unknown transaction'}}])
+
+        receipts = self.rpc.batch_eth_getTransactionReceipt(['0x1', '0x2'], item_errors=True)
+        self.assertIsInstance(receipts[0], BadResponseError)
+        self.assertEqual(receipts[1], {'status': '0x1'}, "other results of the batch must be returned")
+
+    def test_batch_transaction_count(self):
+        self.rpc.session = FakeSession({'eth_getTransactionCount': '0x5'})
+        self.assertEqual(self.rpc.batch_eth_getTransactionCount('0xmanager', ['latest', 'pending']), [5, 5])
+        self.assertEqual([item['params'] for item in self.rpc.session.requests[0]],
+                         [['0xmanager', 'latest'], ['0xmanager', 'pending']])
+
+
+class JsonRpcStandInHandler(BaseHTTPRequestHandler):
+    """
+    Local JSON-RPC stand-in of the node, answers eth_blockNumber with keep-alive connections
+    """
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        JsonRpcStandInHandler.connections += 1
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        body = json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': '0x10'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestEthJsonRpcPool(unittest.TestCase):
+    _logger = logging.getLogger('unittest')
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), JsonRpcStandInHandler)
+        self.host = '127.0.0.1:{}'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        JsonRpcStandInHandler.connections = 0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_benchmark(self):
+        calls = 200
+
+        start_time = time.time()
+        for _ in range(calls):
+            self.assertEqual(EthJsonRpc(self.host, timeout=5).eth_blockNumber(), 16)
+        new_client_time = time.time() - start_time
+        new_client_connections = JsonRpcStandInHandler.connections
+
+        JsonRpcStandInHandler.connections = 0
+        rpc = EthJsonRpc(self.host, timeout=5)
+        start_time = time.time()
+        for _ in range(calls):
+            self.assertEqual(rpc.eth_blockNumber(), 16)
+        shared_client_time = time.time() - start_time
+
+        self._logger.info('eth_blockNumber per call: new client {:.2f}ms, shared client {:.2f}ms'
+                          .format(new_client_time * 1000 / calls, shared_client_time * 1000 / calls))
+        self.assertEqual(new_client_connections, calls)
+        self.assertEqual(JsonRpcStandInHandler.connections, 1, "shared client must keep the connection alive")
+
+    def test_threads(self):
+        rpc = EthJsonRpc(self.host, timeout=5, pool_maxsize=4)
+        results = []
+
+        def worker():
+            for _ in range(20):
+                results.append(rpc.eth_blockNumber())
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [16] * 80)
+        self.assertLessEqual(JsonRpcStandInHandler.connections, 4, "connections must be reused from the pool")
@@ -0,0 +1,99 @@
+import unittest
+
+from jco.commonutils.gas_oracle import GasPriceOracle, percentile_gas_price
+
+
+GWEI = 10 ** 9
+
+
+def make_block(*gas_prices):
+    return {'transactions': [{'gasPrice': hex(gas_price * GWEI)} for gas_price in gas_prices]}
+
+
+class FakeRpc:
+    def __init__(self, blocks, gas_price=4 * GWEI):
+        self.blocks = blocks
+        self.gas_price = gas_price
+        self.calls = 0
+        self.fail = False
+
+    def eth_blockNumber(self):
+        if self.fail:
+            raise ConnectionError("node is down")
+        return len(self.blocks) - 1
+
+    def batch_eth_getBlockByNumber(self, blocks, tx_objects=True):
+        self.calls += 1
+        return [self.blocks[block] for block in blocks]
+
+    def eth_gasPrice(self):
+        return self.gas_price
+
+
+class TestGasPriceOracle(unittest.TestCase):
+    def make_oracle(self, rpc, ttl=60):
+        return GasPriceOracle(rpc, block_count=3, percentile=60, ttl=ttl,
+                              min_price=1 * GWEI, max_price=50 * GWEI, fallback_multiplier=1.5)
+
+    def test_percentile(self):
+        blocks = [make_block(5, 1, 3), None, make_block(2, 4)]
+        self.assertEqual(percentile_gas_price(blocks, 60), 3 * GWEI)
+        self.assertEqual(percentile_gas_price(blocks, 100), 5 * GWEI)
+        self.assertEqual(percentile_gas_price(blocks, 0), 1 * GWEI)
+        self.assertIsNone(percentile_gas_price([make_block()], 60))
+
+    def test_sample_recent_blocks(self):
+        rpc = FakeRpc([make_block(90, 90), make_block(10, 20), make_block(30), make_block(40, 50)])
+        self.assertEqual(self.make_oracle(rpc).sample(), 30 * GWEI, "only last 3 blocks must be sampled")
+
+    def test_sample_limits(self):
+        self.assertEqual(self.make_oracle(FakeRpc([make_block(90)])).sample(), 50 * GWEI)
+        self.assertEqual(self.make_oracle(FakeRpc([make_block()])).sample(), 6 * GWEI,
+                         "node gas price with the multiplier must be used for empty blocks")
+
+    def test_cache(self):
+        rpc = FakeRpc([make_block(10), make_block(20)])
+        oracle = self.make_oracle(rpc)
+        self.assertEqual([oracle.get_gas_price() for _ in range(10)], [20 * GWEI] * 10)
+        self.assertEqual(rpc.calls, 1, "price must be served from memory within the TTL")
+
+    def test_expired_cache(self):
+        rpc = FakeRpc([make_block(10)])
+        oracle = self.make_oracle(rpc, ttl=0)
+        self.assertEqual(oracle.get_gas_price(), 10 * GWEI)
+
+        rpc.blocks = [make_block(10), make_block(15)]
+        self.assertEqual(oracle.get_gas_price(), 15 * GWEI)
+        self.assertEqual(rpc.calls, 2)
+
+        rpc.fail = True
+        self.assertEqual(oracle.get_gas_price(), 15 * GWEI, "previous price must be served if the node fails")
+
+    def test_retry_after_failure(self):
+        rpc = FakeRpc([make_block(10)])
+        oracle = self.make_oracle(rpc, ttl=60)
+        self.assertEqual(oracle.get_gas_price(), 10 * GWEI)
+
+        oracle._updated -= 60
+        rpc.fail = True
+        self.assertEqual(oracle.get_gas_price(), 10 * GWEI)
+
+        rpc.fail = False
+        rpc.blocks = [make_block(10), make_block(20)]
+        self.assertEqual(oracle.get_gas_price(), 20 * GWEI, "sampling must be retried after the failure")
+        self.assertEqual(rpc.calls, 2)
+
+    def test_replacement_gas_price(self):
+        oracle = self.make_oracle(FakeRpc([make_block(10)]))
+        self.assertEqual(oracle.get_replacement_gas_price(20 * GWEI, 1.125), 22.5 * GWEI)
+        self.assertEqual(oracle.get_replacement_gas_price(4 * GWEI, 1.125), 10 * GWEI,
+                         "oracle price must be used if it is above the bumped one")
+        self.assertEqual(oracle.get_replacement_gas_price(44 * GWEI, 1.125), 495 * GWEI // 10)
+        self.assertIsNone(oracle.get_replacement_gas_price(50 * GWEI, 1.125),
+                          "replacement must not be priced above the max price")
+
+    def test_no_price(self):
+        rpc = FakeRpc([make_block(10)])
+        rpc.fail = True
+        with self.assertRaises(ConnectionError):
+            self.make_oracle(rpc).get_gas_price()
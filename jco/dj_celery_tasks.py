@@ -49,7 +49,23 @@ def celery_scan_btc_addresses_wo_transactions_odd():
 @initialize_app
 @locked_task()
 def calculate_jnt_purchases():
-    return commands.calculate_jnt_purchases()
+    result = commands.calculate_jnt_purchases()
+    api_tasks.refresh_raised_tokens_cache_runner()
+    return result
+
+
+@celery_app.task()
+@initialize_app
+@locked_task()
+def celery_dispatch_outbox_events():
+    return commands.dispatch_outbox_events()
+
+
+@celery_app.task()
+@initialize_app
+@locked_task()
+def celery_replenish_address_pool():
+    return commands.replenish_address_pool()
 
 
 @celery_app.task()
@@ -87,6 +103,20 @@ def celery_withdraw_processing():
     return commands.withdraw_processing()
 
 
+@celery_app.task()
+@initialize_app
+@locked_task()
+def celery_sign_withdraws():
+    return commands.sign_withdraws()
+
+
+@celery_app.task()
+@initialize_app
+@locked_task()
+def celery_confirm_withdraws_by_logs():
+    return commands.confirm_withdraws_by_logs()
+
+
 @celery_app.task()
 @initialize_app
 @locked_task()
@@ -131,6 +161,10 @@ def setup_periodic_tasks(sender, **kwargs):
 
     sender.add_periodic_task(crontab(minute='*/5'),
                              calculate_jnt_purchases, expires=5 * 60, name='calculate_jnt_purchases')
+    sender.add_periodic_task(20.0,
+                             celery_dispatch_outbox_events, expires=1 * 60, name='celery_dispatch_outbox_events')
+    sender.add_periodic_task(crontab(minute='*/5'),
+                             celery_replenish_address_pool, expires=5 * 60, name='celery_replenish_address_pool')
     sender.add_periodic_task(crontab(minute='*/1'),
                              celery_fetch_tickers_price, expires=1 * 60, name='fetch_tickers_price')
     sender.add_periodic_task(crontab(minute='*/10'),
@@ -138,9 +172,13 @@ def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(crontab(minute='*/10'),
                              celery_scan_affiliates, expires=5 * 60, name='celery_scan_affiliates')
     sender.add_periodic_task(30.0,
+                             celery_sign_withdraws, expires=1 * 60, name='celery_sign_withdraws')
+    sender.add_periodic_task(10.0,
                              celery_withdraw_processing, expires=1 * 60, name='celery_withdraw_processing')
     sender.add_periodic_task(10.0,
-                             celery_check_withdraw_transactions, expires=1 * 60, name='celery_check_withdraw_transactions')
+                             celery_confirm_withdraws_by_logs, expires=1 * 60, name='celery_confirm_withdraws_by_logs')
+    sender.add_periodic_task(crontab(minute='*/5'),
+                             celery_check_withdraw_transactions, expires=5 * 60, name='celery_check_withdraw_transactions')
 
 
     sender.add_periodic_task(20,
@@ -151,6 +189,10 @@ def setup_periodic_tasks(sender, **kwargs):
                              api_tasks.process_all_notifications_runner,
                              expires=1 * 60,
                              name='process_all_notifications')
+    sender.add_periodic_task(60,
+                             api_tasks.refresh_raised_tokens_cache_runner,
+                             expires=1 * 60,
+                             name='refresh_raised_tokens_cache_runner')
     sender.add_periodic_task(20,
                              api_tasks.retry_uncomplete_verifications,
                              expires=1 * 60,
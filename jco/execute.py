@@ -1,3 +1,4 @@
+import os
 from typing import Optional
 
 import click
@@ -31,6 +32,19 @@ def generate_btc_addresses(mnemonic, key_count, offset, is_usable):
     return commands.generate_btc_addresses(mnemonic, key_count, offset=offset, is_usable=is_usable)
 
 
+@app.cli.command()
+@initialize_app
+def replenish_address_pool():
+    return commands.replenish_address_pool()
+
+
+@app.cli.command()
+@click.option('--processes', help='Number of signing processes', type=click.INT, default=os.cpu_count() or 1)
+@initialize_app
+def sign_withdraws(processes):
+    return commands.sign_withdraws(processes=processes)
+
+
 @app.cli.command()
 @initialize_app
 def fetch_tickers_price():
@@ -175,10 +175,12 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'jco.api.authentication.CachedTokenAuthentication',
     ),
 }
 
+AUTH_TOKEN__CACHE_TTL = 60
+
 REST_AUTH_SERIALIZERS = {
     'LOGIN_SERIALIZER': 'jco.api.serializers.LoginSerializer',
     'PASSWORD_RESET_SERIALIZER': 'jco.api.serializers.CustomPasswordResetSerializer',
@@ -188,7 +190,27 @@ REST_AUTH_REGISTER_SERIALIZERS = {
     'REGISTER_SERIALIZER': 'jco.api.serializers.RegisterSerializer',
 }
 
+# Shared memcached cache of all uWSGI processes and celery workers,
+# local memory cache (tests, development) if location is not configured.
+# Values written through by other processes don't reach the local cache, they are cached for a limited time
+CACHE_LOCATION = os.getenv('CACHE_LOCATION')
+CACHE_IS_SHARED = bool(CACHE_LOCATION)
+if CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': CACHE_LOCATION.split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_EXPOSE_HEADERS = ('Link', 'ETag')
 
 ONFIDO_API_KEY = os.getenv('ONFIDO_API_KEY')
 
@@ -206,6 +228,9 @@ ACCOUNT_EMAIL_CONFIRMATION_COOLDOWN = 20
 OLD_PASSWORD_FIELD_ENABLED = True
 
 RAISED_TOKENS_SHIFT = 100000000
+RAISED_TOKENS__CACHE_KEY = 'raised_tokens'
+# Refreshed by the celery task and admin actions in the shared cache, expires in the local one
+RAISED_TOKENS__CACHE_TTL = None if CACHE_IS_SHARED else 20
 TOKENS__TOTAL_SUPPLY = 200000000
 
 GA_ID = os.environ['GA_ID']
@@ -214,6 +239,22 @@ WITHDRAW_AVAILABLE_SINCE = datetime(2017, 12, 15, 12)
 
 COUNTRIES_NOT_ALLOWED = ['USA']
 
+TRANSACTIONS_LIST__PAGE_SIZE = 100
+TRANSACTIONS_LIST__MAX_PAGE_SIZE = 500
+
+# Server-sent events stream of user deposits, JNT and withdraws,
+# stream is closed after the duration and client reconnects after the retry delay
+USER_EVENTS__STREAM_DURATION = 55
+USER_EVENTS__HEARTBEAT_INTERVAL = 15
+USER_EVENTS__RETRY_MS = 1000
+# Events are fanned out to the streams of the process from one LISTEN connection,
+# a stream of a slow client drops events above the queue size
+USER_EVENTS__QUEUE_SIZE = 100
+USER_EVENTS__RECONNECT_DELAY = 5
+# EventSource can't send the Authorization header, the stream is authenticated by the signed token
+# in the query string, valid for this time (seconds)
+USER_EVENTS__TOKEN_TTL = 60
+
 #######################################################################
 #
 #             LEGACY SETTINGS
@@ -240,6 +281,30 @@ EMAIL_NOTIFICATIONS__BACKUP_ADDRESS = 'salebackup@jibrel.network'
 EMAIL_NOTIFICATIONS__SUPPORT_ADDRESS = 'support@jibrel'
 EMAIL_NOTIFICATIONS__MAX_ATTEMPTS = 3
 EMAIL_NOTIFICATIONS__SENDGRID_DOMAINS = ["yahoo", "sina.cn", "increw.com.au", "moeboard.net", "hanmail.net", "daum.net"]
+# Unsent notifications are claimed by batches and sent in a pool of threads,
+# a claim not released for the timeout (seconds) is taken by the next dispatcher run
+EMAIL_NOTIFICATIONS__BATCH_SIZE = 1000
+EMAIL_NOTIFICATIONS__SEND_THREADS = 8
+EMAIL_NOTIFICATIONS__CLAIM_TIMEOUT = 10 * 60
+# Failed notification is sent again after exponential delay (seconds) with jitter,
+# the attempts cover 1.5-3 days of the provider outage before the notification is dropped
+EMAIL_NOTIFICATIONS__RETRY_DELAY = 30
+EMAIL_NOTIFICATIONS__RETRY_MAX_DELAY = 6 * 60 * 60
+EMAIL_NOTIFICATIONS__RETRY_MAX_ATTEMPTS = 20
+
+# Outbox of JNT pipeline side effects
+OUTBOX__BATCH_SIZE = 100
+OUTBOX__MAX_ATTEMPTS = 5
+
+# Deposit address pool, replenished from account-level xpubs (m/44'/60'/0' and m/44'/0'/0')
+ADDRESS_POOL__ETH_XPUB = os.getenv('ADDRESS_POOL_ETH_XPUB', '')
+ADDRESS_POOL__BTC_XPUB = os.getenv('ADDRESS_POOL_BTC_XPUB', '')
+ADDRESS_POOL__MIN_FREE = 1000
+ADDRESS_POOL__BATCH_SIZE = 1000
+
+# Derivation of generated addresses, libsecp256k1 is used if `coincurve` is installed
+ADDRESS_DERIVATION__PROCESSES = os.cpu_count() or 1
+ADDRESS_DERIVATION__CHUNK_SIZE = 1000
 
 # Force scanning address
 FORCE_SCANNING_ADDRESS__ENABLED = True
@@ -249,6 +314,8 @@ FORCE_SCANNING_ADDRESS__EMAIL_RECIPIENT = 'Jibrel Presale <presale@jibrel.networ
 MAILGUN__API_KEY = os.getenv('MAILGUN_API_KEY', '')
 MAILGUN__API_MESSAGES_URL = "https://api.mailgun.net/v3/mailgun.jibrel.network/messages"
 MAILGUN__API_EVENTS_URL = "https://api.mailgun.net/v3/mailgun.jibrel.network/events"
+# Notifications of the same type are sent in one request to this count of recipients
+MAILGUN__BATCH_SIZE = 1000
 
 # SendGrid API
 SENDGRID__API_MESSAGES_URL = "https://api.sendgrid.com/api/mail.send.json"
@@ -285,13 +352,35 @@ LOGIN_REDIRECT_URL = '/'
 
 # Ethereum settings
 ETH_NODE__ADDRESS = os.getenv('ETH_NODE_ADDRESS', '')
+# Max count of methods in JSON-RPC batch request
+ETH_NODE__BATCH_SIZE = 100
+# Connect and read timeouts (seconds) and max count of keep-alive connections of the node client
+ETH_NODE__TIMEOUT = (3.05, 30)
+ETH_NODE__POOL_SIZE = 10
 ETH_NETWORK__ID = int(os.getenv('ETH_NETWORK_ID', 3))
 ETH_MANAGER__PRIVATE_KEY = os.getenv('ETH_MANAGER_PRIVATE_KEY', '')
 ETH_MANAGER__ADDRESS = os.getenv('ETH_MANAGER_ADDRESS', '')
 ETH_CONTRACT__ADDRESS = os.getenv('ETH_CONTRACT_ADDRESS', '')
 ETH_CONTRACT__GAS_LIMIT = 1000000
-ETH_CONTRACT__MAX_PENDING_COUNT = 1
+ETH_CONTRACT__MAX_PENDING_COUNT = int(os.getenv('ETH_CONTRACT_MAX_PENDING_COUNT', 10))
+# Pending withdraw transaction not mined for this time (seconds) is broadcasted again with the same nonce
+ETH_NONCE__STUCK_TIMEOUT = 30 * 60
+# Gas price of the broadcast again transaction is bumped at least by this multiplier, nodes reject lower replacements
+ETH_NONCE__REPLACEMENT_GAS_BUMP = 1.125
+# Nonce abandoned by withdraws below the allocated ones is used by a transaction without value to the manager address
+ETH_NONCE__FILLER_GAS_LIMIT = 21000
+# Withdraws are confirmed by JNT Transfer logs of blocks with this count of confirmations
+ETH_WITHDRAW_LOGS__CONFIRMATIONS = 1
+ETH_WITHDRAW_LOGS__MAX_BLOCK_RANGE = 5000
+# First scan starts this count of blocks back from the last block
+ETH_WITHDRAW_LOGS__INITIAL_DEPTH = 10000
 ETH_CONTRACT__GAZ_MULTIPLICATOR = 1.2
+# Gas price of withdraws is the percentile of gas prices in the recent blocks, sampled again after the TTL (seconds)
+GAS_ORACLE__BLOCK_COUNT = 20
+GAS_ORACLE__PERCENTILE = 60
+GAS_ORACLE__TTL = 60
+GAS_ORACLE__MIN_PRICE = 1 * 10 ** 9
+GAS_ORACLE__MAX_PRICE = int(os.getenv('GAS_ORACLE_MAX_PRICE', 100 * 10 ** 9))
 ETH_CONTRACT__ABI = b'[{"constant": false, ' \
                     b'  "inputs": [{"name": "_account", "type": "address"},' \
                     b'             {"name": "_value", "type": "uint256"}], ' \
@@ -302,6 +391,22 @@ ETH_CONTRACT__ABI = b'[{"constant": false, ' \
                     b'             {"name": "_value", "type": "uint256"}], ' \
                     b'  "name": "transfer", "outputs": [{"name": "", "type": "bool"}], "payable": false,' \
                     b'  "type": "function"}]'
+# Multi-transfer contract sends JNT of the manager to several withdraw addresses in one transaction,
+# withdraws are sent one by one if the address is not set.
+# Withdraws are confirmed by Transfer logs from the manager (transferFrom with the allowance of the manager)
+# or from the contract itself (JNT held by the contract)
+ETH_MULTI_TRANSFER__ADDRESS = os.getenv('ETH_MULTI_TRANSFER_ADDRESS', '')
+ETH_MULTI_TRANSFER__BATCH_SIZE = 50
+ETH_MULTI_TRANSFER__BASE_GAS = 50000
+ETH_MULTI_TRANSFER__GAS_PER_TRANSFER = 40000
+ETH_MULTI_TRANSFER__ABI = b'[{"constant": false, ' \
+                          b'  "inputs": [{"name": "_to", "type": "address[]"},' \
+                          b'             {"name": "_values", "type": "uint256[]"}], ' \
+                          b'  "name": "multiTransfer", "outputs": [{"name": "", "type": "bool"}], "payable": false,' \
+                          b'  "type": "function"}]'
+# Withdraw transactions are signed ahead of the broadcast in a pool of this count of processes,
+# a celery worker of the prefork pool is daemonic and signs in its own process
+ETH_WITHDRAW_SIGNING__PROCESSES = int(os.getenv('ETH_WITHDRAW_SIGNING_PROCESSES', 1))
 
 # Blockchain explorers
 ETHERSCAN_API_KEY = os.getenv('ETHERSCAN_API_KEY', '')
@@ -0,0 +1,17 @@
+"""
+WSGI config of the user events streams, served by the gevent instance of uWSGI (uwsgi-events.yml).
+
+Streams wait on greenlets instead of the worker threads, psycopg2 is patched to be cooperative.
+"""
+
+import os
+
+from psycogreen.gevent import patch_psycopg
+
+from django.core.wsgi import get_wsgi_application
+
+patch_psycopg()
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "jco.settings")
+
+application = get_wsgi_application()